@@ -1 +1,6 @@
+import time
+
 __version__ = '0.7.12'
+
+# When the package started importing; the import span of --trace
+IMPORT_STARTED = time.perf_counter()
@@ -1,7 +1,19 @@
 """Audit LDAP Permissions."""
+import csv
+import json
+import os
+import sys
+from collections import defaultdict
+from itertools import combinations
+
 import click
+from ldap3.utils.conv import escape_filter_chars
 
+import ldap_tools.exceptions
 from ldap_tools.client import Client
+from ldap_tools.history import History
+from ldap_tools.history import parse_time
+from ldap_tools.ldif import write_entry
 
 
 class API:
@@ -49,9 +61,83 @@ class API:
             ]
         return group_membership
 
-    def raw(self):  # pragma: no cover
-        """Dump contents of LDAP directory to console."""
-        return self.client.search(None)
+    def user(self, username):
+        """
+        Display group membership of a single user.
+
+        Uses an equality filter on memberUid, so the cost does not depend
+        on the number of users and groups in the directory.
+
+        Returns:
+            Dictionary with the user's group membership.
+                For example: {'test.user': ['testgroup', 'testgroup2']}
+
+        """
+        filter = [
+            '(objectclass=posixGroup)',
+            '(memberUid={})'.format(escape_filter_chars(username))
+        ]
+        results = self.client.search(filter, ['cn'])
+        return {username: sorted(i.cn.value for i in results)}
+
+    def group(self, group):
+        """
+        Display membership of a single group.
+
+        Returns:
+            Dictionary with the group's members.
+                For example: {'testgroup': ['test.user', 'test.user2']}
+
+        Raises:
+            ldap_tools.exceptions.NoGroupsFound:
+                No Groups were returned by LDAP
+
+        """
+        filter = [
+            '(objectclass=posixGroup)',
+            '(cn={})'.format(escape_filter_chars(group))
+        ]
+        results = self.client.search(filter, ['cn', 'memberUid'])
+        if len(results) < 1:
+            raise ldap_tools.exceptions.NoGroupsFound(
+                'Group ({}) not found'.format(group))
+        return {
+            record.cn.value: sorted(record.memberUid.values)
+            for record in results
+        }
+
+    def matrix(self):
+        """
+        Build a user by group membership matrix from one search.
+
+        Returns:
+            MembershipMatrix covering every user and every group
+
+        """
+        filter = ['(|(objectclass=posixAccount)(objectclass=posixGroup))']
+        results = self.client.search(filter,
+                                     ['objectClass', 'uid', 'cn', 'memberUid'])
+        users = []
+        membership = {}
+        for record in results:
+            if 'posixGroup' in record.objectClass.values:
+                membership[record.cn.value] = record.memberUid.values
+            else:
+                users.append(record.uid.value)
+        return MembershipMatrix(membership, users)
+
+    def raw(self, workers=None):  # pragma: no cover
+        """
+        Stream the contents of the LDAP directory.
+
+        Args:
+            workers: concurrent connections (see Client#sharded_stream)
+
+        Returns:
+            A generator of ldap3 response dictionaries
+
+        """
+        return self.client.sharded_stream(None, workers=workers)
 
     def __get_groups_with_membership(self):  # pragma: no cover
         """Get group membership."""
@@ -68,6 +154,124 @@ class API:
             yield result.uid.value
 
 
+class MembershipMatrix:
+    """
+    Sparse user by group membership matrix.
+
+    Each group is one row, stored as a bitset (a Python int) with bit i set
+    when users[i] is a member, so intersections, unions and subset checks
+    between two groups are single word-parallel integer operations.
+    """
+
+    def __init__(self, membership, users=()):
+        """
+        Initialize MembershipMatrix.
+
+        Args:
+            membership: dictionary of group name to list of member names
+            users: names of users to include even if they have no groups
+
+        """
+        members = set(users)
+        for values in membership.values():
+            members.update(values)
+        self.users = sorted(members)
+        self.groups = sorted(membership)
+
+        column = {user: i for i, user in enumerate(self.users)}
+        self.rows = []
+        for group in self.groups:
+            row = 0
+            for user in membership[group]:
+                row |= 1 << column[user]
+            self.rows.append(row)
+        self.sizes = [MembershipMatrix.__popcount(row) for row in self.rows]
+
+        # Groups of each user, so only groups sharing a member are compared
+        self.__columns = defaultdict(list)
+        for i, group in enumerate(self.groups):
+            for user in membership[group]:
+                self.__columns[column[user]].append(i)
+
+    def overlaps(self, threshold=0.0):
+        """
+        Pairwise Jaccard overlap of groups sharing at least one member.
+
+        Args:
+            threshold: minimum Jaccard index to report
+
+        Returns:
+            List of dictionaries with 'groups', 'shared', 'jaccard' and
+            'relation' keys, most similar pairs first.  relation describes
+            the first group against the second: 'equal', 'subset',
+            'superset' or None.
+
+        """
+        pairs = set()
+        for groups in self.__columns.values():
+            pairs.update(combinations(sorted(set(groups)), 2))
+
+        results = []
+        for a, b in pairs:
+            shared = MembershipMatrix.__popcount(self.rows[a] & self.rows[b])
+            jaccard = shared / (self.sizes[a] + self.sizes[b] - shared)
+            if jaccard < threshold:
+                continue
+            results.append({
+                'groups': [self.groups[a], self.groups[b]],
+                'shared': shared,
+                'jaccard': round(jaccard, 4),
+                'relation': self.__relation(a, b, shared)
+            })
+        results.sort(key=lambda i: (-i['jaccard'], i['groups']))
+        return results
+
+    def user_counts(self):
+        """Return the number of groups each user belongs to."""
+        counts = {user: 0 for user in self.users}
+        for i, groups in self.__columns.items():
+            counts[self.users[i]] = len(set(groups))
+        return counts
+
+    def export(self, FILE, format='json', threshold=0.0):
+        """
+        Write group sizes, overlaps and per-user group counts.
+
+        Args:
+            FILE: writable text file
+            format: 'json' for everything, or 'csv' for overlaps only
+
+        """
+        overlaps = self.overlaps(threshold)
+        if format == 'csv':
+            writer = csv.writer(FILE)
+            writer.writerow(['group_a', 'group_b', 'shared', 'jaccard',
+                             'relation'])
+            for i in overlaps:
+                writer.writerow(i['groups'] + [
+                    i['shared'], i['jaccard'], i['relation'] or ''
+                ])
+        else:
+            json.dump({
+                'groups': dict(zip(self.groups, self.sizes)),
+                'overlaps': overlaps,
+                'user_counts': self.user_counts()
+            }, FILE, indent=2, sort_keys=True)
+            FILE.write('\n')
+
+    def __relation(self, a, b, shared):
+        if shared == self.sizes[a] == self.sizes[b]:
+            return 'equal'
+        elif shared == self.sizes[a]:
+            return 'subset'
+        elif shared == self.sizes[b]:
+            return 'superset'
+        return None
+
+    def __popcount(row):
+        return bin(row).count('1')
+
+
 class CLI:
     """Commands to audit LDAP permissions."""
 
@@ -96,13 +300,136 @@ class CLI:
         CLI.parse_membership('Users by Group', audit_api.by_group())
 
     @audit.command()
+    @click.argument('username')
     @click.pass_obj
-    def raw(config):  # pragma: no cover
-        """Dump the contents of LDAP to console in raw format."""
+    def user(config, username):
+        """Display the groups a single user belongs to."""
         client = Client()
         client.prepare_connection()
         audit_api = API(client)
-        print(audit_api.raw())
+        CLI.parse_membership('Groups of User', audit_api.user(username))
+
+    @audit.command()
+    @click.argument('group')
+    @click.pass_obj
+    def group(config, group):
+        """Display the members of a single group."""
+        client = Client()
+        client.prepare_connection()
+        audit_api = API(client)
+        try:
+            CLI.parse_membership('Users in Group', audit_api.group(group))
+        except ldap_tools.exceptions.NoGroupsFound as err:
+            sys.exit(err.args[0])
+
+    @audit.command()
+    @click.option(
+        '--format',
+        '-f',
+        type=click.Choice(['json', 'csv']),
+        default='json',
+        show_default=True,
+        help='json for all results, csv for group overlaps only')
+    @click.option(
+        '--threshold',
+        '-t',
+        default=0.0,
+        show_default=True,
+        help='Minimum Jaccard overlap between two groups to report')
+    @click.option(
+        '--output', '-o', type=click.File('w'), default='-',
+        help='File to write to (default: stdout)')
+    @click.pass_obj
+    def matrix(config, format, threshold, output):
+        """Export group overlap and per-user group counts."""
+        client = Client()
+        client.prepare_connection()
+        audit_api = API(client)
+        audit_api.matrix().export(output, format, threshold)
+
+    @audit.command()
+    @click.option(
+        '--path',
+        '-p',
+        help='History directory (default: $LDAP_CONFIG_DIR/history)')
+    @click.pass_obj
+    def snapshot(config, path):
+        """Record current group membership in the history."""
+        client = Client()
+        client.prepare_connection()
+        audit_api = API(client)
+        history = History(CLI.history_path(client, path))
+        if not history.snapshot(audit_api.by_group()):
+            print('Membership unchanged since the last snapshot.')
+
+    @audit.command()
+    @click.argument('date')
+    @click.option('--group', '-g', help='Only show this group')
+    @click.option(
+        '--path',
+        '-p',
+        help='History directory (default: $LDAP_CONFIG_DIR/history)')
+    @click.pass_obj
+    def at(config, date, group, path):
+        """Display group membership as of DATE (YYYY-MM-DD[THH:MM:SS])."""
+        try:
+            time = parse_time(date)
+        except ldap_tools.exceptions.ArgumentError as err:
+            sys.exit(err.args[0])
+        membership = History(CLI.history_path(Client(), path)).at(time)
+        if membership is None:
+            sys.exit('No snapshot found before {}'.format(time))
+        if group is not None:
+            membership = {group: membership.get(group, [])}
+        CLI.parse_membership('Users by Group at {}'.format(time), membership)
+
+    @audit.command()
+    @click.argument('start')
+    @click.argument('end')
+    @click.option('--group', '-g', help='Only show this group')
+    @click.option(
+        '--path',
+        '-p',
+        help='History directory (default: $LDAP_CONFIG_DIR/history)')
+    @click.pass_obj
+    def changes(config, start, end, group, path):
+        """Display membership changes between START and END."""
+        try:
+            start, end = parse_time(start), parse_time(end)
+        except ldap_tools.exceptions.ArgumentError as err:
+            sys.exit(err.args[0])
+        history = History(CLI.history_path(Client(), path))
+        membership = {}
+        for name, change in history.changes(start, end).items():
+            if group is None or name == group:
+                membership[name] = ['+ {}'.format(i) for i in change['added']
+                                    ] + ['- {}'.format(i)
+                                         for i in change['removed']]
+        CLI.parse_membership('Changes from {} to {}'.format(start, end),
+                             membership)
+
+    @audit.command()
+    @click.option(
+        '--workers',
+        '-w',
+        type=int,
+        help='Concurrent connections; default: scan_workers from config')
+    @click.pass_obj
+    def raw(config, workers):  # pragma: no cover
+        """Dump the contents of LDAP to console as LDIF."""
+        client = Client()
+        client.prepare_connection()
+        audit_api = API(client)
+        FILE = sys.stdout.buffer
+        for response in audit_api.raw(workers):
+            write_entry(FILE, response['dn'], response['raw_attributes'])
+        FILE.flush()
+
+    def history_path(client, path):
+        """Return the history directory, defaulting to the config dir."""
+        if path is None:
+            path = os.path.join(client.config_dir, 'history')
+        return path
 
     def parse_membership(header_string, membership):  # pragma: no cover
         """Print membership for #by_group and #by_user."""
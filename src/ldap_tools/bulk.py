@@ -0,0 +1,208 @@
+"""Bounded Concurrent LDAP Operations."""
+import os
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+import ldap3
+
+DEFAULT_WORKERS = 4
+
+
+def check(client, succeeded):
+    """
+    Raise the ldap3 exception matching a failed operation.
+
+    Connections are not created with raise_exceptions, so add, modify and
+    delete report failure by returning False.  This turns that into the
+    same exception ldap3 would have raised (e.g. LDAPEntryAlreadyExistsResult).
+
+    Args:
+        client: the Client that ran the operation
+        succeeded: return value of the operation
+
+    """
+    if succeeded is False:
+        result = client.result
+        raise ldap3.core.exceptions.LDAPOperationResult(
+            result=result['result'],
+            description=result['description'],
+            dn=result['dn'],
+            message=result['message'],
+            response_type=result['type'])
+    return succeeded
+
+
+class Executor:
+    """Run LDAP operations concurrently with bounded parallelism."""
+
+    def __init__(self, client, workers=DEFAULT_WORKERS):
+        """
+        Initialize Executor.
+
+        Args:
+            client: a connected Client. Worker threads use copies of it
+                (see Client#spawn), one connection per thread.
+            workers: maximum number of operations in flight
+
+        """
+        self.client = client
+        self.workers = max(1, workers)
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__spawned = []
+
+    def results(self, func, items, journal=None):
+        """
+        Call func(client, item) for every item.
+
+        Items are consumed lazily, so at most `workers` of them are held in
+        flight at a time no matter how long the iterable is.
+
+        Args:
+            journal: Journal (optional); items it already lists are
+                skipped, and items that succeed are recorded in it
+
+        Returns:
+            A generator of (item, result, error) tuples in completion order.
+            error is None on success, or the exception raised by func.
+
+        """
+        if journal is None:
+            yield from self.__results(func, items)
+            return
+        for item, result, error in self.__results(
+                func, (i for i in items if i not in journal)):
+            if error is None:
+                journal.record(item)
+            yield item, result, error
+
+    def __results(self, func, items):
+        if self.workers == 1:
+            for item in items:
+                yield Executor.__call(func, self.client, item)
+            return
+
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            pending = deque()
+            items = iter(items)
+            for item in items:
+                pending.append(pool.submit(self.__work, func, item))
+                if len(pending) >= self.workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                        yield future.result()
+            for future in pending:
+                yield future.result()
+        finally:
+            pool.shutdown(wait=True)
+            self.close()
+
+    def run(self, func, items, journal=None):
+        """
+        Call func(client, item) for every item.
+
+        Args:
+            journal: Journal of items to skip and record (optional)
+
+        Returns:
+            List of (item, error) tuples for the items that failed
+
+        """
+        return [(item, error)
+                for item, result, error in self.results(func, items, journal)
+                if error is not None]
+
+    def close(self):
+        """Unbind the connections opened for worker threads."""
+        with self.__lock:
+            spawned, self.__spawned = self.__spawned, []
+        for client in spawned:
+            if client is not self.client:  # a pooled client spawns itself
+                client.close()
+        self.__local = threading.local()
+
+    def __work(self, func, item):
+        client = getattr(self.__local, 'client', None)
+        if client is None:
+            client = self.client.spawn()
+            self.__local.client = client
+            with self.__lock:
+                self.__spawned.append(client)
+        return Executor.__call(func, client, item)
+
+    def __call(func, client, item):
+        try:
+            return (item, func(client, item), None)
+        except Exception as err:
+            return (item, None, err)
+
+
+class Journal:
+    """
+    Progress journal of a bulk operation, so a rerun skips finished items.
+
+    Each item that succeeds is appended as one line (its key) and flushed
+    right away, so the journal survives the process dying halfway.
+    """
+
+    def __init__(self, filename, key=str, resume=False):
+        """
+        Initialize Journal.
+
+        Args:
+            filename: journal file, e.g. the input file name + '.journal'
+            key: callable giving the one-line key of an item, e.g. the
+                username of a user to create. The key must change when
+                the operation does, or an edited input is skipped.
+            resume: keep the items recorded by a previous run; otherwise
+                the journal starts empty
+
+        """
+        self.filename = filename
+        self.key = key
+        self.__done = set()
+        if resume and os.path.exists(filename):
+            with open(filename, 'r') as FILE:
+                self.__done.update(line.rstrip('\n') for line in FILE
+                                   if line.strip())
+        self.__file = open(filename, 'a' if resume else 'w')
+        self.__lock = threading.Lock()
+
+    def __contains__(self, item):
+        """Whether item was recorded, in this run or a previous one."""
+        return self.recorded(self.key(item))
+
+    def recorded(self, key):
+        """Whether an item with this key was recorded."""
+        return key in self.__done
+
+    def __len__(self):
+        """Number of items recorded."""
+        return len(self.__done)
+
+    def record(self, item):
+        """Record that item succeeded."""
+        key = self.key(item)
+        with self.__lock:
+            if key in self.__done:
+                return
+            self.__done.add(key)
+            self.__file.write('{}\n'.format(key))
+            self.__file.flush()
+
+    def close(self, finished=False):
+        """
+        Close the journal file.
+
+        Args:
+            finished: every item succeeded, so the journal is removed
+
+        """
+        self.__file.close()
+        if finished and os.path.exists(self.filename):
+            os.remove(self.filename)
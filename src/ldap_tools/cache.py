@@ -0,0 +1,171 @@
+"""LDAP Search Result Cache."""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from ldap3.utils.dn import to_dn
+
+DEFAULT_SIZE = 1024
+DEFAULT_TTL = 60
+
+# One comparison in an LDAP filter, e.g. (uid=test.user) or (uidNumber>=10)
+FILTER_ITEM = re.compile(r'\(([^()=<>~!&|]+)(?:=|>=|<=|~=)([^()]*)\)')
+# The attribute name of each comparison, e.g. uid in (uid=test.user)
+FILTER_ATTRIBUTE = re.compile(r'\(([^()=<>~!&|]+)(?==|>=|<=|~=)')
+
+
+def normalize_dn(dn):
+    """Comparable form of a DN."""
+    return ','.join(i.strip() for i in to_dn(dn)).lower()
+
+
+class SearchCache:
+    """
+    LRU cache of search results with a time to live.
+
+    Writes invalidate only the results they can affect: results holding
+    the modified or deleted entry, results whose filter tests a modified
+    attribute, and results whose filter could match an added entry's
+    object classes.  Methods are thread safe, so spawned clients can share
+    one cache.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        """
+        Initialize SearchCache.
+
+        Args:
+            size: maximum number of cached searches
+            ttl: seconds a result is served for
+
+        """
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def key(self, base, filter, attributes):
+        """
+        Cache key for a search; filter is a list of filter strings.
+
+        Attribute names and the base are compared without case, filter
+        values as given, since some attributes (e.g. memberUid) match
+        case-exactly.
+        """
+        return (base.lower(),
+                tuple(sorted(SearchCache.__normalize(i) for i in filter)),
+                tuple(sorted(i.lower() for i in attributes)))
+
+    def get(self, key):
+        """Return cached entries, or None on a miss."""
+        with self.__lock:
+            cached = self.__entries.get(key)
+            if cached is not None and cached['expires'] > time.monotonic():
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return list(cached['entries'])
+            if cached is not None:
+                del self.__entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, filter, entries):
+        """Cache the entries found by a search."""
+        attributes, classes = SearchCache.__analyze(filter)
+        with self.__lock:
+            self.__entries[key] = {
+                'expires': time.monotonic() + self.ttl,
+                'entries': list(entries),
+                'dns': {normalize_dn(i.entry_dn) for i in entries},
+                'attributes': attributes,
+                'classes': classes,
+            }
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def added(self, dn, object_class):
+        """Invalidate results an added entry could belong to."""
+        object_class = {i.lower() for i in object_class}
+        self.__invalidate(lambda cached: cached['classes'] is None or bool(
+            cached['classes'] & object_class))
+
+    def modified(self, dn, attributes):
+        """Invalidate results holding an entry or testing its attributes."""
+        dn = normalize_dn(dn)
+        attributes = {i.lower() for i in attributes}
+        self.__invalidate(lambda cached: dn in cached['dns'] or bool(
+            cached['attributes'] & attributes))
+
+    def deleted(self, dn):
+        """Invalidate results holding a deleted entry."""
+        dn = normalize_dn(dn)
+        self.__invalidate(lambda cached: dn in cached['dns'])
+
+    def clear(self):
+        """Drop every cached result."""
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self):
+        """
+        Cache counters.
+
+        Returns:
+            Dictionary of hits, misses, evictions, invalidations and the
+            current number of cached searches (size)
+
+        """
+        with self.__lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self.__entries)
+            }
+
+    def __invalidate(self, affected):
+        with self.__lock:
+            stale = [
+                key for key, cached in self.__entries.items()
+                if affected(cached)
+            ]
+            for key in stale:
+                del self.__entries[key]
+            self.invalidations += len(stale)
+
+    def __normalize(term):
+        return FILTER_ATTRIBUTE.sub(
+            lambda match: '({}'.format(match.group(1).strip().lower()), term)
+
+    def __analyze(filter):
+        """
+        Attributes tested by a filter and object classes it requires.
+
+        Returns:
+            Tuple of a set of lowercase attribute names and a set of
+            lowercase object classes a matching entry must have one of, or
+            None if the filter does not restrict object classes
+
+        """
+        attributes = set()
+        classes = None
+        for term in filter:
+            items = [(name.strip().lower(), value)
+                     for name, value in FILTER_ITEM.findall(term)]
+            attributes.update(name for name, _ in items)
+            # A term restricts object classes when it only has positive
+            # objectclass equality tests (one, or several ORed together)
+            if (items and '!' not in term and '&' not in term and
+                    all(name == 'objectclass' and '*' not in value
+                        for name, value in items)):
+                values = {value.lower() for _, value in items}
+                classes = values if classes is None else classes & values
+        return attributes, classes
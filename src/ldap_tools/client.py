@@ -1,11 +1,53 @@
 """LDAP Client Class."""
 import base64
+import copy
+import heapq
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from contextlib import contextmanager
 
 import ldap3
 import yaml
+from ldap3.utils.conv import escape_filter_chars
 
 import ldap_tools.exceptions
+from ldap_tools import profile
+from ldap_tools import trace
+from ldap_tools.cache import DEFAULT_SIZE
+from ldap_tools.cache import DEFAULT_TTL
+from ldap_tools.cache import SearchCache
+from ldap_tools.controls import PERSISTENT_SEARCH_OID
+from ldap_tools.controls import SERVER_SIDE_SORT_OID
+from ldap_tools.controls import VIRTUAL_LIST_VIEW_OID
+from ldap_tools.controls import parse_sort_key
+from ldap_tools.controls import sort_control
+from ldap_tools.controls import vlv_control
+from ldap_tools.health import DEFAULT_RETRIES
+from ldap_tools.health import DEFAULT_TIMEOUTS
+from ldap_tools.health import SERVER_ERRORS
+from ldap_tools.health import ServerHealth
+from ldap_tools.health import backoff
+from ldap_tools.health import unavailable
+from ldap_tools.pool import DEFAULT_IDLE_TIMEOUT
+from ldap_tools.pool import DEFAULT_MAX_LIFETIME
+from ldap_tools.pool import DEFAULT_SIZE as DEFAULT_POOL_SIZE
+from ldap_tools.pool import ConnectionPool
+from ldap_tools.routing import DEFAULT_PIN_WINDOW
+from ldap_tools.routing import Router
+
+# First characters of uids, grouped into shards by #sharded_stream
+UID_CHARACTERS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+
+def any_of(attribute, values):
+    """Filter matching any of values, e.g. (|(uid=a)(uid=b)), escaped."""
+    return '(|{})'.format(''.join(
+        '({}={})'.format(attribute, escape_filter_chars(value))
+        for value in values))
 
 
 class Client:
@@ -14,6 +56,18 @@ class Client:
     def __init__(self):
         """Initialize Client class."""
         self.config_dir = Client.__ldap_config_directory()
+        self.cache = None
+        self.pool = None
+        self.pool_config = None
+        self.router = None
+        self.replicas = []
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.retries = DEFAULT_RETRIES
+        self.scan_workers = 1
+        self.health = ServerHealth()
+        self.__local = threading.local()
+        self.__replicas = {}
+        self.__replicas_lock = threading.Lock()
 
     def prepare_connection(self):  # pragma: no cover
         """Prepare connection to LDAP client."""
@@ -21,6 +75,7 @@ class Client:
         self.load_ldap_password()
         self.connection()
 
+    @trace.traced('config')
     def load_ldap_config(self):  # pragma: no cover
         """Configure LDAP Client settings."""
         try:
@@ -33,10 +88,22 @@ class Client:
                 self.basedn = config['basedn']
                 self.mail_domain = config['mail_domain']
                 self.service_ou = config['service_ou']
+                self.replicas = config.get('replicas') or []
+                if config.get('cache'):
+                    self.enable_cache(**config['cache'])
+                self.pool_config = config.get('pool')
+                self.timeouts.update(config.get('timeouts') or {})
+                self.retries = config.get('retries', DEFAULT_RETRIES)
+                self.scan_workers = config.get('scan_workers', 1)
+                if config.get('route_reads') and self.replicas:
+                    self.enable_routing(
+                        self.replicas,
+                        config.get('pin_window', DEFAULT_PIN_WINDOW))
         except OSError as err:
             print('{}: Config file ({}/ldap_info.yaml) not found'.format(
                 type(err), self.config_dir))
 
+    @trace.traced('secret')
     def load_ldap_password(self):  # pragma: no cover
         """Import LDAP password from file."""
         with open('{}/ldap.secret'.format(self.config_dir), 'r') as FILE:
@@ -48,14 +115,295 @@ class Client:
         # self.server allows us to fetch server info
         # (including LDAP schema list) if we wish to
         # add this feature later
-        self.server = ldap3.Server(self.host, port=self.port, get_info=ldap3.ALL)
+        self.server = ldap3.Server(
+            self.host,
+            port=self.port,
+            get_info=ldap3.ALL,
+            connect_timeout=self.timeouts['connect'])
+        traced = trace.active() is not None
         self.conn = ldap3.Connection(
+            self.server,
+            user=self.user_dn,
+            password=self.user_pw,
+            auto_bind=not traced,
+            lazy=not traced,
+            receive_timeout=self.timeouts['read'])
+        if traced:
+            self.__traced_bind()
+        if self.pool_config:
+            self.enable_pool(**self.pool_config)
+
+    def __traced_bind(self):  # pragma: no cover
+        """Bind now, in separate spans for the bind and the schema fetch."""
+        with trace.span('bind', host=self.host):
+            self.conn.open(read_server_info=False)
+            if not self.conn.bind(read_server_info=False):
+                raise ldap3.core.exceptions.LDAPBindError(
+                    self.conn.last_error)
+        with trace.span('schema', host=self.host):
+            self.conn.refresh_server_info()
+
+    def enable_pool(self,
+                    size=DEFAULT_POOL_SIZE,
+                    idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                    max_lifetime=DEFAULT_MAX_LIFETIME):  # pragma: no cover
+        """
+        Make this client safe to share between threads.
+
+        Every operation then checks a connection out of a bounded pool
+        (see ldap_tools.pool.ConnectionPool) instead of using self.conn,
+        and #result is tracked per thread.  #spawn returns the client
+        itself, since it can already serve concurrent callers.
+
+        Returns:
+            ldap_tools.pool.ConnectionPool
+
+        """
+        self.pool = ConnectionPool(self.__new_connection, size, idle_timeout,
+                                   max_lifetime)
+        return self.pool
+
+    def __new_connection(self):  # pragma: no cover
+        return ldap3.Connection(
             self.server,
             user=self.user_dn,
             password=self.user_pw,
             auto_bind=True,
-            lazy=True,
-            receive_timeout=1)
+            receive_timeout=self.timeouts['read'])
+
+    def enable_routing(self, replicas, pin_window=DEFAULT_PIN_WINDOW):
+        """
+        Send searches to read replicas and writes to this client's server.
+
+        Replicas are picked by load and latency (see
+        ldap_tools.routing.Router).  After a write, reads stay on the
+        primary for `pin_window` seconds so they see the write.  Code that
+        must read the primary regardless, e.g. before allocating an ID,
+        can use #primary.
+
+        Args:
+            replicas: hosts to send reads to
+            pin_window: seconds reads stay on the primary after a write
+
+        Returns:
+            ldap_tools.routing.Router
+
+        """
+        self.router = Router(replicas, pin_window)
+        return self.router
+
+    @contextmanager
+    def primary(self):
+        """Read from the primary, uncached, in this block (and thread)."""
+        depth = getattr(self.__local, 'primary', 0)
+        self.__local.primary = depth + 1
+        try:
+            yield self
+        finally:
+            self.__local.primary = depth
+
+    def __run(self, kind, name, operation, **details):
+        """
+        Run operation(connection) with failover.
+
+        Reads are retried on the next best server, after a jittered
+        backoff, when a server fails or reports itself unavailable.
+        Writes are never retried, since they may have been applied.
+
+        Args:
+            kind: operation type, a key of self.timeouts
+            name: operation name for traces, with details as its args
+
+        """
+        attempts = 1 if kind == 'write' else self.retries + 1
+        tried = []
+        for attempt in range(1, attempts + 1):
+            host, routed = self.__pick(kind, tried)
+            started = time.monotonic()
+            try:
+                with trace.span(name, 'ldap', host=host, **details):
+                    with self.__checkout(kind, host) as conn:
+                        value = operation(conn)
+                        failed = unavailable(conn.result)
+            except SERVER_ERRORS:
+                self.health.failed(host)
+                if attempt == attempts:
+                    raise
+            else:
+                if not failed:
+                    self.health.succeeded(host)
+                    return value
+                self.health.failed(host)
+                if attempt == attempts:
+                    return value
+            finally:
+                if routed:
+                    self.router.release(host, time.monotonic() - started)
+            tried.append(host)
+            time.sleep(backoff(attempt))
+
+    def __profile(operation, filterstr, started, entries):
+        """Report a search to the query profiler, if profiling."""
+        profiler = profile.active()
+        if profiler is None:
+            return
+        measurement = profile.Measurement()
+        measurement.seconds = time.monotonic() - started
+        for entry in entries:
+            measurement.count(entry.entry_dn, entry.entry_raw_attributes)
+        profiler.record(operation, filterstr, measurement)
+
+    def __pick(self, kind, tried):
+        """
+        Server for the next attempt at an operation.
+
+        Returns:
+            Tuple of the host and whether it was acquired from the router
+
+        """
+        primary = getattr(self, 'host', None)
+        if (kind == 'write' or getattr(self.__local, 'primary', 0) or
+                (self.router is not None and self.router.pinned())):
+            return primary, False
+        if self.router is not None:
+            host = self.router.acquire([
+                i for i in self.router.replicas
+                if i not in tried and not self.health.demoted(i)
+            ])
+            if host is not None:
+                return host, True
+        candidates = [
+            i for i in [primary] + list(self.replicas) if i not in tried
+        ]
+        return (self.health.order(candidates) or [primary])[0], False
+
+    @contextmanager
+    def __checkout(self, kind, host=None):
+        """The connection to run one operation on."""
+        if host is not None and host != getattr(self, 'host', None):
+            with self.__replica(host).__checkout(kind) as conn:
+                try:
+                    yield conn
+                finally:
+                    self.__local.result = conn.result
+            return
+
+        if self.pool is None:
+            Client.__set_timeout(self.conn, self.timeouts[kind])
+            try:
+                yield self.conn
+            except SERVER_ERRORS:
+                self.__reconnect()
+                raise
+            finally:
+                self.__local.result = None  # see self.conn.result
+            return
+        with self.pool.connection() as conn:
+            Client.__set_timeout(conn, self.timeouts[kind])
+            try:
+                yield conn
+            finally:
+                self.__local.result = conn.result
+
+    def __set_timeout(conn, seconds):
+        if conn.receive_timeout != seconds:
+            conn.receive_timeout = seconds
+            if getattr(conn, 'socket', None) is not None:
+                conn.socket.settimeout(seconds)
+
+    def __reconnect(self):  # pragma: no cover
+        try:
+            self.conn.unbind()
+        except Exception:
+            pass  # the connection is broken already
+        self.connection()
+
+    def __replica(self, host):  # pragma: no cover
+        with self.__replicas_lock:
+            client = self.__replicas.get(host)
+            if client is None:
+                client = copy.copy(self)
+                client.host = host
+                client.cache = client.router = None
+                client.pool = client.pool_config = None
+                client.replicas = []
+                client.__local = threading.local()
+                client.__replicas = {}
+                client.connection()
+                if self.pool is not None:
+                    client.enable_pool(self.pool.size, self.pool.idle_timeout,
+                                       self.pool.max_lifetime)
+                self.__replicas[host] = client
+            return client
+
+    def __wrote(self):
+        if self.router is not None:
+            self.router.wrote()
+
+    def enable_cache(self, size=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        """
+        Cache search results in this process.
+
+        Repeated searches (e.g. Group API#lookup_id for the same group) are
+        then served from memory for up to `ttl` seconds.  Writes made
+        through this client, or clients spawned from it, invalidate the
+        results they affect; writes made elsewhere can be stale for `ttl`.
+        Reads in a #primary block, which decide writes (e.g. ID allocation
+        and ensure plans), bypass the cache.
+
+        Args:
+            size: maximum number of cached searches
+            ttl: seconds a result is served for
+
+        Returns:
+            ldap_tools.cache.SearchCache (see its stats method)
+
+        """
+        self.cache = SearchCache(size, ttl)
+        return self.cache
+
+    def spawn(self, host=None):  # pragma: no cover
+        """
+        Create a copy of this client with its own LDAP connection.
+
+        ldap3 connections serve one operation at a time, so concurrent
+        workers (see ldap_tools.bulk.Executor) each need their own.
+
+        Args:
+            host: server to connect to (optional); defaults to this
+                client's server, e.g. a replica from the config file
+
+        """
+        if self.pool is not None and host is None:
+            return self
+        client = copy.copy(self)
+        client.__local = threading.local()
+        client.__replicas = {}
+        client.__replicas_lock = threading.Lock()
+        if host is not None:
+            client.host = host
+            client.pool = client.pool_config = client.router = None
+            client.replicas = []
+        client.connection()
+        return client
+
+    def close(self):  # pragma: no cover
+        """Unbind the LDAP connection (and close the pool, if any)."""
+        with self.__replicas_lock:
+            replicas, self.__replicas = self.__replicas, {}
+        for client in replicas.values():
+            client.close()
+        if self.pool is not None:
+            self.pool.close()
+        self.conn.unbind()
+
+    @property
+    def result(self):
+        """Result dictionary of the last LDAP operation (in this thread)."""
+        result = getattr(self.__local, 'result', None)
+        if result is None and self.pool is None:
+            return self.conn.result
+        return result
 
     def add(self, distinguished_name, object_class, attributes):
         """
@@ -69,11 +417,24 @@ class Client:
                 See ldap_tools.api.group.API#__ldap_attr
 
         """
-        self.conn.add(distinguished_name, object_class, attributes)
+        result = self.__run(
+            'write', 'add',
+            lambda conn: conn.add(distinguished_name, object_class, attributes),
+            dn=distinguished_name)
+        self.__wrote()
+        if self.cache is not None:
+            self.cache.added(distinguished_name, object_class)
+        return result
 
     def delete(self, distinguished_name):  # pragma: no cover
         """Remove object from LDAP."""
-        return self.conn.delete(distinguished_name)
+        result = self.__run(
+            'write', 'delete', lambda conn: conn.delete(distinguished_name),
+            dn=distinguished_name)
+        self.__wrote()
+        if self.cache is not None:
+            self.cache.deleted(distinguished_name)
+        return result
 
     def modify(self, distinguished_name, mod_list):  # pragma: no cover
         """
@@ -87,10 +448,16 @@ class Client:
 
                 mod_list = {'memberUid': [(ldap3.MODIFY_ADD, [username])]}
         """
+        result = self.__run(
+            'write', 'modify',
+            lambda conn: conn.modify(distinguished_name, mod_list),
+            dn=distinguished_name)
+        self.__wrote()
+        if self.cache is not None:
+            self.cache.modified(distinguished_name, mod_list.keys())
+        return result
 
-        self.conn.modify(distinguished_name, mod_list)
-
-    def search(self, filter, attributes=None):
+    def search(self, filter, attributes=None, controls=None):
         """Search LDAP for records."""
         if attributes is None:
             attributes = ['*']
@@ -98,15 +465,433 @@ class Client:
         if filter is None:
             filter = ["(objectclass=*)"]
 
+        key = None
+        if (self.cache is not None and controls is None and
+                not getattr(self.__local, 'primary', 0)):
+            key = self.cache.key(self.basedn, filter, attributes)
+            entries = self.cache.get(key)
+            if entries is not None:
+                return entries
+
         # Convert filter list into an LDAP-consumable format
         filterstr = "(&{})".format(''.join(filter))
-        self.conn.search(
+
+        def operation(conn):
+            conn.search(
+                search_base=self.basedn,
+                search_filter=filterstr,
+                search_scope=ldap3.SUBTREE,
+                attributes=attributes,
+                controls=controls)
+            return conn.entries, conn.result['result'] == 0
+
+        started = time.monotonic()
+        entries, succeeded = self.__run(
+            'read', 'search', operation, filter=filterstr)
+        Client.__profile('search', filterstr, started, entries)
+        if key is not None and succeeded:
+            self.cache.put(key, filter, entries)
+        return entries
+
+    def read(self, distinguished_name, attributes=None):  # pragma: no cover
+        """
+        Fetch one record by DN.
+
+        Returns:
+            ldap3 entry, or None if there is no such record
+
+        """
+        if attributes is None:
+            attributes = ['*']
+
+        def operation(conn):
+            conn.search(
+                search_base=distinguished_name,
+                search_filter='(objectclass=*)',
+                search_scope=ldap3.BASE,
+                attributes=attributes)
+            return conn.entries
+
+        started = time.monotonic()
+        entries = self.__run(
+            'read', 'read', operation, dn=distinguished_name)
+        Client.__profile('read', '(objectclass=*)', started, entries)
+        return entries[0] if entries else None
+
+    def stream(self,
+               filter,
+               attributes=None,
+               page_size=500,
+               base=None,
+               scope=ldap3.SUBTREE):  # pragma: no cover
+        """
+        Search LDAP for records one page at a time.
+
+        Unlike #search, results are not accumulated on the connection, so
+        memory use does not grow with the size of the directory.
+
+        Args:
+            base: DN to search below (optional); defaults to basedn
+            scope: ldap3.SUBTREE, LEVEL or BASE
+
+        Returns:
+            A generator of ldap3 response dictionaries ('dn', 'attributes')
+
+        """
+        if attributes is None:
+            attributes = ['*']
+
+        if filter is None:
+            filter = ["(objectclass=*)"]
+
+        filterstr = "(&{})".format(''.join(filter))
+        attempts = self.retries + 1
+        tried = []
+        for attempt in range(1, attempts + 1):
+            host, routed = self.__pick('scan', tried)
+            streamed = False
+            measurement = profile.Measurement()
+            try:
+                with self.__checkout('scan', host) as conn:
+                    responses = conn.extend.standard.paged_search(
+                        search_base=base or self.basedn,
+                        search_filter=filterstr,
+                        search_scope=scope,
+                        attributes=attributes,
+                        paged_size=page_size,
+                        generator=True)
+                    with trace.span('stream', 'ldap', host=host,
+                                    filter=filterstr):
+                        for response in measurement.iterate(responses):
+                            if response['type'] == 'searchResEntry':
+                                streamed = True
+                                yield response
+                self.health.succeeded(host)
+                return
+            except SERVER_ERRORS:
+                self.health.failed(host)
+                if streamed or attempt == attempts:
+                    raise  # entries already yielded cannot be taken back
+            finally:
+                if routed:
+                    self.router.release(host)
+                if profile.active() is not None:
+                    profile.active().record('stream', filterstr, measurement)
+            tried.append(host)
+            time.sleep(backoff(attempt))
+
+    def sharded_stream(self,
+                       filter,
+                       attributes=None,
+                       shard_by='ou',
+                       workers=None,
+                       page_size=500):
+        """
+        Search LDAP for records over several connections at once.
+
+        The search is split into disjoint shards, which are streamed
+        concurrently and merged into one stream as pages arrive.  Shards
+        are interleaved, but records of one shard keep the order the
+        server sent them in, and basedn comes first.
+
+        Args:
+            shard_by: 'ou' for one shard per entry directly below basedn,
+                or 'uid' for shards by the first character of uid plus
+                one for all other records, which suits a single large OU
+                of users
+            workers: number of concurrent connections; defaults to
+                scan_workers from the config file, and 1 is a plain #stream
+
+        Returns:
+            A generator of ldap3 response dictionaries, as from #stream
+
+        """
+        if filter is None:
+            filter = ["(objectclass=*)"]
+        if shard_by not in ('ou', 'uid'):
+            raise ValueError('Unknown shard type: {}'.format(shard_by))
+        if workers is None:
+            workers = self.scan_workers
+        if workers <= 1:
+            yield from self.stream(filter, attributes, page_size)
+            return
+        if shard_by == 'ou':
+            yield from self.stream(filter, attributes, page_size, self.basedn,
+                                   ldap3.BASE)
+            shards = self.__ou_shards()
+        else:
+            shards = Client.__uid_shards(workers * 4)
+
+        responses = queue.Queue(maxsize=workers * page_size)
+        cancelled = threading.Event()
+        local = threading.local()
+        clients = []
+        clients_lock = threading.Lock()
+
+        def deliver(item):
+            while not cancelled.is_set():
+                try:
+                    responses.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def scan(shard):
+            base, scope, shard_filter = shard
+            try:
+                client = getattr(local, 'client', None)
+                if client is None:
+                    client = local.client = self.spawn()
+                    with clients_lock:
+                        clients.append(client)
+                stream = client.stream(filter + shard_filter, attributes,
+                                       page_size, base, scope)
+                with closing(stream):  # release the connection if cancelled
+                    for response in stream:
+                        if not deliver(('entry', response)):
+                            return
+                deliver(('done', None))
+            except Exception as err:
+                deliver(('error', err))
+
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        seen = set() if shard_by == 'uid' else None
+        try:
+            for shard in shards:
+                executor.submit(scan, shard)
+            pending = len(shards)
+            while pending:
+                kind, value = responses.get()
+                if kind == 'done':
+                    pending -= 1
+                elif kind == 'error':
+                    raise value
+                elif seen is None:
+                    yield value
+                elif value['dn'].lower() not in seen:
+                    # a record with several uids can be in several shards
+                    seen.add(value['dn'].lower())
+                    yield value
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=True)
+            for client in clients:
+                if client is not self:
+                    client.close()
+
+    def __ou_shards(self):  # pragma: no cover
+        shards = []
+        for response in self.stream(None, ['1.1'], scope=ldap3.LEVEL):
+            shards.append((response['dn'], ldap3.SUBTREE, []))
+        return shards
+
+    def __uid_shards(count):
+        """uid first character shards, then a shard for everything else."""
+        count = max(1, min(count, len(UID_CHARACTERS)))
+        size = -(-len(UID_CHARACTERS) // count)
+        groups = [
+            UID_CHARACTERS[start:start + size]
+            for start in range(0, len(UID_CHARACTERS), size)
+        ]
+        shards = [(None, ldap3.SUBTREE, ['(|{})'.format(''.join(
+            '(uid={}*)'.format(i) for i in group))]) for group in groups]
+        shards.append((None, ldap3.SUBTREE, ['(!(|{}))'.format(''.join(
+            '(uid={}*)'.format(i) for i in UID_CHARACTERS))]))
+        return shards
+
+    def watch(self, filter, attributes, poll_interval=60):
+        """
+        Follow changes to matching records.
+
+        A persistent search on a dedicated connection is used when the
+        server supports it; otherwise the server is polled every
+        `poll_interval` seconds for records with a newer modifyTimestamp.
+        Polling cannot see deleted records.
+
+        Returns:
+            A never ending generator of (change type, dn, raw attributes)
+            tuples. The change type is 'add', 'delete', 'modify' or
+            'modify dn'; polling reports every change as 'modify'.
+
+        """
+        try:
+            persistent = self.supports_control(PERSISTENT_SEARCH_OID)
+        except ldap3.core.exceptions.LDAPException:
+            persistent = False
+        if persistent:
+            yield from self.__persistent_search(filter, attributes,
+                                                poll_interval)
+        else:
+            yield from self.__poll(filter, attributes, poll_interval)
+
+    def __persistent_search(self, filter, attributes,
+                            poll_interval):  # pragma: no cover
+        conn = ldap3.Connection(
+            self.server,
+            user=self.user_dn,
+            password=self.user_pw,
+            client_strategy=ldap3.ASYNC_STREAM,
+            auto_bind=True)
+        search = conn.extend.standard.persistent_search(
             search_base=self.basedn,
-            search_filter=filterstr,
-            search_scope=ldap3.SUBTREE,
-            attributes=attributes)
-        return self.conn.entries
+            search_filter="(&{})".format(''.join(filter)),
+            attributes=attributes,
+            streaming=False)
+        try:
+            while True:
+                # wake up regularly so the process can be interrupted
+                event = search.next(block=True, timeout=poll_interval)
+                if event is not None and event['type'] == 'searchResEntry':
+                    yield (event.get('changeType', 'modify'), event['dn'],
+                           event['raw_attributes'])
+        finally:
+            search.stop()
+
+    def __poll(self, filter, attributes, poll_interval):
+        stamps = [(response['dn'], Client.__modify_timestamp(response))
+                  for response in self.stream(filter, ['modifyTimestamp'])]
+        mark = max((stamp for _, stamp in stamps), default='')
+        # (dn, timestamp) already seen at the mark, which >= matches again
+        seen = {(dn, stamp) for dn, stamp in stamps if stamp == mark}
+        while True:
+            time.sleep(poll_interval)
+            clauses = list(filter)
+            if mark:
+                clauses.append('(modifyTimestamp>={})'.format(mark))
+            changed = []
+            for response in self.stream(clauses,
+                                        attributes + ['modifyTimestamp']):
+                stamp = Client.__modify_timestamp(response)
+                if (response['dn'], stamp) not in seen:
+                    changed.append((stamp, response))
+            if changed:
+                latest = max(stamp for stamp, _ in changed)
+                if latest != mark:
+                    seen = set()
+                mark = latest
+                seen.update((response['dn'], stamp)
+                            for stamp, response in changed if stamp == mark)
+            for _, response in sorted(changed, key=lambda i: i[0]):
+                yield ('modify', response['dn'], response['raw_attributes'])
+
+    def __modify_timestamp(response):
+        for name, values in response['raw_attributes'].items():
+            if name.lower() == 'modifytimestamp' and values:
+                return values[0].decode()
+        return ''
+
+    def supports_control(self, oid):  # pragma: no cover
+        """Check whether the server advertises support for a control."""
+        if self.server.info is None:
+            with self.__checkout('read') as conn:
+                if not conn.bound:
+                    conn.bind()  # server info is read when binding
+        if self.server.info is None:
+            return False
+        return oid in [i[0] for i in self.server.info.supported_controls]
+
+    def sorted_search(self, filter, attributes=None, sort='uid', offset=0,
+                      limit=None):
+        """
+        Search LDAP for one sorted window of records.
+
+        The server side sort and virtual list view controls are used when
+        the server supports them.  Otherwise only the sort attribute is
+        fetched for every match, the window is picked with a bounded heap,
+        and full records are fetched for that window only; without a
+        limit, the records are fetched in one search and sorted here.
+
+        Args:
+            sort: attribute to sort by, prefixed with '-' for descending order
+            offset: number of records to skip
+            limit: maximum number of records to return (optional)
+
+        Returns:
+            List of ldap3 entries
+
+        """
+        if self.__server_side_window(limit):
+            controls = [sort_control(sort)]
+            if limit is not None:
+                controls.append(vlv_control(offset, limit))
+            entries = self.search(filter, attributes, controls)
+            if self.result['result'] == 0:
+                if limit is None:
+                    return entries[offset:]
+                return entries[:limit]
+
+        return self.__client_side_window(filter, attributes, sort, offset,
+                                         limit)
+
+    def __server_side_window(self, limit):  # pragma: no cover
+        try:
+            sort_supported = self.supports_control(SERVER_SIDE_SORT_OID)
+            vlv_supported = self.supports_control(VIRTUAL_LIST_VIEW_OID)
+        except ldap3.core.exceptions.LDAPException:
+            return False
+        return sort_supported and (limit is None or vlv_supported)
 
+    def __client_side_window(self, filter, attributes, sort, offset, limit):
+        if filter is None:
+            filter = ["(objectclass=*)"]
+
+        attribute, reverse = parse_sort_key(sort)
+        if limit is None:
+            # Every record past offset is wanted, so fetch them all at once
+            # rather than refetch nearly the whole directory by sort value
+            if attributes is not None and attribute.lower() not in {
+                    i.lower() for i in attributes}:
+                attributes = list(attributes) + [attribute]
+            entries = self.search(filter, attributes)
+            return sorted(
+                entries,
+                key=lambda i: Client.__sort_key(
+                    i.entry_dn, i.entry_attributes_as_dict, attribute),
+                reverse=reverse)[offset:]
+
+        keys = (
+            Client.__sort_key(response['dn'], response['attributes'],
+                              attribute)
+            for response in self.stream(filter, [attribute]))
+        if reverse:
+            window = heapq.nlargest(offset + limit, keys)[offset:]
+        else:
+            window = heapq.nsmallest(offset + limit, keys)[offset:]
+        if not window:
+            return []
+
+        # Fetch the full records in the window by their sort values
+        clauses = set()
+        for (missing, value, dn) in window:
+            if not missing:
+                clauses.add('({}={})'.format(attribute, escape_filter_chars(
+                    str(value))))
+            else:
+                clauses.add('(!({}=*))'.format(attribute))
+        entries = self.search(
+            filter + ['(|{})'.format(''.join(sorted(clauses)))], attributes)
+
+        position = {dn: i for i, (_, _, dn) in enumerate(window)}
+        return sorted(
+            [i for i in entries if i.entry_dn.lower() in position],
+            key=lambda i: position[i.entry_dn.lower()])
+
+    def __sort_key(dn, attributes, attribute):
+        """Sortable (missing, value, dn) tuple; missing values sort high."""
+        value = None
+        for name, values in attributes.items():
+            if name.lower() == attribute.lower():
+                if isinstance(values, list):
+                    values = values[0] if values else None
+                value = values
+        if isinstance(value, str):
+            value = value.lower()
+        if value is None:
+            return (True, '', dn.lower())
+        return (False, value, dn.lower())
+
+    @trace.traced('get_max_id')
     def get_max_id(self, object_type, role):
         """Get the highest used ID."""
         if object_type == 'user':
@@ -127,7 +912,8 @@ class Client:
         if maxID is not None:
             filter.append("({}<={})".format(ldap_attr, maxID))
 
-        id_list = self.search(filter, [ldap_attr])
+        with self.primary():  # replicas may not have the newest IDs yet
+            id_list = self.search(filter, [ldap_attr])
 
         if id_list == []:
             id = minID
@@ -141,6 +927,29 @@ class Client:
 
         return id
 
+    def id_allocator(self, role, used_ids):
+        """
+        Allocate IDs without further LDAP queries.
+
+        Args:
+            role: 'user' or 'service'; selects the ID range
+            used_ids: every uidNumber (or gidNumber) already in use
+
+        Returns:
+            A generator of IDs following the highest ID in use in the range,
+            matching what successive calls to #get_max_id would return.
+
+        """
+        minID, maxID = Client.__set_id_boundary(role)
+        in_range = [
+            i for i in used_ids
+            if i >= minID and (maxID is None or i <= maxID)
+        ]
+        id = max(in_range) + 1 if in_range else minID
+        while True:
+            yield id
+            id += 1
+
     def __ldap_config_directory():
         return os.getenv('LDAP_CONFIG_DIR', "{}/.ldap".format(
             os.getenv('HOME')))
@@ -1,10 +1,23 @@
 """Command line application entry point."""
+import sys  # pragma: no cover
+
 import click  # pragma: no cover
+import ldap3  # pragma: no cover
+import yaml  # pragma: no cover
 
 import ldap_tools  # pragma: no cover
+from ldap_tools import profile  # pragma: no cover
+from ldap_tools import trace  # pragma: no cover
 from ldap_tools.audit import CLI as AuditCLI  # pragma: no cover
+from ldap_tools.client import Client  # pragma: no cover
+from ldap_tools.diff import CLI as DiffCLI  # pragma: no cover
 from ldap_tools.group import CLI as GroupCLI  # pragma: no cover
 from ldap_tools.key import CLI as KeyCLI  # pragma: no cover
+from ldap_tools.ldif import CLI as LdifCLI  # pragma: no cover
+from ldap_tools.loadtest import CLI as LoadTestCLI  # pragma: no cover
+from ldap_tools.nss import CLI as NssCLI  # pragma: no cover
+from ldap_tools.replica import CLI as ReplicaCLI  # pragma: no cover
+from ldap_tools.state import CLI as StateCLI  # pragma: no cover
 from ldap_tools.user import CLI as UserCLI  # pragma: no cover
 
 
@@ -21,9 +34,60 @@ class CLI:  # pragma: no cover
 
 
 @click.group()  # pragma: no cover
-def entry_point():  # pragma: no cover
+@click.option(
+    '--profile-queries',
+    is_flag=True,
+    help='Report LDAP query statistics and index advice on exit')
+@click.option(
+    '--trace',
+    'trace_file',
+    type=click.Path(dir_okay=False, writable=True),
+    help='Write timings of each phase and LDAP operation to a Chrome '
+    'trace event file')
+@click.pass_context
+def entry_point(ctx, profile_queries, trace_file):  # pragma: no cover
     """Enter the application here."""
-    pass
+    if profile_queries:
+        profile.enable()
+        ctx.call_on_close(report_queries)
+    if trace_file:
+        tracer = trace.enable(ldap_tools.IMPORT_STARTED)
+        started = trace.clock()
+        tracer.complete('import', 'phase', ldap_tools.IMPORT_STARTED,
+                        started)
+        ctx.call_on_close(lambda: write_trace(
+            trace_file, ctx.invoked_subcommand, started))
+
+
+def write_trace(filename, command, started):  # pragma: no cover
+    """Close the command's span and write the trace."""
+    tracer = trace.disable()
+    tracer.complete(command or 'ldaptools', 'command', started, trace.clock(),
+                    {'argv': ' '.join(sys.argv[1:])})
+    with open(filename, 'w') as FILE:
+        tracer.write(FILE)
+
+
+def report_queries():  # pragma: no cover
+    """Print the query profile to stderr."""
+    profiler = profile.disable()
+    if profiler is None or not profiler.report():
+        return
+    indexes = None
+    client = Client()
+    try:
+        client.prepare_connection()
+        indexes = profile.read_indexes(client)
+    except (OSError, KeyError, TypeError, ValueError, yaml.YAMLError,
+            ldap3.core.exceptions.LDAPException):
+        pass  # report without index information
+    finally:
+        if getattr(client, 'conn', None) is not None:
+            client.close()
+    if indexes is None:
+        print('Server indexes unknown (cn=config not readable); '
+              'suggesting indexes for slow queries only', file=sys.stderr)
+    print('\n'.join(profiler.format(indexes)), file=sys.stderr)
 
 
 def main():  # pragma: no cover
@@ -33,5 +97,12 @@ def main():  # pragma: no cover
     entry_point.add_command(GroupCLI.group)
     entry_point.add_command(AuditCLI.audit)
     entry_point.add_command(KeyCLI.key)
+    entry_point.add_command(StateCLI.apply)
+    entry_point.add_command(LdifCLI.dump)
+    entry_point.add_command(LdifCLI.load)
+    entry_point.add_command(DiffCLI.diff)
+    entry_point.add_command(ReplicaCLI.replica_check)
+    entry_point.add_command(NssCLI.nss)
+    entry_point.add_command(LoadTestCLI.loadtest)
 
     entry_point()
@@ -0,0 +1,120 @@
+"""LDAP Request Controls not built into ldap3."""
+from ldap3.protocol.controls import build_control
+from pyasn1.type.namedtype import NamedType
+from pyasn1.type.namedtype import NamedTypes
+from pyasn1.type.namedtype import OptionalNamedType
+from pyasn1.type.tag import Tag
+from pyasn1.type.tag import tagClassContext
+from pyasn1.type.tag import tagFormatConstructed
+from pyasn1.type.tag import tagFormatSimple
+from pyasn1.type.univ import Boolean
+from pyasn1.type.univ import Choice
+from pyasn1.type.univ import Integer
+from pyasn1.type.univ import OctetString
+from pyasn1.type.univ import Sequence
+from pyasn1.type.univ import SequenceOf
+
+SERVER_SIDE_SORT_OID = '1.2.840.113556.1.4.473'
+VIRTUAL_LIST_VIEW_OID = '2.16.840.1.113730.3.4.9'
+PERSISTENT_SEARCH_OID = '2.16.840.1.113730.3.4.3'
+
+
+class SortKey(Sequence):
+    """RFC 2891 sort key."""
+
+    componentType = NamedTypes(
+        NamedType('attributeType', OctetString()),
+        OptionalNamedType(
+            'orderingRule',
+            OctetString().subtype(
+                implicitTag=Tag(tagClassContext, tagFormatSimple, 0))),
+        OptionalNamedType(
+            'reverseOrder',
+            Boolean().subtype(
+                implicitTag=Tag(tagClassContext, tagFormatSimple, 1))))
+
+
+class SortKeyList(SequenceOf):
+    """RFC 2891 server side sort request."""
+
+    componentType = SortKey()
+
+
+class ByOffset(Sequence):
+    """VLV target selected by position."""
+
+    tagSet = Sequence.tagSet.tagImplicitly(
+        Tag(tagClassContext, tagFormatConstructed, 0))
+    componentType = NamedTypes(
+        NamedType('offset', Integer()), NamedType('contentCount', Integer()))
+
+
+class Target(Choice):
+    """VLV target entry."""
+
+    componentType = NamedTypes(
+        NamedType('byOffset', ByOffset()),
+        NamedType(
+            'greaterThanOrEqual',
+            OctetString().subtype(
+                implicitTag=Tag(tagClassContext, tagFormatSimple, 1))))
+
+
+class VirtualListViewRequest(Sequence):
+    """draft-ietf-ldapext-ldapv3-vlv virtual list view request."""
+
+    componentType = NamedTypes(
+        NamedType('beforeCount', Integer()),
+        NamedType('afterCount', Integer()), NamedType('target', Target()))
+
+
+def parse_sort_key(sort):
+    """
+    Split a sort specification into an attribute and a direction.
+
+    Args:
+        sort: attribute name, prefixed with '-' for descending order
+
+    Returns:
+        (attribute, reverse) tuple
+
+    """
+    if sort.startswith('-'):
+        return sort[1:], True
+    return sort, False
+
+
+def sort_control(sort, criticality=True):
+    """Build a server side sort control for one sort specification."""
+    attribute, reverse = parse_sort_key(sort)
+    key = SortKey()
+    key.setComponentByName('attributeType', attribute)
+    if reverse:
+        key.setComponentByName('reverseOrder', True)
+
+    key_list = SortKeyList()
+    key_list.setComponentByPosition(0, key)
+    return build_control(SERVER_SIDE_SORT_OID, criticality, key_list)
+
+
+def vlv_control(offset, limit, criticality=True):
+    """
+    Build a virtual list view control.
+
+    Args:
+        offset: number of entries to skip (0 based)
+        limit: number of entries to return
+
+    """
+    by_offset = ByOffset()
+    by_offset.setComponentByName('offset', offset + 1)  # VLV is 1 based
+    by_offset.setComponentByName('contentCount', 0)
+
+    target = Target()
+    target.setComponentByName('byOffset', by_offset)
+
+    request = VirtualListViewRequest()
+    request.setComponentByName('beforeCount', 0)
+    request.setComponentByName('afterCount', max(limit - 1, 0))
+    request.setComponentByName('target', target)
+    return build_control(VIRTUAL_LIST_VIEW_OID, criticality, request)
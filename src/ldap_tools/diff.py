@@ -0,0 +1,285 @@
+"""Differences Between LDAP Directory Snapshots."""
+import hashlib
+import heapq
+import io
+import mmap
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+from collections import namedtuple
+from contextlib import contextmanager
+
+import click
+from ldap3.utils.dn import to_dn
+
+from ldap_tools.client import Client
+from ldap_tools.ldif import API as LdifApi
+from ldap_tools.ldif import attribute_line
+from ldap_tools.ldif import open_file
+from ldap_tools.ldif import read_entries
+
+DEFAULT_CHUNK_SIZE = 100000
+
+Difference = namedtuple('Difference', ['action', 'dn', 'attributes'])
+
+
+def dn_key(dn):
+    """
+    Sort key for a DN.
+
+    RDNs are compared from the suffix down, so a parent sorts directly
+    before its children, and case and spacing are ignored.
+    """
+    return ','.join(i.strip().lower() for i in reversed(to_dn(dn)))
+
+
+def digest(attributes):
+    """Hash of an entry's content that ignores attribute and value order."""
+    content = sorted((name, sorted(values))
+                     for name, (_, values) in normalize(attributes).items())
+    return hashlib.sha1(repr(content).encode()).digest()
+
+
+def normalize(attributes):
+    """
+    Merge attributes whose names differ only in case.
+
+    Returns:
+        Dictionary of lowercase name to (name, list of values)
+
+    """
+    normalized = {}
+    for name, values in attributes.items():
+        normalized.setdefault(name.lower(), (name, []))[1].extend(values)
+    return normalized
+
+
+def compare(before, after):
+    """
+    Attribute level differences between two versions of an entry.
+
+    Returns:
+        Ordered dictionary of attribute name to (removed values, added
+        values) for every attribute that changed
+
+    """
+    before = normalize(before)
+    after = normalize(after)
+    changes = OrderedDict()
+    for key in sorted(set(before) | set(after)):
+        name, old = before.get(key, (None, []))
+        name, new = after.get(key, (name, []))
+        removed = [i for i in old if i not in new]
+        added = [i for i in new if i not in old]
+        if removed or added:
+            changes[name] = (removed, added)
+    return changes
+
+
+def sorted_index(FILE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Index the entries of an LDIF file in DN order.
+
+    Only (DN key, digest, offset) tuples are kept, and once more than
+    `chunk_size` of them have been read they are sorted and spilled to a
+    temporary file; the runs are then merged lazily (an external sort).
+
+    Returns:
+        A generator of (DN key, digest, offset) tuples sorted by DN key
+
+    """
+    runs = []
+    chunk = []
+    try:
+        for offset, dn, attributes in read_entries(FILE):
+            chunk.append((dn_key(dn), digest(attributes), offset))
+            if len(chunk) >= chunk_size:
+                runs.append(_spill(chunk))
+                chunk = []
+        if not runs:
+            yield from sorted(chunk)
+            return
+        if chunk:
+            runs.append(_spill(chunk))
+        yield from heapq.merge(*[_unspill(run) for run in runs])
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _spill(chunk):
+    run = tempfile.TemporaryFile()
+    for item in sorted(chunk):
+        pickle.dump(item, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def _unspill(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+
+def _join(old, new):
+    """Walk two sorted indexes together, pairing entries with equal keys."""
+    a = next(old, None)
+    b = next(new, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield a, None
+            a = next(old, None)
+        elif a is None or b[0] < a[0]:
+            yield None, b
+            b = next(new, None)
+        else:
+            yield a, b
+            a = next(old, None)
+            b = next(new, None)
+
+
+@contextmanager
+def mapped(filename):
+    """
+    Open an LDIF file as a read only memory map.
+
+    Compressed files and stdin are first decompressed to a temporary
+    file, since entries are read back by offset.
+    """
+    if filename == '-' or os.path.splitext(filename)[1] in ('.gz', '.xz'):
+        FILE = tempfile.TemporaryFile()
+        with open_file(filename, 'r') as SOURCE:
+            shutil.copyfileobj(SOURCE, FILE)
+        FILE.flush()
+    else:
+        FILE = open(filename, 'rb')
+    with FILE:
+        if os.fstat(FILE.fileno()).st_size == 0:
+            yield io.BytesIO()  # empty files cannot be mapped
+            return
+        with mmap.mmap(FILE.fileno(), 0, access=mmap.ACCESS_READ) as MAP:
+            yield MAP
+
+
+class API:
+    """Methods to compare LDIF snapshots of LDAP."""
+
+    def __init__(self, client=None):
+        """Initialize Diff API and LDAP Client (only needed for #dump)."""
+        self.client = client
+
+    def diff(self, old, new, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Compare two LDIF files entry by entry.
+
+        Both files are indexed by DN with a content digest per entry; only
+        entries whose digests differ are parsed again (by offset) to work
+        out attribute level changes.
+
+        Args:
+            old: seekable binary LDIF file (ideally memory mapped)
+            new: seekable binary LDIF file
+            chunk_size: entries held in memory per sorted run
+
+        Returns:
+            A generator of Difference tuples, in DN order.  For 'add' and
+            'delete', attributes holds the entry; for 'modify' it maps
+            attribute names to (removed values, added values).
+
+        """
+        for a, b in _join(
+                sorted_index(old, chunk_size), sorted_index(new, chunk_size)):
+            if b is None:
+                dn, attributes = API.__entry(old, a[2])
+                yield Difference('delete', dn, attributes)
+            elif a is None:
+                dn, attributes = API.__entry(new, b[2])
+                yield Difference('add', dn, attributes)
+            elif a[1] != b[1]:
+                _, before = API.__entry(old, a[2])
+                dn, after = API.__entry(new, b[2])
+                yield Difference('modify', dn, compare(before, after))
+
+    def dump(self, FILE):
+        """Write the live directory to FILE as LDIF."""
+        return LdifApi(self.client).dump(FILE)
+
+    def format(difference):
+        """
+        Describe a difference as lines of text.
+
+        Entries are prefixed with '+' (added), '-' (deleted) or '~'
+        (modified), and each attribute value below them with '+' or '-'.
+        """
+        symbol = {'add': '+', 'delete': '-', 'modify': '~'}
+        lines = ['{} {}'.format(symbol[difference.action], difference.dn)]
+        for name, values in difference.attributes.items():
+            if difference.action == 'modify':
+                removed, added = values
+                changes = ([('-', i) for i in removed] +
+                           [('+', i) for i in added])
+            else:
+                changes = [(symbol[difference.action], i) for i in values]
+            lines.extend('    {} {}'.format(sign, attribute_line(
+                name, value).decode()) for sign, value in changes)
+        return lines
+
+    def __entry(FILE, offset):
+        FILE.seek(offset)
+        _, dn, attributes = next(read_entries(FILE))
+        return dn, attributes
+
+
+class CLI:
+    """Commands to compare LDIF snapshots of LDAP."""
+
+    @click.command()
+    @click.argument('old')
+    @click.argument('new', required=False)
+    @click.option(
+        '--chunk-size',
+        default=DEFAULT_CHUNK_SIZE,
+        show_default=True,
+        help='Entries sorted in memory before spilling to disk')
+    @click.option(
+        '--summary', is_flag=True, help='Only print the number of changes')
+    @click.pass_obj
+    def diff(config, old, new, chunk_size, summary):
+        """
+        Show entries and attributes changed between LDIF files.
+
+        When NEW is omitted, OLD is compared with the live directory.
+        Exits with status 1 if there are differences.
+        """
+        diff_api = API()
+        if new is None:
+            client = Client()
+            client.prepare_connection()
+            diff_api = API(client)
+            live = tempfile.NamedTemporaryFile(suffix='.ldif', delete=False)
+            with live:
+                diff_api.dump(live)
+            new = live.name
+
+        counts = {'add': 0, 'delete': 0, 'modify': 0}
+        try:
+            with mapped(old) as OLD, mapped(new) as NEW:
+                for difference in diff_api.diff(OLD, NEW, chunk_size):
+                    counts[difference.action] += 1
+                    if not summary:
+                        print('\n'.join(API.format(difference)))
+        finally:
+            if diff_api.client is not None:
+                os.remove(new)
+
+        print(
+            '{add} added, {delete} deleted, {modify} modified'.format(
+                **counts),
+            file=sys.stderr)
+        if any(counts.values()):
+            sys.exit(1)
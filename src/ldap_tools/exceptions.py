@@ -19,3 +19,7 @@ class TooManyResults(InvalidResult):
 
 class NoUserFound(InvalidResult):
     """No users returned by LDAP."""
+
+
+class PoolTimeout(Exception):
+    """No pooled LDAP connection became free in time."""
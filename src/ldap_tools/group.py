@@ -1,11 +1,18 @@
 """LDAP Group Management API."""
 import sys
+from collections import OrderedDict
 
 import click
 import ldap3
 
 import ldap_tools.exceptions
+from ldap_tools import trace
+from ldap_tools.bulk import DEFAULT_WORKERS
+from ldap_tools.bulk import Executor
+from ldap_tools.bulk import Journal
+from ldap_tools.bulk import check
 from ldap_tools.client import Client
+from ldap_tools.client import any_of
 
 
 class API:
@@ -15,10 +22,16 @@ class API:
         """Initialize GROUP API and LDAP Client."""
         self.client = client
 
-    def create(self, group, grouptype):
+    def create(self, group, grouptype, gidnumber=None):
         """
         Create an LDAP Group.
 
+        Args:
+            group: Name of group to create
+            grouptype: 'user' or 'service'
+            gidnumber: GID to assign (optional). Looked up with
+                Client#get_max_id when not given.
+
         Raises:
             ldap3.core.exceptions.LDAPNoSuchObjectResult:
                 an object involved with the request is missing
@@ -28,27 +41,86 @@ class API:
 
         """
         try:
-            self.client.add(
+            return self.client.add(
                 self.__distinguished_name(group), API.__object_class(),
-                self.__ldap_attr(group, grouptype))
+                self.__ldap_attr(group, grouptype, gidnumber))
         except ldap3.core.exceptions.LDAPNoSuchObjectResult:  # pragma: no cover
             print(
                 "Error creating LDAP Group.\nRequest: ",
-                self.__ldap_attr(group, grouptype),
+                self.__ldap_attr(group, grouptype, gidnumber),
                 "\nDistinguished Name: ",
                 self.__distinguished_name(group),
                 file=sys.stderr)
         except ldap3.core.exceptions.LDAPEntryAlreadyExistsResult:  # pragma: no cover
             print(
                 "Error creating LDAP Group. Group already exists. \nRequest: ",
-                self.__ldap_attr(group, grouptype),
+                self.__ldap_attr(group, grouptype, gidnumber),
                 "\nDistinguished Name: ",
                 self.__distinguished_name(group),
                 file=sys.stderr)
 
+    def ensure(self, groups, grouptype='user', usernames=()):
+        """
+        Make sure groups exist and have the given members.
+
+        One search, projected to cn and memberUid, tells which groups exist
+        and which members they lack, so groups that are already right need
+        no write.  GIDs are looked up (one more search) only when a group
+        has to be created, and each group gains its missing members with a
+        single modify.
+
+        Args:
+            groups: names of groups that must exist
+            grouptype: 'user' or 'service', for groups that are created
+            usernames: users that must be members of every group
+
+        Returns:
+            List of changes made: ('create', group, gid) and
+            ('add_members', group, [usernames]) tuples
+
+        Raises:
+            ldap3.core.exceptions.LDAPOperationResult: a write failed
+
+        """
+        unique = OrderedDict()  # by lowercase name, as LDAP matches cn
+        for group in groups:
+            unique.setdefault(group.lower(), group)
+        if not unique:
+            return []
+
+        with self.client.primary():  # replicas may lag behind our writes
+            current = self.__read_members(unique.values())
+
+        changes = []
+        missing = [key for key in unique if key not in current]
+        if missing:
+            with self.client.primary():
+                used_ids = [
+                    result.gidNumber.value for result in self.client.search(
+                        ['(objectclass=posixGroup)'], ['gidNumber'])
+                ]
+            allocator = self.client.id_allocator(grouptype, used_ids)
+            for key in missing:
+                group = unique[key]
+                gidnumber = next(allocator)
+                check(self.client, self.client.add(
+                    self.__distinguished_name(group), API.__object_class(),
+                    self.__ldap_attr(group, grouptype, gidnumber)))
+                current[key] = (self.__distinguished_name(group), set())
+                changes.append(('create', group, gidnumber))
+
+        for key, group in unique.items():
+            distinguished_name, members = current[key]
+            added = sorted(set(usernames) - members)
+            if added:
+                API.__add_members(self.client, (group, distinguished_name,
+                                                added))
+                changes.append(('add_members', group, added))
+        return changes
+
     def delete(self, group):
         """Delete an LDAP Group."""
-        self.client.delete(self.__distinguished_name(group))
+        return self.client.delete(self.__distinguished_name(group))
 
     def add_user(self, group, username):
         """
@@ -70,7 +142,58 @@ class API:
             raise err from None
 
         operation = {'memberUid': [(ldap3.MODIFY_ADD, [username])]}
-        self.client.modify(self.__distinguished_name(group), operation)
+        return self.client.modify(self.__distinguished_name(group), operation)
+
+    def add_users_plan(self, memberships):
+        """
+        Plan adding many users to groups with one search.
+
+        The search reads the members of every group involved, so members
+        already present are skipped and each group needs a single modify
+        however many users it gains.
+
+        Args:
+            memberships: list of (group, username) tuples
+
+        Returns:
+            Tuple of a list of (group, dn, usernames) operations for groups
+            that gain members, and a sorted list of groups not found
+
+        """
+        wanted = OrderedDict()  # by lowercase name, as LDAP matches cn
+        for group, username in memberships:
+            wanted.setdefault(group.lower(), (group, []))[1].append(username)
+        if not wanted:
+            return [], []
+
+        current = self.__read_members(group for group, _ in wanted.values())
+
+        operations = []
+        for key, (group, usernames) in wanted.items():
+            if key not in current:
+                continue
+            dn, members = current[key]
+            missing = sorted(set(usernames) - members)
+            if missing:
+                operations.append((group, dn, missing))
+        return operations, sorted(group
+                                  for key, (group, _) in wanted.items()
+                                  if key not in current)
+
+    def add_users(self, operations, workers=DEFAULT_WORKERS, journal=None):
+        """
+        Add members planned by #add_users_plan, groups concurrently.
+
+        Args:
+            journal: bulk.Journal keyed by group (optional); groups it
+                lists are skipped and groups updated are added to it
+
+        Returns:
+            List of (operation, exception) tuples for groups that failed
+
+        """
+        return Executor(self.client, workers).run(API.__add_members,
+                                                  operations, journal)
 
     def remove_user(self, group, username):
         """
@@ -92,12 +215,27 @@ class API:
             raise err from None
 
         operation = {'memberUid': [(ldap3.MODIFY_DELETE, [username])]}
-        self.client.modify(self.__distinguished_name(group), operation)
+        return self.client.modify(self.__distinguished_name(group), operation)
 
-    def index(self):
-        """Return group info in a raw format."""
-        return self.client.search(["(objectclass=posixGroup)"])
+    def index(self, attributes=None, sort=None, offset=0, limit=None):
+        """
+        Return group info in a raw format.
 
+        Args:
+            attributes: attributes to fetch (optional). Defaults to all.
+            sort: attribute to sort by, prefixed with '-' for descending
+                order (optional). Defaults to cn when windowing.
+            offset: number of groups to skip
+            limit: maximum number of groups to return (optional)
+
+        """
+        filter = ["(objectclass=posixGroup)"]
+        if sort is None and offset == 0 and limit is None:
+            return self.client.search(filter, attributes)
+        return self.client.sorted_search(filter, attributes, sort or 'cn',
+                                         offset, limit)
+
+    @trace.traced('lookup_id')
     def lookup_id(self, group):
         """
         Lookup GID for the given group.
@@ -129,13 +267,39 @@ class API:
         else:
             return results[0].gidNumber.value
 
+    def __read_members(self, groups):
+        """
+        Read several groups with one search, projected to cn and memberUid.
+
+        Returns:
+            Dictionary of lowercase group name (LDAP matches cn regardless
+            of case) to a tuple of DN and set of members
+
+        """
+        filter = ['(objectclass=posixGroup)', any_of('cn', groups)]
+        return {
+            result.cn.value.lower(): (result.entry_dn,
+                                      set(result.memberUid.values))
+            for result in self.client.search(filter, ['cn', 'memberUid'])
+        }
+
+    def __add_members(client, operation):
+        _, distinguished_name, usernames = operation
+        return check(client,
+                     client.modify(distinguished_name, {
+                         'memberUid': [(ldap3.MODIFY_ADD, usernames)]
+                     }))
+
     def __distinguished_name(self, group):
         return "cn={},ou=Group,{}".format(group, self.client.basedn)
 
-    def __ldap_attr(self, group, grouptype):
+    def __ldap_attr(self, group, grouptype, gidnumber=None):
+        if gidnumber is None:
+            gidnumber = self.client.get_max_id('group', grouptype)
+
         attributes = {}
         attributes['cn'] = str.encode(group)
-        attributes['gidnumber'] = self.client.get_max_id('group', grouptype)
+        attributes['gidnumber'] = gidnumber
 
         return attributes
 
@@ -213,6 +377,103 @@ class CLI:
         except ldap3.TYPE_OR_VALUE_EXISTS:  # pragma: no cover
             print("{} already exists in {}".format(username, group))
 
+    @group.command()
+    @click.option(
+        '--group',
+        '-g',
+        'groups',
+        required=True,
+        multiple=True,
+        help='Group that must exist (repeatable)')
+    @click.option(
+        '--type',
+        '-t',
+        'grouptype',
+        type=click.Choice(['user', 'service']),
+        default='user',
+        show_default=True,
+        help='Type of groups that are created')
+    @click.option(
+        '--username',
+        '-u',
+        'usernames',
+        multiple=True,
+        help='User that must be a member of every group (repeatable)')
+    @click.pass_obj
+    def ensure(config, groups, grouptype, usernames):
+        """
+        Create groups and add members only where missing.
+
+        Prints the changes made; nothing is printed if there were none.
+        """
+        client = Client()
+        client.prepare_connection()
+        group_api = API(client)
+        try:
+            changes = group_api.ensure(groups, grouptype, usernames)
+        except ldap3.core.exceptions.LDAPOperationResult as err:
+            sys.exit('{}: {}'.format(type(err), err))
+        for action, group, detail in changes:
+            if action == 'create':
+                print('+ group {} (gid {})'.format(group, detail))
+            else:
+                print('~ group {} members: {}'.format(
+                    group, ' '.join('+' + i for i in detail)))
+
+    @group.command()
+    @click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+    @click.option(
+        '--workers',
+        '-w',
+        default=DEFAULT_WORKERS,
+        show_default=True,
+        help='Maximum number of concurrent LDAP operations')
+    @click.option(
+        '--resume',
+        is_flag=True,
+        help='Skip groups updated by a previous run (see FILENAME.journal)')
+    @click.pass_obj
+    def add_users(config, filename, workers, resume):
+        """
+        Add the users listed in a file to groups.
+
+        FILENAME has one membership per line: group and username, separated
+        by whitespace.
+        """
+        memberships = []
+        with open(filename, 'r') as FILE:
+            for number, line in enumerate(FILE, 1):
+                if not line.strip() or line.startswith('#'):
+                    continue
+                fields = line.split()
+                if len(fields) != 2:
+                    sys.exit('{}:{}: expected group and username'.format(
+                        filename, number))
+                memberships.append(tuple(fields))
+
+        client = Client()
+        client.prepare_connection()
+        group_api = API(client)
+        operations, missing = group_api.add_users_plan(memberships)
+        for group in missing:
+            print('Group ({}) not found'.format(group), file=sys.stderr)
+        if missing:
+            sys.exit(1)
+
+        def journal_key(operation):
+            # the members too, so members added to the file since are not
+            # skipped
+            group, _, usernames = operation
+            return '{} {}'.format(group, ','.join(usernames))
+
+        journal = Journal('{}.journal'.format(filename), journal_key, resume)
+        failures = group_api.add_users(operations, workers, journal)
+        journal.close(finished=not failures)
+        for (group, _, _), err in failures:
+            print('Failed: {}: {}'.format(group, err), file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
     @group.command()
     @click.option(
         '--group',
@@ -241,10 +502,21 @@ class CLI:
             print("{} does not exist in {}".format(username, group))
 
     @group.command()
+    @click.option(
+        '--attributes',
+        '-a',
+        multiple=True,
+        help='Attribute to display (repeatable); default: all')
+    @click.option(
+        '--sort', '-s', help='Attribute to sort by; prefix with - to reverse')
+    @click.option(
+        '--offset', default=0, show_default=True, help='Groups to skip')
+    @click.option('--limit', type=int, help='Maximum groups to display')
     @click.pass_obj
-    def index(config):  # pragma: no cover
+    def index(config, attributes, sort, offset, limit):  # pragma: no cover
         """Display group info in raw format."""
         client = Client()
         client.prepare_connection()
         group_api = API(client)
-        print(group_api.index())
+        print(
+            group_api.index(list(attributes) or None, sort, offset, limit))
@@ -0,0 +1,114 @@
+"""LDAP Server Health, Timeouts and Retries."""
+import random
+import threading
+import time
+
+import ldap3
+
+# Seconds each kind of operation may wait for the server
+DEFAULT_TIMEOUTS = {
+    'connect': 3,  # opening a connection
+    'read': 5,  # searches and reads by DN
+    'scan': 120,  # each page of a paged search (audits, exports)
+    'write': 10,  # add, modify, delete
+}
+DEFAULT_RETRIES = 2
+
+# Result codes meaning "try another server": busy, unavailable
+UNAVAILABLE_RESULTS = {51, 52}
+
+# Errors after which the server, not the request, is suspect
+SERVER_ERRORS = (ldap3.core.exceptions.LDAPCommunicationError,
+                 ldap3.core.exceptions.LDAPResponseTimeoutError)
+
+
+def backoff(attempt, base=0.1, cap=5):
+    """
+    Seconds to wait before a retry ("full jitter").
+
+    Waits are random so that clients which failed together do not retry
+    together.
+
+    Args:
+        attempt: number of attempts made so far, from 1
+
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def unavailable(result):
+    """Whether an operation result says the server cannot serve it."""
+    try:
+        return result['result'] in UNAVAILABLE_RESULTS
+    except (KeyError, TypeError):
+        return False
+
+
+class ServerHealth:
+    """
+    Track failing servers.
+
+    A server that fails `threshold` times in a row is demoted for
+    `cooldown` seconds, doubling with every further failure up to
+    `max_cooldown`.  Demoted servers are tried last, so a dead server
+    costs one timeout per cooldown instead of one per operation.  The
+    first success restores it.
+    """
+
+    def __init__(self, threshold=3, cooldown=30, max_cooldown=600):
+        """
+        Initialize ServerHealth.
+
+        Args:
+            threshold: consecutive failures before a server is demoted
+            cooldown: seconds a server is first demoted for
+            max_cooldown: longest demotion
+
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.__failures = {}
+        self.__demoted_until = {}
+        self.__lock = threading.Lock()
+
+    def failed(self, host):
+        """Record a failed operation."""
+        with self.__lock:
+            failures = self.__failures.get(host, 0) + 1
+            self.__failures[host] = failures
+            if failures >= self.threshold:
+                seconds = min(self.max_cooldown,
+                              self.cooldown * 2 ** (failures - self.threshold))
+                self.__demoted_until[host] = time.monotonic() + seconds
+
+    def succeeded(self, host):
+        """Record a successful operation."""
+        with self.__lock:
+            self.__failures.pop(host, None)
+            self.__demoted_until.pop(host, None)
+
+    def demoted(self, host):
+        """Whether a server is currently demoted."""
+        with self.__lock:
+            return time.monotonic() < self.__demoted_until.get(host, 0)
+
+    def order(self, hosts):
+        """Hosts with healthy ones first, otherwise in the given order."""
+        with self.__lock:
+            now = time.monotonic()
+            return sorted(
+                hosts,
+                key=lambda host: max(0, self.__demoted_until.get(host, 0) - now))
+
+    def stats(self):
+        """Dictionary of host to consecutive failures and demotion."""
+        with self.__lock:
+            now = time.monotonic()
+            return {
+                host: {
+                    'failures': failures,
+                    'demoted': now < self.__demoted_until.get(host, 0)
+                }
+                for host, failures in self.__failures.items()
+            }
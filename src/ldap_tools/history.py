@@ -0,0 +1,205 @@
+"""Historical LDAP Group Membership."""
+import datetime
+import gzip
+import json
+import os
+
+import ldap_tools.exceptions
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def parse_time(text):
+    """
+    Convert a date or date and time into a snapshot timestamp.
+
+    A bare date (2018-03-03) means the end of that day, so that querying
+    a day includes every snapshot taken on it.
+
+    Raises:
+        ldap_tools.exceptions.ArgumentError: text is not a valid date
+
+    """
+    end_of_day = {'hour': 23, 'minute': 59, 'second': 59}
+    for format, default in (('%Y-%m-%d', end_of_day), (TIME_FORMAT, {}),
+                            ('%Y-%m-%dT%H:%M:%S', {})):
+        try:
+            parsed = datetime.datetime.strptime(text, format)
+        except ValueError:
+            continue
+        # Timestamps compare as strings, so always format them in full
+        return parsed.replace(**default).strftime(TIME_FORMAT)
+    raise ldap_tools.exceptions.ArgumentError(
+        'Invalid date ({}). Use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS'.format(text))
+
+
+class History:
+    """
+    Compact on-disk history of group membership.
+
+    History is stored in gzip compressed segments of JSON lines.  Each
+    segment starts with a full copy of the membership (the base) followed
+    by one delta per snapshot holding only the members added and removed.
+    A new segment is started every `rebase_every` snapshots, which bounds
+    how many deltas have to be replayed to rebuild any point in time.
+    """
+
+    def __init__(self, path, rebase_every=30):
+        """
+        Initialize History.
+
+        Args:
+            path: directory holding the history segments
+            rebase_every: number of deltas after which a new base is written
+
+        """
+        self.path = path
+        self.rebase_every = rebase_every
+
+    def snapshot(self, membership, time=None):
+        """
+        Record the current group membership.
+
+        Args:
+            membership: dictionary of group name to list of member names,
+                as returned by ldap_tools.audit.API#by_group
+            time: snapshot timestamp (optional). Defaults to now.
+
+        Returns:
+            False if membership is unchanged since the last snapshot and
+            nothing was written, True otherwise
+
+        """
+        if time is None:
+            time = datetime.datetime.utcnow().strftime(TIME_FORMAT)
+        membership = {
+            group: sorted(set(members))
+            for group, members in membership.items()
+        }
+
+        segments = self.__segments()
+        if segments:
+            state, last_time, deltas = self.__replay(segments[-1][1])
+            if time < last_time:
+                raise ldap_tools.exceptions.ArgumentError(
+                    'Snapshot ({}) is older than the last one ({})'.format(
+                        time, last_time))
+            delta = History.__delta(state, membership)
+            if not any(delta.values()):
+                return False
+            if deltas < self.rebase_every:
+                delta['time'] = time
+                self.__append(segments[-1][1], delta)
+                return True
+
+        os.makedirs(self.path, exist_ok=True)
+        filename = os.path.join(self.path, 'membership-{}.jsonl.gz'.format(
+            time.replace('-', '').replace(':', '')))
+        self.__append(filename, {'time': time, 'base': membership})
+        return True
+
+    def at(self, time):
+        """
+        Rebuild group membership as of the given time.
+
+        Returns:
+            Dictionary of group name to sorted list of member names, or None
+            if no snapshot is that old
+
+        """
+        segment = None
+        for base_time, filename in self.__segments():
+            if base_time <= time:
+                segment = filename
+        if segment is None:
+            return None
+        state, _, _ = self.__replay(segment, until=time)
+        return state
+
+    def changes(self, start, end):
+        """
+        Net membership changes between two points in time.
+
+        Returns:
+            Dictionary of group name to {'added': [...], 'removed': [...]}
+            for every group whose membership changed
+
+        """
+        old = self.at(start) or {}
+        new = self.at(end) or {}
+        changes = {}
+        for group in sorted(set(old) | set(new)):
+            before = set(old.get(group, []))
+            after = set(new.get(group, []))
+            if before != after:
+                changes[group] = {
+                    'added': sorted(after - before),
+                    'removed': sorted(before - after)
+                }
+        return changes
+
+    def __segments(self):
+        """Sorted list of (base time, filename) tuples."""
+        if not os.path.isdir(self.path):
+            return []
+        segments = []
+        for name in os.listdir(self.path):
+            if name.startswith('membership-') and name.endswith('.jsonl.gz'):
+                filename = os.path.join(self.path, name)
+                with gzip.open(filename, 'rt') as FILE:
+                    segments.append((json.loads(FILE.readline())['time'],
+                                     filename))
+        return sorted(segments)
+
+    def __replay(self, filename, until=None):
+        """Replay a segment; returns (state, time of last record, deltas)."""
+        state = {}
+        time = None
+        deltas = -1
+        with gzip.open(filename, 'rt') as FILE:
+            for line in FILE:
+                record = json.loads(line)
+                if until is not None and record['time'] > until:
+                    break
+                time = record['time']
+                deltas += 1
+                if 'base' in record:
+                    state = {
+                        group: set(members)
+                        for group, members in record['base'].items()
+                    }
+                    continue
+                for group in record['deleted']:
+                    state.pop(group, None)
+                for group in record['created']:
+                    state[group] = set()
+                for group, members in record['add'].items():
+                    state[group].update(members)
+                for group, members in record['remove'].items():
+                    state[group].difference_update(members)
+        return ({group: sorted(members)
+                 for group, members in state.items()}, time, deltas)
+
+    def __append(self, filename, record):
+        # Appending starts a new gzip member; readers see one stream
+        with gzip.open(filename, 'at') as FILE:
+            FILE.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def __delta(old, new):
+        delta = {
+            'created': sorted(set(new) - set(old)),
+            'deleted': sorted(set(old) - set(new)),
+            'add': {},
+            'remove': {}
+        }
+        for group in new:
+            added = sorted(set(new[group]) - set(old.get(group, [])))
+            if added:
+                delta['add'][group] = added
+        for group in old:
+            if group not in new:
+                continue
+            removed = sorted(set(old[group]) - set(new[group]))
+            if removed:
+                delta['remove'][group] = removed
+        return delta
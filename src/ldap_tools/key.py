@@ -1,16 +1,69 @@
 """LDAP Key Management API."""
+import hashlib
 import os
 import sys
 from collections import Counter
+from collections import OrderedDict
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 import click
 import ldap3
+import yaml
 from sshpubkeys import SSHKey
 
 import ldap_tools.exceptions
+from ldap_tools.bulk import DEFAULT_WORKERS
+from ldap_tools.bulk import Executor
+from ldap_tools.bulk import Journal
+from ldap_tools.bulk import check
 from ldap_tools.client import Client
+from ldap_tools.client import any_of
 from ldap_tools.user import API as UserApi
 
+KeyInfo = namedtuple('KeyInfo', ['sha256', 'md5', 'type', 'bits', 'error'])
+Rotation = namedtuple('Rotation', ['username', 'dn', 'keys', 'added', 'removed'])
+
+# Key types that are weak at any size, and minimum sizes for the others
+WEAK_KEY_TYPES = {'ssh-dss'}
+MIN_KEY_BITS = {'ssh-rsa': 2048, 'ecdsa-sha2-nistp256': 256}
+
+# Usernames per (|(uid=...)) filter when fetching keys for a set of users
+BATCH_SIZE = 200
+
+# Below this many unparsed keys, starting worker processes costs more than
+# it saves
+POOL_THRESHOLD = 256
+
+_fingerprints = {}  # KeyInfo by hash of the key data, see #fingerprint
+
+
+def fingerprint(key):
+    """
+    Parse an SSH public key.
+
+    Args:
+        key: public key in authorized_keys format (str)
+
+    Returns:
+        KeyInfo; for keys that cannot be parsed only error is set
+
+    """
+    ssh_key = SSHKey(key, strict=False)
+    try:
+        ssh_key.parse()
+    except Exception as err:
+        return KeyInfo(None, None, None, None, '{}: {}'.format(
+            type(err).__name__, err))
+    return KeyInfo(ssh_key.hash_sha256(), ssh_key.hash_md5(),
+                   ssh_key.key_type.decode(), ssh_key.bits, None)
+
+
+def is_weak(info):
+    """Check a parsed key against WEAK_KEY_TYPES and MIN_KEY_BITS."""
+    return (info.type in WEAK_KEY_TYPES or
+            info.bits < MIN_KEY_BITS.get(info.type, 0))
+
 
 class API:
     """Methods to handle LDAP SSH key management."""
@@ -54,7 +107,7 @@ class API:
         """Remove specified SSH public key from specified user."""
         self.keys = API.__get_keys(filename)
         self.username = username
-        user = user_api.find(username)[0]
+        user = user_api.find(username, [ldap3.NO_ATTRIBUTES])[0]
 
         if not force:  # pragma: no cover
             self.__confirm()
@@ -63,16 +116,136 @@ class API:
             operation = {'sshPublicKey': [(ldap3.MODIFY_DELETE, [key])]}
             self.client.modify(user.entry_dn, operation)
 
-    def install(self):  # pragma: no cover
-        """Install/download ssh keys from LDAP for consumption by SSH."""
-        keys = self.get_keys_from_ldap()
-        for user, ssh_keys in keys.items():
-            user_dir = API.__authorized_keys_path(user)
-            if not os.path.isdir(user_dir):
-                os.makedirs(user_dir)
-            authorized_keys_file = os.path.join(user_dir, 'authorized_keys')
-            with open(authorized_keys_file, 'w') as FILE:
-                print("\n".join([k.decode() for k in ssh_keys]), file=FILE)
+    def install(self, groups=None):
+        """
+        Install/download ssh keys from LDAP for consumption by SSH.
+
+        Args:
+            groups: only install keys of members of these groups (optional)
+
+        Users that have an authorized_keys file but no keys to install,
+        e.g. because they left every one of `groups`, get their file
+        removed, so revoking access takes effect on the host.
+
+        Returns:
+            List of users whose authorized_keys file changed or was removed
+
+        """
+        if groups:
+            keys = self.get_keys_for_users(self.group_members(groups))
+        else:
+            keys = {}
+            for response in self.client.sharded_stream(
+                    ['(sshPublicKey=*)'], ['uid', 'sshPublicKey'], 'uid'):
+                values = response['raw_attributes']
+                keys[values['uid'][0].decode()] = values['sshPublicKey']
+
+        written = []
+        for user, ssh_keys in sorted(keys.items()):
+            if API.__write_authorized_keys(user, ssh_keys):
+                written.append(user)
+        for user in sorted(API.__installed_users() - set(keys)):
+            API.__remove_authorized_keys(user)
+            written.append(user)
+        return written
+
+    def watch(self, groups=None, poll_interval=60):
+        """
+        Keep authorized_keys files in sync with LDAP.
+
+        After one full #install, changes are followed on a long lived
+        connection (see ldap_tools.client.Client#watch) and only the
+        affected user's file is rewritten.  A change to one of `groups`
+        re-resolves its members, removes the file of every user who left
+        and reinstalls the keys of the others.
+
+        Returns:
+            A never ending generator of (change type, username) tuples for
+            every change applied
+
+        """
+        self.install(groups)
+        allowed = self.group_members(groups) if groups else None
+        filter = ['(|(objectclass=posixAccount)(objectclass=posixGroup))']
+        attributes = ['objectClass', 'uid', 'cn', 'sshPublicKey']
+        for change_type, dn, raw_attributes in self.client.watch(
+                filter, attributes, poll_interval):
+            values = {
+                name.lower(): [v.decode() if isinstance(v, bytes) else v
+                               for v in value]
+                for name, value in raw_attributes.items()
+            }
+            object_class = {i.lower() for i in values.get('objectclass', [])}
+            if 'posixgroup' in object_class:
+                if groups and set(values.get('cn', [])) & set(groups):
+                    members = self.group_members(groups)
+                    for username in sorted(allowed - members):
+                        API.__remove_authorized_keys(username)
+                        yield 'delete', username
+                    allowed = members
+                    self.install(groups)
+                    yield change_type, None
+                continue
+
+            username = (values.get('uid') or [None])[0]
+            if username is None or (allowed is not None and
+                                    username not in allowed):
+                continue
+            if change_type == 'delete':
+                API.__remove_authorized_keys(username)
+            else:
+                API.__write_authorized_keys(username,
+                                            values.get('sshpublickey', []))
+            yield change_type, username
+
+    def group_members(self, groups):
+        """
+        Resolve the members of several groups with one search.
+
+        Returns:
+            Set of usernames
+
+        Raises:
+            ldap_tools.exceptions.NoGroupsFound:
+                One of the groups does not exist
+
+        """
+        filter = ['(objectclass=posixGroup)', any_of('cn', groups)]
+        results = self.client.search(filter, ['cn', 'memberUid'])
+        found = {result.cn.value.lower() for result in results}
+        missing = {group for group in groups if group.lower() not in found}
+        if missing:
+            raise ldap_tools.exceptions.NoGroupsFound(
+                'Group(s) ({}) not found'.format(', '.join(sorted(missing))))
+        members = set()
+        for result in results:
+            members.update(result.memberUid.values)
+        return members
+
+    def get_keys_for_users(self, usernames, batch_size=BATCH_SIZE):
+        """
+        Fetch keys for a set of users.
+
+        Users are looked up `batch_size` at a time with (|(uid=...)...)
+        filters instead of downloading every key in the directory.
+
+        Returns:
+            Dictionary in '{username: [public keys]}' format
+
+        """
+        result_dict = {}
+        for result in self.__search_users('(sshPublicKey=*)', usernames,
+                                          batch_size):
+            result_dict[result.uid.value] = result.sshPublicKey.values
+        return result_dict
+
+    def __search_users(self, filter, usernames, batch_size=BATCH_SIZE):
+        """uid and sshPublicKey of users, `batch_size` users a search."""
+        usernames = sorted(usernames)
+        for start in range(0, len(usernames), batch_size):
+            yield from self.client.search(
+                [filter, any_of('uid', usernames[start:start + batch_size])],
+                ['uid', 'sshPublicKey'])
 
     def get_keys_from_ldap(self, username=None):
         """
@@ -97,6 +270,315 @@ class API:
         # for key, value results[0].items():
         #     yield value
 
+    def fingerprints(self, keys, workers=DEFAULT_WORKERS):
+        """
+        Fingerprint many SSH public keys.
+
+        Keys are memoized by a hash of their key data (comments are
+        ignored), so each distinct key is parsed once per process.  Large
+        batches of new keys are parsed in a pool of `workers` processes.
+
+        Returns:
+            Dictionary of key to KeyInfo
+
+        """
+        digests = {key: API.__key_digest(key) for key in keys}
+        pending = {}
+        for key, digest in digests.items():
+            if digest not in _fingerprints:
+                pending.setdefault(digest, key)
+
+        if workers > 1 and len(pending) >= POOL_THRESHOLD:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                infos = pool.map(
+                    fingerprint,
+                    list(pending.values()),
+                    chunksize=max(len(pending) // (workers * 4), 1))
+                _fingerprints.update(zip(pending, infos))
+        else:
+            for digest, key in pending.items():
+                _fingerprints[digest] = fingerprint(key)
+
+        return {key: _fingerprints[digest] for key, digest in digests.items()}
+
+    def index(self, workers=DEFAULT_WORKERS):
+        """
+        Map every SSH public key in LDAP to the users that have it.
+
+        Keys are fetched with one paged search, sharded by uid (see
+        ldap_tools.client.Client#sharded_stream).
+
+        Returns:
+            Tuple of a dictionary of SHA256 fingerprint to (KeyInfo, sorted
+            list of usernames) and a list of (username, key, KeyInfo) for
+            keys that could not be parsed
+
+        """
+        user_keys = []
+        for response in self.client.sharded_stream(
+                ['(sshPublicKey=*)'], ['uid', 'sshPublicKey'], 'uid'):
+            username = response['raw_attributes']['uid'][0].decode()
+            for key in response['raw_attributes']['sshPublicKey']:
+                user_keys.append((username, key.decode().strip()))
+
+        infos = self.fingerprints({key for _, key in user_keys}, workers)
+        index = {}
+        invalid = []
+        for username, key in user_keys:
+            info = infos[key]
+            if info.error is not None:
+                invalid.append((username, key, info))
+                continue
+            index.setdefault(info.sha256, (info, set()))[1].add(username)
+        return ({fp: (info, sorted(users))
+                 for fp, (info, users) in index.items()}, invalid)
+
+    def who_has(self, target, workers=DEFAULT_WORKERS):
+        """
+        Find the users that trust a key.
+
+        Args:
+            target: SHA256 or MD5 fingerprint (as printed by ssh-keygen -l),
+                or the name of a file holding public keys
+
+        Returns:
+            Dictionary of SHA256 fingerprint to (KeyInfo, list of usernames)
+            for every matching key
+
+        """
+        if os.path.isfile(target):
+            wanted = {
+                info.sha256
+                for info in self.fingerprints(
+                    API.__get_key_from_file(target), 1).values()
+                if info.error is None
+            }
+
+            def matches(info):
+                return info.sha256 in wanted
+        elif target.upper().startswith('MD5:') or ':' in target[:3]:
+            md5 = target.split(':', 1)[1] if target.upper().startswith(
+                'MD5:') else target
+
+            def matches(info):
+                return info.md5.split(':', 1)[1].lower() == md5.lower()
+        else:
+            sha256 = target if target.startswith('SHA256:') else (
+                'SHA256:' + target)
+
+            def matches(info):
+                return info.sha256 == sha256.rstrip('=')
+
+        index, _ = self.index(workers)
+        return {
+            fp: entry
+            for fp, entry in index.items() if matches(entry[0])
+        }
+
+    def audit(self, workers=DEFAULT_WORKERS):
+        """
+        Find keys shared by several users, weak keys and invalid keys.
+
+        Returns:
+            Dictionary with 'duplicate' and 'weak' lists of (fingerprint,
+            KeyInfo, usernames) and an 'invalid' list of (username, key,
+            KeyInfo)
+
+        """
+        index, invalid = self.index(workers)
+        report = {'duplicate': [], 'weak': [], 'invalid': invalid}
+        for fp in sorted(index):
+            info, users = index[fp]
+            if len(users) > 1:
+                report['duplicate'].append((fp, info, users))
+            if is_weak(info):
+                report['weak'].append((fp, info, users))
+        return report
+
+    def load_manifest(filename):
+        """
+        Load a key rotation manifest.
+
+        The manifest is a YAML mapping of username to the complete list of
+        keys the user should have after the rotation:
+
+            jane.doe:
+              - ssh-ed25519 AAAA... jane@laptop
+            john.doe: []
+
+        Returns:
+            Dictionary of username to list of keys
+
+        Raises:
+            ldap_tools.exceptions.ArgumentError: the manifest is invalid
+
+        """
+        with open(filename, 'r') as FILE:
+            manifest = yaml.safe_load(FILE) or {}
+        if not isinstance(manifest, dict):
+            raise ldap_tools.exceptions.ArgumentError(
+                'Manifest ({}) must map usernames to keys'.format(filename))
+
+        keys = {}
+        for username, user_keys in manifest.items():
+            if isinstance(user_keys, str):
+                user_keys = [user_keys]
+            if not isinstance(user_keys, list):
+                raise ldap_tools.exceptions.ArgumentError(
+                    'Keys for user ({}) must be a list'.format(username))
+            if not all(isinstance(k, str) for k in user_keys if k):
+                raise ldap_tools.exceptions.ArgumentError(
+                    'Keys for user ({}) must be strings'.format(username))
+            keys[str(username)] = list(
+                OrderedDict.fromkeys(k.strip() for k in user_keys if k))
+        return keys
+
+    def rotation_plan(self, manifest, workers=DEFAULT_WORKERS):
+        """
+        Compute key changes for a manifest with one bulk read.
+
+        Args:
+            manifest: dictionary of username to keys, see #load_manifest
+
+        Returns:
+            Tuple of a list of Rotation tuples for users whose keys change,
+            a sorted list of usernames not found in LDAP, and a list of
+            (username, key, KeyInfo) for keys that could not be parsed
+
+        """
+        infos = self.fingerprints(
+            {key for keys in manifest.values() for key in keys}, workers)
+        invalid = [(username, key, infos[key])
+                   for username, keys in sorted(manifest.items())
+                   for key in keys if infos[key].error is not None]
+
+        usernames = sorted(manifest)
+        current = self.__read_keys(usernames)
+
+        rotations = []
+        for username in usernames:
+            if username not in current:
+                continue
+            dn, have = current[username]
+            want = manifest[username]
+            if set(have) != set(want):
+                rotations.append(
+                    Rotation(username, dn, want,
+                             [k for k in want if k not in have],
+                             [k for k in have if k not in want]))
+        return rotations, sorted(set(manifest) - set(current)), invalid
+
+    def ensure(self, keys):
+        """
+        Add keys to users only where missing.
+
+        The keys users have are read with one search per BATCH_SIZE users,
+        projected to uid and sshPublicKey.  Keys are compared by their key
+        data, ignoring options and comments, and each user that lacks keys
+        gets them with a single MODIFY_ADD; users that have them all need
+        no write.
+
+        Args:
+            keys: dictionary of username to keys that must be present, see
+                #load_manifest
+
+        Returns:
+            Tuple of a list of (username, added keys) tuples and a sorted
+            list of usernames not found
+
+        Raises:
+            ldap_tools.exceptions.ArgumentError: a key to add is invalid
+            ldap3.core.exceptions.LDAPOperationResult: a modify failed
+
+        """
+        with self.client.primary():  # replicas may lag behind our writes
+            current = self.__read_keys(sorted(keys))
+
+        additions = []
+        for username in sorted(current):
+            dn, have = current[username]
+            digests = {API.__key_digest(key) for key in have}
+            added = []
+            for key in keys[username]:
+                digest = API.__key_digest(key)
+                if digest in digests:
+                    continue
+                error = fingerprint(key).error
+                if error is not None:
+                    raise ldap_tools.exceptions.ArgumentError(
+                        'Invalid key for user ({}): {}'.format(username,
+                                                               error))
+                digests.add(digest)
+                added.append(key)
+            if added:
+                additions.append((username, dn, added))
+
+        for username, dn, added in additions:
+            operation = {'sshPublicKey': [(ldap3.MODIFY_ADD, added)]}
+            check(self.client, self.client.modify(dn, operation))
+        return ([(username, added) for username, _, added in additions],
+                sorted(set(keys) - set(current)))
+
+    def rotate(self, rotations, workers=DEFAULT_WORKERS, progress=None,
+               journal=None):
+        """
+        Replace keys planned by #rotation_plan.
+
+        Each user gets a single MODIFY_REPLACE, sent concurrently on up to
+        `workers` connections.
+
+        Args:
+            progress: callable taking the number of users just finished
+                (optional), e.g. the update method of a click.progressbar
+            journal: bulk.Journal keyed by username (optional); users it
+                lists are skipped and users rotated are added to it
+
+        Returns:
+            List of (Rotation, exception) tuples for users that failed
+
+        """
+        failures = []
+        executor = Executor(self.client, workers)
+        try:
+            for rotation, _, error in executor.results(
+                    API.__replace_keys, rotations, journal):
+                if error is not None:
+                    failures.append((rotation, error))
+                if progress is not None:
+                    progress(1)
+        finally:
+            executor.close()
+        return failures
+
+    def __read_keys(self, usernames):
+        """
+        Dictionary of username to (dn, keys), BATCH_SIZE users a search.
+
+        uid matches without case, so users are keyed by the username asked
+        for rather than the uid LDAP returns.
+        """
+        requested = {username.lower(): username for username in usernames}
+        current = {}
+        for result in self.__search_users('(objectclass=posixAccount)',
+                                          usernames):
+            username = requested.get(result.uid.value.lower(),
+                                     result.uid.value)
+            current[username] = (result.entry_dn, [
+                k.decode().strip() if isinstance(k, bytes) else k.strip()
+                for k in result.sshPublicKey.values
+            ])
+        return current
+
+    def __replace_keys(client, rotation):
+        operation = {'sshPublicKey': [(ldap3.MODIFY_REPLACE, rotation.keys)]}
+        return check(client, client.modify(rotation.dn, operation))
+
+    def __key_digest(key):
+        fields = key.split()
+        # options and comments don't change the key itself
+        data = next((i for i in fields if i.startswith('AAAA')), key)
+        return hashlib.sha1(data.encode()).hexdigest()
+
     def __get_key_from_file(filename):
         """
         Get SSH public keys from file.
@@ -146,6 +628,40 @@ class API:
         if not click.confirm('Delete these keys?'):
             sys.exit('Deletion of key aborted')
 
+    def __write_authorized_keys(user, ssh_keys):
+        """Write a user's authorized_keys file unless it is up to date."""
+        user_dir = API.__authorized_keys_path(user)
+        authorized_keys_file = os.path.join(user_dir, 'authorized_keys')
+        content = "\n".join([
+            k.decode() if isinstance(k, bytes) else k for k in ssh_keys
+        ]) + "\n"
+        if os.path.isfile(authorized_keys_file):
+            with open(authorized_keys_file, 'r') as FILE:
+                if FILE.read() == content:
+                    return False
+        if not os.path.isdir(user_dir):
+            os.makedirs(user_dir)
+        with open(authorized_keys_file, 'w') as FILE:
+            FILE.write(content)
+        return True
+
+    def __remove_authorized_keys(user):
+        authorized_keys_file = os.path.join(
+            API.__authorized_keys_path(user), 'authorized_keys')
+        if os.path.isfile(authorized_keys_file):
+            os.remove(authorized_keys_file)
+
+    def __installed_users():
+        """Users that have an authorized_keys file installed."""
+        root = os.path.dirname(API.__authorized_keys_path('user'))
+        if not os.path.isdir(root):
+            return set()
+        return {
+            user for user in os.listdir(root) if os.path.isfile(
+                os.path.join(API.__authorized_keys_path(user),
+                             'authorized_keys'))
+        }
+
     def __authorized_keys_path(user):
         return os.path.join(os.sep, 'etc', 'ssh', 'users', user)
 
@@ -201,13 +717,202 @@ class CLI:
         key_api.remove(username, user_api, filename, force)
 
     @key.command()
+    @click.option(
+        '--group',
+        '-g',
+        'groups',
+        multiple=True,
+        help='Only install keys of members of this group (repeatable)')
+    @click.option(
+        '--watch',
+        is_flag=True,
+        help='Keep running and apply changes as they happen')
+    @click.option(
+        '--interval',
+        default=60,
+        show_default=True,
+        help='Seconds between polls when watching without persistent search')
     @click.pass_obj
-    def install(config):  # pragma: no cover
+    def install(config, groups, watch, interval):  # pragma: no cover
         """Install user's SSH public key to the local system."""
         client = Client()
         client.prepare_connection()
         key_api = API(client)
-        key_api.install()
+        try:
+            if not watch:
+                key_api.install(groups)
+                return
+            for change_type, username in key_api.watch(groups, interval):
+                print('{}: {}'.format(change_type, username or 'group'))
+        except ldap_tools.exceptions.NoGroupsFound as err:
+            sys.exit(err.args[0])
+        except KeyboardInterrupt:
+            pass
+
+    @key.command()
+    @click.argument('target')
+    @click.option(
+        '--workers',
+        '-w',
+        default=DEFAULT_WORKERS,
+        show_default=True,
+        help='Processes used to parse keys')
+    @click.pass_obj
+    def who_has(config, target, workers):
+        """
+        Show users that have a key.
+
+        TARGET is a SHA256 or MD5 fingerprint, or a public key file.
+        """
+        client = Client()
+        client.prepare_connection()
+        key_api = API(client)
+        matches = key_api.who_has(target, workers)
+        if not matches:
+            sys.exit('No users have this key')
+        for fp, (info, users) in sorted(matches.items()):
+            print('{} ({} {}): {}'.format(fp, info.type, info.bits,
+                                          ', '.join(users)))
+
+    @key.command()
+    @click.option(
+        '--workers',
+        '-w',
+        default=DEFAULT_WORKERS,
+        show_default=True,
+        help='Processes used to parse keys')
+    @click.pass_obj
+    def audit(config, workers):
+        """Report shared, weak and invalid SSH public keys."""
+        client = Client()
+        client.prepare_connection()
+        key_api = API(client)
+        report = key_api.audit(workers)
+
+        print('Keys shared by several users:')
+        for fp, info, users in report['duplicate']:
+            print('\t{}: {}'.format(fp, ', '.join(users)))
+        print('Weak keys:')
+        for fp, info, users in report['weak']:
+            print('\t{} ({} {}): {}'.format(fp, info.type, info.bits,
+                                            ', '.join(users)))
+        print('Invalid keys:')
+        for username, key, info in report['invalid']:
+            print('\t{}: {} ({})'.format(username, key[:40], info.error))
+
+    @key.command()
+    @click.option(
+        '--username',
+        '-u',
+        'usernames',
+        multiple=True,
+        help='User that must have the keys (repeatable)')
+    @click.option(
+        '--filename',
+        '-f',
+        type=click.File('r'),
+        default='-',
+        help='File to load keys from; default: stdin')
+    @click.option(
+        '--manifest',
+        '-m',
+        type=click.Path(exists=True),
+        help='YAML file mapping usernames to keys they must have')
+    @click.pass_obj
+    def ensure(config, usernames, filename, manifest):
+        """
+        Add SSH public keys to users only where missing.
+
+        Prints the keys added; nothing is printed if every user had them.
+        """
+        if not usernames and manifest is None:
+            sys.exit('Specify --username or --manifest')
+        try:
+            keys = API.load_manifest(manifest) if manifest else {}
+        except ldap_tools.exceptions.ArgumentError as err:
+            sys.exit(err.args[0])
+        if usernames:
+            user_keys = [k.strip() for k in filename if k.strip()]
+            for username in usernames:
+                keys.setdefault(username, []).extend(user_keys)
+
+        client = Client()
+        client.prepare_connection()
+        key_api = API(client)
+        try:
+            added, missing = key_api.ensure(keys)
+        except (ldap_tools.exceptions.ArgumentError,
+                ldap3.core.exceptions.LDAPOperationResult) as err:
+            sys.exit('{}: {}'.format(type(err), err))
+        for username, user_keys in added:
+            print('~ user {} keys: +{} key(s)'.format(username,
+                                                      len(user_keys)))
+        for username in missing:
+            print('User ({}) not found'.format(username), file=sys.stderr)
+        if missing:
+            sys.exit(1)
+
+    @key.command()
+    @click.option(
+        '--manifest',
+        '-m',
+        required=True,
+        type=click.Path(exists=True),
+        help='YAML file mapping usernames to their new keys')
+    @click.option(
+        '--workers',
+        '-w',
+        default=DEFAULT_WORKERS,
+        show_default=True,
+        help='Maximum number of concurrent LDAP operations')
+    @click.option('--dry-run', is_flag=True, help='Only show the changes')
+    @click.option(
+        '--resume',
+        is_flag=True,
+        help='Skip users rotated by a previous run (see MANIFEST.journal)')
+    @click.pass_obj
+    def rotate(config, manifest, workers, dry_run, resume):
+        """Replace the keys of many users at once."""
+        try:
+            keys = API.load_manifest(manifest)
+        except ldap_tools.exceptions.ArgumentError as err:
+            sys.exit(err.args[0])
+        client = Client()
+        client.prepare_connection()
+        key_api = API(client)
+        rotations, missing, invalid = key_api.rotation_plan(keys, workers)
+
+        for username in missing:
+            print('User ({}) not found'.format(username), file=sys.stderr)
+        for username, key, info in invalid:
+            print('Invalid key for {}: {} ({})'.format(username, key[:40],
+                                                       info.error),
+                  file=sys.stderr)
+        if missing or invalid:
+            sys.exit(1)
+        for rotation in rotations:
+            print('{}: +{} -{} key(s)'.format(
+                rotation.username, len(rotation.added), len(rotation.removed)))
+        if dry_run or not rotations:
+            return
+
+        def journal_key(rotation):
+            # the keys too, so users whose keys the manifest changes since
+            # are rotated again
+            digest = hashlib.sha1('\n'.join(sorted(rotation.keys)).encode())
+            return '{} {}'.format(rotation.username, digest.hexdigest())
+
+        journal = Journal('{}.journal'.format(manifest), journal_key, resume)
+        with click.progressbar(
+                length=len(rotations), label='Rotating keys',
+                file=sys.stderr) as bar:
+            failures = key_api.rotate(rotations, workers, bar.update, journal)
+        journal.close(finished=not failures)
+        for rotation, err in failures:
+            print('Failed: {}: {}'.format(rotation.username, err),
+                  file=sys.stderr)
+        if failures:
+            sys.exit(1)
 
     @key.command()
     @click.pass_obj
@@ -0,0 +1,323 @@
+"""LDIF Export and Import."""
+import base64
+import gzip
+import lzma
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import click
+import ldap3
+from ldap3.protocol.rfc2849 import safe_ldif_string
+from ldap3.utils.dn import to_dn
+
+from ldap_tools.bulk import DEFAULT_WORKERS
+from ldap_tools.bulk import Executor
+from ldap_tools.bulk import check
+from ldap_tools.client import Client
+
+COMPRESSION = {'.gz': gzip.open, '.xz': lzma.open}
+
+
+def open_file(filename, mode):
+    """
+    Open an LDIF file in binary mode.
+
+    Files ending in .gz or .xz are (de)compressed on the fly, and '-'
+    stands for stdin or stdout.
+    """
+    if filename == '-':
+        return click.open_file(filename, mode + 'b')
+    opener = COMPRESSION.get(os.path.splitext(filename)[1], open)
+    return opener(filename, mode + 'b')
+
+
+def write_entry(FILE, dn, attributes):
+    """
+    Write one LDIF content record.
+
+    Args:
+        FILE: binary file
+        dn: distinguished name of the entry
+        attributes: dictionary of attribute name to list of values
+            (bytes or str)
+
+    """
+    lines = [attribute_line('dn', dn)]
+    for name, values in attributes.items():
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        lines.extend(attribute_line(name, value) for value in values)
+    FILE.write(b'\n'.join(lines) + b'\n\n')
+
+
+def read_entries(FILE):
+    """
+    Parse LDIF content records incrementally.
+
+    Args:
+        FILE: binary file; only one record is held in memory at a time
+
+    Returns:
+        A generator of (offset, dn, attributes) tuples, where offset is the
+        byte position of the record in FILE and attributes is an ordered
+        dictionary of attribute name to list of bytes values
+
+    Raises:
+        ldap3.core.exceptions.LDAPLDIFError: the input is not valid LDIF
+
+    """
+    offset = 0
+    start = None
+    lines = []
+    for raw in iter(FILE.readline, b''):
+        line = raw.rstrip(b'\r\n')
+        if not line:
+            record = _record(lines) if lines else None
+            if record is not None:
+                yield (start, ) + record
+            lines = []
+        elif line.startswith(b' '):
+            if lines and lines[-1] is not None:  # else a folded comment
+                lines[-1] += line[1:]
+        elif line.startswith(b'#'):
+            lines.append(None)  # comments may be continued too
+        else:
+            if all(i is None for i in lines):
+                start = offset  # records start at their first non-comment
+            lines.append(line)
+        offset += len(raw)
+    record = _record(lines) if lines else None
+    if record is not None:
+        yield (start, ) + record
+
+
+def attribute_line(name, value):
+    """Format one attribute value as an LDIF line, base64 encoded if needed."""
+    if isinstance(value, str):
+        value = value.encode()
+    elif not isinstance(value, bytes):
+        value = str(value).encode()
+    if safe_ldif_string(value):
+        return name.encode() + b': ' + value
+    return name.encode() + b':: ' + base64.b64encode(value)
+
+
+def _record(lines):
+    dn = None
+    attributes = OrderedDict()
+    for line in lines:
+        if line is None:
+            continue
+        name, separator, value = line.partition(b':')
+        if not separator:
+            raise ldap3.core.exceptions.LDAPLDIFError(
+                'Invalid LDIF line: {}'.format(line[:80]))
+        name = name.decode()
+        if value.startswith(b':'):
+            value = base64.b64decode(value[1:].strip())
+        elif value.startswith(b'<'):
+            raise ldap3.core.exceptions.LDAPLDIFError(
+                'URL values are not supported: {}'.format(name))
+        else:
+            value = value.lstrip(b' ')
+
+        if name == 'version' and dn is None and not attributes:
+            continue
+        elif name == 'dn':
+            dn = value.decode()
+        elif name.lower() == 'changetype':
+            raise ldap3.core.exceptions.LDAPLDIFError(
+                'Only LDIF content records are supported ({})'.format(dn))
+        else:
+            attributes.setdefault(name, []).append(value)
+    if dn is None and not attributes:
+        return None  # version line or comments only
+    elif dn is None:
+        raise ldap3.core.exceptions.LDAPLDIFError(
+            'LDIF record without a dn: {}'.format(lines[0]))
+    return dn, attributes
+
+
+class API:
+    """Methods to dump and load LDAP entries as LDIF."""
+
+    def __init__(self, client):
+        """Initialize LDIF API and LDAP Client."""
+        self.client = client
+
+    def dump(self, FILE, filter=None, attributes=None):
+        """
+        Write LDAP entries to FILE as LDIF.
+
+        Results are fetched with a paged search (sharded by OU, see
+        Client#sharded_stream) and written as they arrive, so memory use
+        does not depend on the size of the directory.
+
+        Returns:
+            Number of entries written
+
+        """
+        count = 0
+        FILE.write(b'version: 1\n\n')
+        for response in self.client.sharded_stream(filter, attributes):
+            write_entry(FILE, response['dn'], response['raw_attributes'])
+            count += 1
+        return count
+
+    def load(self,
+             FILE,
+             workers=DEFAULT_WORKERS,
+             checkpoint=None,
+             skip=0,
+             checkpoint_every=100):
+        """
+        Add the entries in an LDIF file to LDAP.
+
+        Entries are added concurrently on up to `workers` connections.  An
+        entry whose parent is still being added waits for it, and entries
+        that already exist are counted as loaded, so loads can be rerun.
+
+        Args:
+            FILE: binary LDIF file
+            checkpoint: callable taking the number of leading records that
+                are done (optional). Called every `checkpoint_every` records
+                and at the end, so a failed load can be resumed with `skip`.
+            skip: number of leading records to skip
+
+        Returns:
+            List of (dn, exception) tuples for entries that failed
+
+        """
+        records = (
+            (index, dn, attributes)
+            for index, (_, dn, attributes) in enumerate(read_entries(FILE))
+            if index >= skip)
+        in_flight = {}
+        lock = threading.Lock()
+
+        def add(client, record):
+            index, dn, attributes = record
+            with lock:
+                parent = in_flight.get(API.__key(to_dn(dn)[1:]))
+            if parent is not None:
+                parent.wait()
+            try:
+                return API.__add(client, dn, attributes)
+            finally:
+                with lock:
+                    in_flight.pop(API.__key(to_dn(dn))).set()
+
+        def submitted():
+            for record in records:
+                with lock:
+                    in_flight[API.__key(to_dn(record[1]))] = threading.Event()
+                yield record
+
+        failures = []
+        done = set()
+        mark = saved = skip
+        for (index, dn, _), result, error in Executor(
+                self.client, workers).results(add, submitted()):
+            if error is not None:
+                failures.append((dn, error))
+                continue
+            done.add(index)
+            while mark in done:
+                done.remove(mark)
+                mark += 1
+            if checkpoint is not None and mark - saved >= checkpoint_every:
+                checkpoint(mark)
+                saved = mark
+        if checkpoint is not None and mark != saved:
+            checkpoint(mark)
+        return failures
+
+    def __add(client, dn, attributes):
+        object_class = [
+            i.decode() for i in next((values
+                                      for name, values in attributes.items()
+                                      if name.lower() == 'objectclass'), [])
+        ]
+        attributes = {
+            name: values
+            for name, values in attributes.items()
+            if name.lower() != 'objectclass'
+        }
+        try:
+            return check(client, client.add(dn, object_class, attributes))
+        except ldap3.core.exceptions.LDAPEntryAlreadyExistsResult:
+            return False
+
+    def __key(parts):
+        """Comparable form of a DN split into its parts."""
+        return ','.join(i.strip() for i in parts).lower()
+
+
+class CLI:
+    """Commands to dump and load LDAP entries as LDIF."""
+
+    @click.command()
+    @click.option(
+        '--output',
+        '-o',
+        default='-',
+        help='File to write (.gz and .xz are compressed); default: stdout')
+    @click.option(
+        '--filter',
+        '-f',
+        'search_filter',
+        help='LDAP filter, e.g. (objectclass=posixAccount); default: all')
+    @click.pass_obj
+    def dump(config, output, search_filter):
+        """Dump LDAP entries to LDIF."""
+        client = Client()
+        client.prepare_connection()
+        ldif_api = API(client)
+        with open_file(output, 'w') as FILE:
+            count = ldif_api.dump(FILE, [search_filter]
+                                  if search_filter else None)
+        print('Dumped {} entries'.format(count), file=sys.stderr)
+
+    @click.command()
+    @click.argument('filename')
+    @click.option(
+        '--workers',
+        '-w',
+        default=DEFAULT_WORKERS,
+        show_default=True,
+        help='Maximum number of concurrent LDAP operations')
+    @click.option(
+        '--resume',
+        is_flag=True,
+        help='Skip records loaded by a previous run (see FILENAME.checkpoint)')
+    @click.pass_obj
+    def load(config, filename, workers, resume):
+        """Load LDAP entries from LDIF (.gz and .xz are decompressed)."""
+        checkpoint_file = '{}.checkpoint'.format(filename)
+        skip = 0
+        if resume and os.path.exists(checkpoint_file):
+            with open(checkpoint_file, 'r') as FILE:
+                skip = int(FILE.read().strip() or 0)
+            print('Resuming after {} records'.format(skip), file=sys.stderr)
+
+        def checkpoint(count):
+            with open(checkpoint_file, 'w') as FILE:
+                FILE.write('{}\n'.format(count))
+
+        client = Client()
+        client.prepare_connection()
+        ldif_api = API(client)
+        try:
+            with open_file(filename, 'r') as FILE:
+                failures = ldif_api.load(FILE, workers, checkpoint, skip)
+        except ldap3.core.exceptions.LDAPLDIFError as err:
+            sys.exit('{}: {}'.format(type(err), err))
+
+        for dn, err in failures:
+            print('Failed: {}: {}'.format(dn, err), file=sys.stderr)
+        if failures:
+            sys.exit(1)
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
@@ -0,0 +1,292 @@
+"""Provisioning Load Tests Against a Stand-in Directory."""
+import math
+import random
+import threading
+import time
+from collections import Counter
+from collections import namedtuple
+
+import click
+import ldap3
+from ldap3.protocol.rfc4512 import AttributeTypeInfo
+from ldap3.protocol.rfc4512 import ObjectClassInfo
+
+from ldap_tools.bulk import Executor
+from ldap_tools.bulk import check
+from ldap_tools.client import Client
+from ldap_tools.group import API as GroupApi
+from ldap_tools.key import API as KeyApi
+from ldap_tools.user import API as UserApi
+
+SCENARIOS = ['create', 'membership', 'keys']
+BASEDN = 'dc=loadtest,dc=org'
+GROUP = 'loadtest'
+
+# openssh-lpk, which the offline OpenLDAP schema of ldap3 lacks
+SSH_ATTRIBUTE_TYPES = [
+    "( 1.3.6.1.4.1.24552.500.1.1.1.13 NAME 'sshPublicKey' "
+    "EQUALITY octetStringMatch SYNTAX 1.3.6.1.4.1.1466.115.121.1.40 )"
+]
+SSH_OBJECT_CLASSES = [
+    "( 1.3.6.1.4.1.24552.500.1.1.2.0 NAME 'ldapPublicKey' SUP top "
+    "AUXILIARY MAY ( sshPublicKey $ uid ) )"
+]
+
+Result = namedtuple(
+    'Result',
+    ['scenario', 'operations', 'seconds', 'latencies', 'errors',
+     'collisions'])
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers, or None if empty."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+class StandIn:
+    """
+    In-memory directory (an ldap3 MOCK_SYNC server) with injected latency.
+
+    Every operation waits `latency` seconds, plus up to `jitter` more,
+    before it runs, like a network round trip.  The waits of concurrent
+    operations overlap; the in-memory operations themselves run one at a
+    time, since the mock directory is not safe for concurrent use.
+    """
+
+    def __init__(self, latency=0.005, jitter=0.0, users=100):
+        """
+        Initialize StandIn.
+
+        Args:
+            latency: seconds added to every operation
+            jitter: maximum random seconds added on top of latency
+            users: number of seed users (load.seed0 ...), each with a key
+
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.users = users
+        self.server = ldap3.Server('loadtest', get_info=ldap3.OFFLINE_SLAPD_2_4)
+        self.server.schema.attribute_types.update(
+            AttributeTypeInfo.from_definition(SSH_ATTRIBUTE_TYPES))
+        self.server.schema.object_classes.update(
+            ObjectClassInfo.from_definition(SSH_OBJECT_CLASSES))
+        self.__lock = threading.Lock()
+        self.__seed()
+
+    def client(self):
+        """A Client connected to the stand-in directory."""
+        client = StandInClient(self)
+        client.connection()
+        return client
+
+    def connection(self):
+        """A bound ldap3 connection with latency injected."""
+        conn = ldap3.Connection(
+            self.server,
+            user='cn=admin,{}'.format(BASEDN),
+            password='loadtest',
+            client_strategy=ldap3.MOCK_SYNC)
+        conn.bind()
+        for name in ['add', 'delete', 'modify', 'search']:
+            setattr(conn, name, self.__delayed(getattr(conn, name)))
+        return conn
+
+    def __delayed(self, operation):
+        def delayed(*args, **kwargs):
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+            with self.__lock:
+                return operation(*args, **kwargs)
+
+        return delayed
+
+    def __seed(self):
+        conn = ldap3.Connection(self.server, client_strategy=ldap3.MOCK_SYNC)
+        entries = [
+            (BASEDN, {'objectClass': ['top', 'dcObject', 'organization'],
+                      'dc': 'loadtest', 'o': 'loadtest'}),
+            ('ou=People,{}'.format(BASEDN),
+             {'objectClass': ['organizationalUnit'], 'ou': 'People'}),
+            ('ou=Group,{}'.format(BASEDN),
+             {'objectClass': ['organizationalUnit'], 'ou': 'Group'}),
+            ('cn={},ou=Group,{}'.format(GROUP, BASEDN),
+             {'objectClass': ['top', 'posixGroup'], 'cn': GROUP,
+              'gidNumber': 10000}),
+        ]
+        for number in range(self.users):
+            username = 'load.seed{}'.format(number)
+            entries.append(('uid={},ou=People,{}'.format(username, BASEDN), {
+                'objectClass': ['top', 'posixAccount', 'inetOrgPerson',
+                                'ldapPublicKey'],
+                'uid': username,
+                'cn': username,
+                'sn': 'seed',
+                'uidNumber': 10000 + number,
+                'gidNumber': 10000,
+                'homeDirectory': '/home/{}'.format(username),
+                'sshPublicKey': 'ssh-ed25519 AAAAC3NzaC1lZDI1NTE5 {}'.format(
+                    username)
+            }))
+        for dn, attributes in entries:
+            conn.strategy.add_entry(dn, attributes)
+
+
+class StandInClient(Client):
+    """Client whose connections (and spawned copies) use a StandIn."""
+
+    def __init__(self, standin):
+        """Initialize StandInClient."""
+        super().__init__()
+        self.standin = standin
+        self.host = 'loadtest'
+        self.basedn = BASEDN
+        self.mail_domain = 'loadtest.org'
+        self.service_ou = 'Service'
+
+    def connection(self):
+        """Connect to the stand-in directory."""
+        self.server = self.standin.server
+        self.conn = self.standin.connection()
+
+
+class API:
+    """Methods to measure provisioning throughput."""
+
+    def __init__(self, standin, workers=8):
+        """
+        Initialize LoadTest API.
+
+        Args:
+            standin: StandIn directory to run against
+            workers: concurrent workers, each with its own connection
+
+        """
+        self.standin = standin
+        self.workers = workers
+
+    def run(self, scenario, operations):
+        """
+        Run one scenario.
+
+        Scenarios drive the user, group and key APIs the way the command
+        line does: 'create' creates users (get_max_id, group lookup_id
+        and add), 'membership' adds members to a group (lookup_id and
+        modify) and 'keys' looks up a seed user's SSH keys.
+
+        Returns:
+            Result; latencies (seconds) are of successful operations,
+            errors counts failures by exception type, and collisions is
+            the number of created users that got a uidNumber another
+            user already had ('create' only, else None)
+
+        """
+        func = getattr(API, '_API__{}'.format(scenario))
+        client = self.standin.client()
+        executor = Executor(client, self.workers)
+        latencies = []
+        errors = Counter()
+        started = time.monotonic()
+        for _, latency, error in executor.results(func, range(operations)):
+            if error is None:
+                latencies.append(latency)
+            else:
+                errors[type(error).__name__] += 1
+        seconds = time.monotonic() - started
+        executor.close()
+        collisions = self.__collisions(client) if scenario == 'create' else None
+        client.close()
+        return Result(scenario, operations, seconds, latencies, dict(errors),
+                      collisions)
+
+    def __create(client, number):
+        started = time.monotonic()
+        check(client, UserApi(client).create(
+            'load', 'user{}'.format(number), GROUP, 'user', GroupApi(client)))
+        return time.monotonic() - started
+
+    def __membership(client, number):
+        started = time.monotonic()
+        check(client, GroupApi(client).add_user(GROUP,
+                                                'member{}'.format(number)))
+        return time.monotonic() - started
+
+    def __keys(client, number):
+        started = time.monotonic()
+        username = 'load.seed{}'.format(number % client.standin.users)
+        KeyApi(client).get_keys_from_ldap(username)[username]
+        return time.monotonic() - started
+
+    def __collisions(self, client):
+        numbers = Counter(
+            entry.uidNumber.value
+            for entry in client.search(['(objectclass=posixAccount)'],
+                                       ['uidNumber']))
+        return sum(count - 1 for count in numbers.values())
+
+
+class CLI:
+    """Commands to measure provisioning throughput."""
+
+    @click.command()
+    @click.option(
+        '--scenario',
+        '-s',
+        'scenarios',
+        multiple=True,
+        type=click.Choice(SCENARIOS),
+        help='Scenario to run; default: all')
+    @click.option(
+        '--operations',
+        '-n',
+        default=200,
+        show_default=True,
+        help='Operations per scenario')
+    @click.option(
+        '--workers',
+        '-w',
+        default=8,
+        show_default=True,
+        help='Concurrent workers')
+    @click.option(
+        '--latency',
+        default=5.0,
+        show_default=True,
+        help='Milliseconds added to every LDAP operation')
+    @click.option(
+        '--jitter',
+        default=0.0,
+        show_default=True,
+        help='Maximum random milliseconds added on top of --latency')
+    @click.option(
+        '--users',
+        default=100,
+        show_default=True,
+        help='Seed users in the stand-in directory')
+    @click.pass_obj
+    def loadtest(config, scenarios, operations, workers, latency, jitter,
+                 users):  # pragma: no cover
+        """Measure provisioning throughput against an in-memory directory."""
+        print('{:<11} {:>6} {:>7} {:>9} {:>8} {:>8}'.format(
+            'scenario', 'ops', 'errors', 'ops/s', 'p50 ms', 'p99 ms'))
+        for scenario in scenarios or SCENARIOS:
+            standin = StandIn(latency / 1000, jitter / 1000, users)
+            result = API(standin, workers).run(scenario, operations)
+            CLI.report(result)
+
+    def report(result):  # pragma: no cover
+        """Print one scenario's Result."""
+        def milliseconds(percent):
+            value = percentile(result.latencies, percent)
+            return '-' if value is None else '{:.1f}'.format(value * 1000)
+
+        print('{:<11} {:>6} {:>7} {:>9.1f} {:>8} {:>8}'.format(
+            result.scenario, result.operations, sum(result.errors.values()),
+            result.operations / result.seconds, milliseconds(50),
+            milliseconds(99)))
+        for name, count in sorted(result.errors.items()):
+            print('  {}: {}'.format(name, count))
+        if result.collisions is not None:
+            print('  uidNumber collisions: {}'.format(result.collisions))
@@ -0,0 +1,287 @@
+"""NSS Cache Files Generated from LDAP."""
+import hashlib
+import os
+import sys
+import tempfile
+
+import click
+
+import ldap_tools.exceptions
+from ldap_tools.client import Client
+
+PASSWD_ATTRIBUTES = [
+    'uid', 'uidNumber', 'gidNumber', 'gecos', 'cn', 'homeDirectory',
+    'loginShell'
+]
+GROUP_ATTRIBUTES = ['cn', 'gidNumber', 'memberUid']
+
+# Fraction of its lines a map may lose in one export without --force
+DEFAULT_MAX_SHRINK = 0.2
+
+# Fields of each map that get an index with --index, by index file suffix
+INDEXES = {
+    'passwd': {'ixname': 0, 'ixuid': 2},
+    'group': {'ixname': 0, 'ixgid': 2},
+}
+
+
+def write_atomic(filename, content, mode=0o644):
+    """
+    Replace a file's content atomically, unless it is unchanged.
+
+    The new content is written to a temporary file in the same directory,
+    flushed to disk and renamed over the old file, so readers never see a
+    partial file.
+
+    Args:
+        content: bytes
+
+    Returns:
+        True if the file was written, False if it already had this content
+
+    """
+    if os.path.isfile(filename):
+        with open(filename, 'rb') as FILE:
+            old = hashlib.sha256(FILE.read()).digest()
+        if old == hashlib.sha256(content).digest():
+            return False
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    FILE = tempfile.NamedTemporaryFile(
+        dir=directory, prefix='.{}.'.format(os.path.basename(filename)),
+        delete=False)
+    try:
+        with FILE:
+            FILE.write(content)
+            FILE.flush()
+            os.fsync(FILE.fileno())
+        os.chmod(FILE.name, mode)
+        os.replace(FILE.name, filename)
+    except BaseException:
+        os.remove(FILE.name)
+        raise
+    return True
+
+
+def build_index(lines, field):
+    """
+    Build a libnss-cache style index of a map.
+
+    Each index line holds a key, NUL padded to the length of the longest
+    key, and the byte offset of its line in the map, zero padded.  Lines
+    all have the same length and are sorted by key, so lookups can binary
+    search the index.
+
+    Args:
+        lines: lines of the map, without newlines
+        field: position of the key in each ':' separated line
+
+    Returns:
+        Index file content (bytes)
+
+    """
+    offsets = {}
+    offset = 0
+    for line in lines:
+        key = line.split(':')[field]
+        offsets.setdefault(key, offset)  # first match wins, as in NSS
+        offset += len(line.encode()) + 1
+    if not offsets:
+        return b''
+
+    key_width = max(len(key.encode()) for key in offsets)
+    offset_width = len(str(offset))
+    return b''.join(
+        key.encode().ljust(key_width, b'\0') + b'\0' +
+        str(offsets[key]).zfill(offset_width).encode() + b'\n'
+        for key in sorted(offsets))
+
+
+class API:
+    """Methods to generate NSS files from LDAP."""
+
+    def __init__(self, client):
+        """Initialize NSS API and LDAP Client."""
+        self.client = client
+
+    def maps(self):
+        """
+        Build the passwd and group maps with one paged search.
+
+        The search is sharded by OU when scan_workers is configured (see
+        ldap_tools.client.Client#sharded_stream).
+
+        Entries missing a required attribute, or with values that would
+        corrupt the file format, are skipped.
+
+        Returns:
+            Dictionary with 'passwd' and 'group' lists of lines, sorted by
+            ID and name
+
+        """
+        filter = ['(|(objectclass=posixAccount)(objectclass=posixGroup))']
+        attributes = sorted(
+            set(PASSWD_ATTRIBUTES + GROUP_ATTRIBUTES + ['objectClass']))
+        passwd = []
+        group = []
+        for response in self.client.sharded_stream(filter, attributes):
+            values = {
+                name.lower(): [v.decode() for v in value]
+                for name, value in response['raw_attributes'].items()
+            }
+            object_class = {i.lower() for i in values.get('objectclass', [])}
+            if 'posixaccount' in object_class:
+                fields = API.__passwd(values)
+                if fields is not None:
+                    passwd.append(fields)
+            elif 'posixgroup' in object_class:
+                fields = API.__group(values)
+                if fields is not None:
+                    group.append(fields)
+
+        return {
+            'passwd': [':'.join(i[1]) for i in sorted(passwd)],
+            'group': [':'.join(i[1]) for i in sorted(group)]
+        }
+
+    def export(self, path, suffix='.cache', index=False,
+               max_shrink=DEFAULT_MAX_SHRINK, force=False):
+        """
+        Write NSS map files.
+
+        Files are only replaced when their content changes.  An empty map,
+        or one that lost more than `max_shrink` of the lines of its file,
+        more likely comes from a wrong basedn or ACL than from real
+        deletions, and would lock users out, so nothing is written then
+        unless `force` is set.
+
+        Args:
+            path: directory to write passwd and group files to
+            suffix: appended to each file name, e.g. passwd.cache
+            index: also write ixname/ixuid/ixgid index files
+            max_shrink: fraction of a file's lines a map may lose
+            force: write maps however much they shrink
+
+        Returns:
+            List of the files that were written
+
+        Raises:
+            ldap_tools.exceptions.InvalidResult: a map is empty or shrank
+                too much
+
+        """
+        maps = self.maps()
+        if not force:
+            for name, lines in sorted(maps.items()):
+                API.__check_shrink(
+                    os.path.join(path, name + suffix), lines, max_shrink)
+
+        written = []
+        for name, lines in sorted(maps.items()):
+            filename = os.path.join(path, name + suffix)
+            files = [(filename, ''.join(line + '\n' for line in lines).encode())]
+            if index:
+                for index_suffix, field in sorted(INDEXES[name].items()):
+                    files.append(('{}.{}'.format(filename, index_suffix),
+                                  build_index(lines, field)))
+            for filename, content in files:
+                if write_atomic(filename, content):
+                    written.append(filename)
+        return written
+
+    def __check_shrink(filename, lines, max_shrink):
+        if not lines:
+            raise ldap_tools.exceptions.InvalidResult(
+                'LDAP returned no entries for {}; use --force to write '
+                'it anyway'.format(filename))
+        if not os.path.isfile(filename):
+            return
+        with open(filename, 'rb') as FILE:
+            old = sum(1 for _ in FILE)
+        if len(lines) < old * (1 - max_shrink):
+            raise ldap_tools.exceptions.InvalidResult(
+                '{} would shrink from {} to {} lines; use --force to write '
+                'it anyway'.format(filename, old, len(lines)))
+
+    def __passwd(values):
+        try:
+            fields = [
+                values['uid'][0], 'x', values['uidnumber'][0],
+                values['gidnumber'][0],
+                (values.get('gecos') or values.get('cn') or [''])[0],
+                values['homedirectory'][0],
+                (values.get('loginshell') or [''])[0]
+            ]
+            key = (int(fields[2]), fields[0])
+        except (KeyError, IndexError, ValueError):
+            return None
+        if not API.__safe(fields):
+            return None
+        return key, fields
+
+    def __group(values):
+        members = sorted(values.get('memberuid', []))
+        try:
+            fields = [
+                values['cn'][0], 'x', values['gidnumber'][0],
+                ','.join(members)
+            ]
+            key = (int(fields[2]), fields[0])
+        except (KeyError, IndexError, ValueError):
+            return None
+        if any(',' in i for i in members):
+            return None
+        if not API.__safe(fields[:3] + members):
+            return None
+        return key, fields
+
+    def __safe(fields):
+        return not any(':' in i or '\n' in i for i in fields)
+
+
+class CLI:
+    """Commands to generate NSS files from LDAP."""
+
+    @click.group()
+    @click.pass_obj
+    def nss(config):
+        """Generate NSS passwd and group files."""
+        pass
+
+    @nss.command()
+    @click.option(
+        '--path',
+        '-p',
+        default='/etc',
+        show_default=True,
+        help='Directory to write the files to')
+    @click.option(
+        '--suffix',
+        default='.cache',
+        show_default=True,
+        help='File name suffix, e.g. passwd.cache')
+    @click.option(
+        '--index',
+        is_flag=True,
+        help='Also write libnss-cache style index files')
+    @click.option(
+        '--max-shrink',
+        default=DEFAULT_MAX_SHRINK,
+        show_default=True,
+        help='Fraction of its lines a file may lose without --force')
+    @click.option(
+        '--force',
+        is_flag=True,
+        help='Write empty or much smaller files too')
+    @click.pass_obj
+    def export(config, path, suffix, index, max_shrink, force):
+        """Write passwd and group files from LDAP."""
+        client = Client()
+        client.prepare_connection()
+        nss_api = API(client)
+        try:
+            written = nss_api.export(path, suffix, index, max_shrink, force)
+        except ldap_tools.exceptions.InvalidResult as err:
+            sys.exit(err.args[0])
+        for filename in written:
+            print('Wrote {}'.format(filename), file=sys.stderr)
@@ -0,0 +1,145 @@
+"""Pool of LDAP Connections."""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import ldap_tools.exceptions
+
+DEFAULT_SIZE = 8
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_MAX_LIFETIME = 3600
+
+
+class ConnectionPool:
+    """
+    Bounded, thread safe pool of LDAP connections.
+
+    Connections are created on demand up to `size`.  A thread checks one
+    out for the duration of a single operation, so each connection only
+    ever serves one operation at a time.  Idle connections are closed
+    after `idle_timeout` seconds and every connection is replaced after
+    `max_lifetime` seconds.
+    """
+
+    def __init__(self,
+                 factory,
+                 size=DEFAULT_SIZE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_lifetime=DEFAULT_MAX_LIFETIME):
+        """
+        Initialize ConnectionPool.
+
+        Args:
+            factory: callable returning a new ldap3 Connection
+            size: maximum number of open connections
+            idle_timeout: seconds an unused connection is kept open
+            max_lifetime: seconds after which a connection is replaced
+
+        """
+        self.factory = factory
+        self.size = max(1, size)
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.__idle = deque()  # (connection, created, last used)
+        self.__open = 0
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Check a connection out of the pool.
+
+        Blocks while all `size` connections are in use.  A connection
+        that raised an exception is closed instead of being returned.
+
+        Args:
+            timeout: seconds to wait for a connection (optional)
+
+        Raises:
+            ldap_tools.exceptions.PoolTimeout: no connection was free in time
+
+        """
+        conn, created = self.__acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.__discard(conn)
+            raise
+        self.__release(conn, created)
+
+    def close(self):
+        """Close idle connections; busy ones are closed when returned."""
+        with self.__condition:
+            self.__closed = True
+            idle = [conn for conn, _, _ in self.__idle]
+            self.__idle.clear()
+            self.__open -= len(idle)
+            self.__condition.notify_all()
+        ConnectionPool.__unbind(idle)
+
+    def stats(self):
+        """Dictionary of open and idle connection counts and the size."""
+        with self.__condition:
+            return {
+                'open': self.__open,
+                'idle': len(self.__idle),
+                'size': self.size
+            }
+
+    def __acquire(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        stale = []
+        try:
+            with self.__condition:
+                while True:
+                    now = time.monotonic()
+                    while self.__idle:
+                        conn, created, used = self.__idle.pop()
+                        if (now - used > self.idle_timeout or
+                                now - created > self.max_lifetime):
+                            stale.append(conn)
+                            self.__open -= 1
+                            continue
+                        return conn, created
+                    if self.__open < self.size:
+                        self.__open += 1
+                        break
+                    remaining = None if deadline is None else deadline - now
+                    if remaining is not None and remaining <= 0:
+                        raise ldap_tools.exceptions.PoolTimeout(
+                            'No LDAP connection free after {}s'.format(
+                                timeout))
+                    self.__condition.wait(remaining)
+        finally:
+            ConnectionPool.__unbind(stale)
+
+        try:
+            return self.factory(), time.monotonic()
+        except BaseException:
+            with self.__condition:
+                self.__open -= 1
+                self.__condition.notify()
+            raise
+
+    def __release(self, conn, created):
+        with self.__condition:
+            if not self.__closed and not conn.closed:
+                self.__idle.append((conn, created, time.monotonic()))
+                self.__condition.notify()
+                return
+        self.__discard(conn)
+
+    def __discard(self, conn):
+        with self.__condition:
+            self.__open -= 1
+            self.__condition.notify()
+        ConnectionPool.__unbind([conn])
+
+    def __unbind(connections):
+        for conn in connections:
+            try:
+                conn.unbind()
+            except Exception:
+                pass  # the connection is being thrown away anyway
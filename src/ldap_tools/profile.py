@@ -0,0 +1,265 @@
+"""LDAP Query Profiler."""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import ldap3
+
+DEFAULT_SLOW = 0.1
+
+# One comparison in an LDAP filter: attribute, operator and value
+TERM = re.compile(r'\(([^()=<>~!&|]+)(=|>=|<=|~=)([^()]*)\)')
+
+# OpenLDAP index type each kind of comparison needs
+INDEX_TYPES = {'=': 'eq', '>=': 'eq', '<=': 'eq', '~=': 'approx'}
+
+# Attributes that narrow a search too little for their index to count
+BROAD_ATTRIBUTES = {'objectclass'}
+
+_profiler = None
+
+
+def enable(slow=DEFAULT_SLOW):
+    """Start profiling every LDAP query made by any Client."""
+    global _profiler
+    _profiler = QueryProfiler(slow)
+    return _profiler
+
+
+def disable():
+    """Stop profiling; return the profiler that was active, if any."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def active():
+    """The active QueryProfiler, or None."""
+    return _profiler
+
+
+def template(filterstr):
+    """
+    Filter with its values replaced by '?', e.g. (&(uid=?)(cn=?*)).
+
+    Presence tests ((attr=*)) are kept, since they are a pattern of their
+    own.
+    """
+    def placeholder(match):
+        name, operator, value = match.groups()
+        if operator == '=' and '*' in value and value != '*':
+            value = re.sub(r'[^*]+', '?', value)
+        elif value != '*' or operator != '=':
+            value = '?'
+        return '({}{}{})'.format(name.strip().lower(), operator, value)
+
+    return TERM.sub(placeholder, filterstr)
+
+
+def index_needs(filterstr):
+    """Set of (attribute, OpenLDAP index type) tested by a filter."""
+    needs = set()
+    for name, operator, value in TERM.findall(filterstr):
+        name = name.strip().lower()
+        if operator != '=':
+            needs.add((name, INDEX_TYPES[operator]))
+        elif value == '*':
+            needs.add((name, 'pres'))
+        elif '*' in value:
+            needs.add((name, 'sub'))
+        else:
+            needs.add((name, 'eq'))
+    return needs
+
+
+def read_indexes(client):  # pragma: no cover
+    """
+    Read the attribute indexes of an OpenLDAP server from cn=config.
+
+    Returns:
+        Dictionary of lowercase attribute name to set of index types, or
+        None if cn=config cannot be read
+
+    """
+    try:
+        client.conn.search(
+            search_base='cn=config',
+            search_filter='(olcDbIndex=*)',
+            search_scope=ldap3.SUBTREE,
+            attributes=['olcDbIndex'])
+    except ldap3.core.exceptions.LDAPException:
+        return None
+    if client.conn.result['result'] != 0 or not client.conn.entries:
+        return None
+    return parse_indexes(value for entry in client.conn.entries
+                         for value in entry.olcDbIndex.values)
+
+
+def parse_indexes(lines):
+    """Parse olcDbIndex or slapd.conf index lines, e.g. 'uid,cn eq,sub'."""
+    indexes = {}
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        types = set(fields[1].lower().split(',')) if len(fields) > 1 else {
+            'eq'
+        }
+        for name in fields[0].lower().split(','):
+            indexes.setdefault(name, set()).update(types)
+    return indexes
+
+
+class Measurement:
+    """Timing, entry count and size of one LDAP query."""
+
+    def __init__(self):
+        """Initialize Measurement."""
+        self.seconds = 0.0
+        self.entries = 0
+        self.size = 0
+
+    def count(self, dn, raw_attributes):
+        """Count one returned entry and the size of its values."""
+        self.entries += 1
+        self.size += len(dn) + sum(
+            len(name) + sum(len(value) for value in values)
+            for name, values in raw_attributes.items())
+
+    def iterate(self, responses):
+        """Yield responses, timing only the wait for each one."""
+        responses = iter(responses)
+        while True:
+            started = time.monotonic()
+            try:
+                response = next(responses)
+            except StopIteration:
+                return
+            finally:
+                self.seconds += time.monotonic() - started
+            if 'raw_attributes' in response:
+                self.count(response['dn'], response['raw_attributes'])
+            yield response
+
+
+class QueryProfiler:
+    """
+    Aggregate LDAP queries by filter template.
+
+    Thread safe, so the workers of bulk operations and sharded scans can
+    all report to the one active profiler.
+    """
+
+    def __init__(self, slow=DEFAULT_SLOW):
+        """
+        Initialize QueryProfiler.
+
+        Args:
+            slow: mean seconds above which a query pattern is reported slow
+
+        """
+        self.slow = slow
+        self.__stats = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def record(self, operation, filterstr, measurement):
+        """Add one query's Measurement to its filter template."""
+        key = (operation, template(filterstr))
+        with self.__lock:
+            stats = self.__stats.get(key)
+            if stats is None:
+                stats = self.__stats[key] = {
+                    'operation': operation,
+                    'template': key[1],
+                    'needs': index_needs(filterstr),
+                    'count': 0,
+                    'seconds': 0.0,
+                    'max': 0.0,
+                    'entries': 0,
+                    'bytes': 0
+                }
+            stats['count'] += 1
+            stats['seconds'] += measurement.seconds
+            stats['max'] = max(stats['max'], measurement.seconds)
+            stats['entries'] += measurement.entries
+            stats['bytes'] += measurement.size
+
+    def report(self, indexes=None):
+        """
+        Query patterns, most total time first.
+
+        A pattern is flagged 'slow' when its mean latency exceeds `slow`,
+        and 'unindexed' when no attribute it tests, other than objectClass,
+        has the index the test needs, so the server has to examine every
+        candidate entry.
+
+        Args:
+            indexes: dictionary of attribute to index types (see
+                #read_indexes), or None if unknown; then unindexed cannot
+                be told and suggestions are made for slow patterns only
+
+        Returns:
+            List of dictionaries with operation, template, count, seconds,
+            mean, max, entries, bytes, flags and missing (a set of
+            (attribute, index type) that would help)
+
+        """
+        with self.__lock:
+            patterns = [dict(stats) for stats in self.__stats.values()]
+        for stats in patterns:
+            stats['mean'] = stats['seconds'] / stats['count']
+            stats['flags'] = []
+            if stats['mean'] > self.slow:
+                stats['flags'].append('slow')
+            needs = {(name, kind) for name, kind in stats.pop('needs')
+                     if name not in BROAD_ATTRIBUTES}
+            if indexes is None:
+                stats['missing'] = needs if 'slow' in stats['flags'] else set()
+                continue
+            stats['missing'] = {(name, kind) for name, kind in needs
+                                if kind not in indexes.get(name, ())}
+            if needs and stats['missing'] == needs:
+                stats['flags'].append('unindexed')
+        return sorted(patterns, key=lambda i: i['seconds'], reverse=True)
+
+    def suggestions(self, indexes=None):
+        """
+        OpenLDAP index directives for the flagged patterns.
+
+        Returns:
+            List of lines such as 'index memberuid pres'
+
+        """
+        wanted = {}
+        for stats in self.report(indexes):
+            if stats['flags']:
+                for name, kind in stats['missing']:
+                    wanted.setdefault(name, set()).add(kind)
+        return [
+            'index {} {}'.format(name, ','.join(sorted(kinds)))
+            for name, kinds in sorted(wanted.items())
+        ]
+
+    def format(self, indexes=None):
+        """Report as lines of text."""
+        lines = [
+            '{:>6} {:>9} {:>8} {:>8} {:>8} {:>10}  {}'.format(
+                'count', 'total s', 'mean ms', 'max ms', 'entries', 'bytes',
+                'query')
+        ]
+        for stats in self.report(indexes):
+            lines.append('{:>6} {:>9.3f} {:>8.1f} {:>8.1f} {:>8} {:>10}  '
+                         '{} {}{}'.format(
+                             stats['count'], stats['seconds'],
+                             stats['mean'] * 1000, stats['max'] * 1000,
+                             stats['entries'], stats['bytes'],
+                             stats['operation'], stats['template'],
+                             ''.join(' [{}]'.format(i)
+                                     for i in stats['flags'])))
+        suggestions = self.suggestions(indexes)
+        if suggestions:
+            lines.append('')
+            lines.append('Indexes that would help:')
+            lines.extend('  ' + i for i in suggestions)
+        return lines
@@ -0,0 +1,245 @@
+"""LDAP Replica Consistency."""
+import hashlib
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from ldap3.utils.dn import to_dn
+
+from ldap_tools.client import Client
+from ldap_tools.diff import API as DiffApi
+from ldap_tools.diff import Difference
+from ldap_tools.diff import compare
+from ldap_tools.diff import digest
+
+# Replication metadata that changes with every write to an entry
+STAMP_ATTRIBUTES = ['entryCSN', 'modifyTimestamp']
+
+
+class DigestTree:
+    """
+    Merkle tree of entry digests.
+
+    Every entry gets a subtree hash covering its own digest and the
+    subtree hashes of its children, so two servers whose hashes agree for
+    an entry are known to agree for everything below it.
+    """
+
+    ROOT = ()
+
+    def __init__(self, digests):
+        """
+        Build the tree.
+
+        Args:
+            digests: iterable of (dn, digest) tuples in any order
+
+        """
+        self.entries = {}
+        for dn, entry_digest in digests:
+            key = tuple(i.strip().lower() for i in reversed(to_dn(dn)))
+            self.entries[key] = (dn, entry_digest)
+
+        self.children = {DigestTree.ROOT: []}
+        for key in self.entries:
+            parent = key[:-1]
+            while parent and parent not in self.entries:
+                parent = parent[:-1]  # attach orphans to their nearest entry
+            self.children.setdefault(parent, []).append(key)
+
+        self.hashes = {}
+        for key in sorted(self.entries, key=len, reverse=True):
+            self.hashes[key] = self.__hash(key, self.entries[key][1])
+        self.hashes[DigestTree.ROOT] = self.__hash(DigestTree.ROOT, b'')
+
+    def subtree(self, key):
+        """Every key at or below key."""
+        keys = [key]
+        for key in keys:
+            keys.extend(self.children.get(key, []))
+        return keys
+
+    def compare(self, other):
+        """
+        Find entries that differ from another tree.
+
+        Branches with equal subtree hashes are skipped without looking at
+        the entries in them.
+
+        Returns:
+            A tuple of a list of (action, key) tuples and the number of
+            entries confirmed through matching subtree hashes.  action is
+            'add' (only in other), 'delete' (only in self) or 'modify'.
+
+        """
+        differences = []
+        confirmed = 0
+        pending = [DigestTree.ROOT]
+        while pending:
+            key = pending.pop()
+            if self.hashes[key] == other.hashes[key]:
+                confirmed += len(self.subtree(key)) - (key == DigestTree.ROOT)
+                continue
+            if (key != DigestTree.ROOT and
+                    self.entries[key][1] != other.entries[key][1]):
+                differences.append(('modify', key))
+            ours = set(self.children.get(key, []))
+            theirs = set(other.children.get(key, []))
+            for child in sorted(ours - theirs, reverse=True):
+                differences.extend(
+                    ('delete', i) for i in self.subtree(child)
+                    if i not in other.entries)
+            for child in sorted(theirs - ours, reverse=True):
+                differences.extend(
+                    ('add', i) for i in other.subtree(child)
+                    if i not in self.entries)
+            pending.extend(sorted(ours & theirs, reverse=True))
+        return sorted(differences, key=lambda i: i[1]), confirmed
+
+    def __hash(self, key, entry_digest):
+        value = hashlib.sha1(entry_digest)
+        for child in sorted(self.children.get(key, [])):
+            value.update(repr(child).encode() + self.hashes[child])
+        return value.digest()
+
+
+class API:
+    """Methods to compare LDAP replicas."""
+
+    def __init__(self, client):
+        """Initialize Replica API and LDAP Client."""
+        self.client = client
+
+    def digests(self, client, full=False):
+        """
+        Fetch a digest for every entry on one server.
+
+        By default only replication metadata (entryCSN, modifyTimestamp)
+        is transferred, which changes whenever an entry does.
+
+        Args:
+            full: hash every user attribute instead, for servers that do
+                not maintain entryCSN or modifyTimestamp
+
+        Returns:
+            DigestTree
+
+        """
+        attributes = ['*'] if full else STAMP_ATTRIBUTES
+        return DigestTree(
+            (response['dn'], digest(response['raw_attributes']))
+            for response in client.stream(None, attributes))
+
+    def check(self, hosts, full=False):
+        """
+        Compare replicas with the primary server.
+
+        Digests are fetched from every server in parallel.  Full entries
+        are then fetched from both sides, only for entries that differ.
+
+        Args:
+            hosts: replica servers to compare with this client's server
+
+        Returns:
+            Tuple of a dictionary of host to list of Difference tuples
+            (as seen from the primary: 'add' is only on the replica) and a
+            dictionary of host to exception for servers that failed
+
+        """
+        clients = {}
+        trees = {}
+        errors = {}
+
+        def fetch(host):
+            clients[host] = self.client.spawn(host)
+            return self.digests(clients[host], full)
+
+        servers = [self.client.host] + list(hosts)
+        try:
+            with ThreadPoolExecutor(max_workers=len(servers)) as pool:
+                futures = {host: pool.submit(fetch, host) for host in servers}
+            for host, future in futures.items():
+                if future.exception() is not None:
+                    errors[host] = future.exception()
+                else:
+                    trees[host] = future.result()
+            if self.client.host in errors:
+                return {}, errors
+
+            primary = trees[self.client.host]
+            differences = {}
+            for host in hosts:
+                if host in trees:
+                    differences[host] = self.__differences(
+                        clients[self.client.host], primary, clients[host],
+                        trees[host])
+            return differences, errors
+        finally:
+            for client in clients.values():
+                client.close()
+
+    def __differences(self, primary_client, primary, replica_client, replica):
+        differences = []
+        changed, _ = primary.compare(replica)
+        for action, key in changed:
+            if action == 'delete':
+                differences.append(
+                    Difference('delete', primary.entries[key][0], {}))
+            elif action == 'add':
+                differences.append(
+                    Difference('add', replica.entries[key][0], {}))
+            else:
+                dn = primary.entries[key][0]
+                changes = compare(
+                    API.__raw(primary_client.read(dn)),
+                    API.__raw(replica_client.read(dn)))
+                if changes:  # otherwise only the replication metadata differs
+                    differences.append(Difference('modify', dn, changes))
+        return differences
+
+    def __raw(entry):
+        if entry is None:
+            return {}
+        return entry.entry_raw_attributes
+
+
+class CLI:
+    """Commands to compare LDAP replicas."""
+
+    @click.command()
+    @click.option(
+        '--replica',
+        '-r',
+        'replicas',
+        multiple=True,
+        help='Replica server; default: replicas from the config file')
+    @click.option(
+        '--full',
+        is_flag=True,
+        help='Hash entry contents instead of entryCSN/modifyTimestamp')
+    @click.pass_obj
+    def replica_check(config, replicas, full):
+        """Find entries that differ between LDAP replicas."""
+        client = Client()
+        client.load_ldap_config()
+        client.load_ldap_password()
+        replicas = list(replicas) or client.replicas
+        if not replicas:
+            sys.exit('No replicas given or configured')
+
+        differences, errors = API(client).check(replicas, full)
+        for host, err in sorted(errors.items()):
+            print('{}: {}: {}'.format(host, type(err).__name__, err),
+                  file=sys.stderr)
+        for host in replicas:
+            if host not in differences:
+                continue
+            print('{}: {} difference(s)'.format(host, len(differences[host])))
+            for difference in differences[host]:
+                print('\n'.join(
+                    '  ' + i for i in DiffApi.format(difference)))
+
+        if errors:
+            sys.exit(2)
+        if any(differences.values()):
+            sys.exit(1)
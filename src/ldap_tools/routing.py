@@ -0,0 +1,105 @@
+"""Routing of LDAP Reads to Replicas."""
+import threading
+import time
+
+DEFAULT_PIN_WINDOW = 5
+
+# Weight of the newest sample in a server's average latency
+LATENCY_WEIGHT = 0.3
+
+
+class Router:
+    """
+    Pick the server for each read.
+
+    Reads go to the replica with the lowest expected wait: its average
+    latency times the number of reads it is already serving, plus one.
+    Replicas that have not answered yet are tried first.  For
+    `pin_window` seconds after a write every read goes to the primary, so
+    a session always sees its own writes even while replicas catch up.
+    """
+
+    def __init__(self, replicas, pin_window=DEFAULT_PIN_WINDOW):
+        """
+        Initialize Router.
+
+        Args:
+            replicas: hosts to send reads to
+            pin_window: seconds reads stay on the primary after a write
+
+        """
+        self.replicas = list(replicas)
+        self.pin_window = pin_window
+        self.__latency = {host: None for host in self.replicas}
+        self.__busy = {host: 0 for host in self.replicas}
+        self.__reads = {host: 0 for host in self.replicas}
+        self.__pinned_until = 0
+        self.__lock = threading.Lock()
+
+    def wrote(self):
+        """Record a write; reads are pinned to the primary for a while."""
+        with self.__lock:
+            self.__pinned_until = time.monotonic() + self.pin_window
+
+    def pinned(self):
+        """Whether reads must currently go to the primary."""
+        with self.__lock:
+            return time.monotonic() < self.__pinned_until
+
+    def acquire(self, candidates=None):
+        """
+        Pick a replica for one read and count it as busy.
+
+        Args:
+            candidates: replicas to choose from (optional), e.g. without
+                the ones that are failing; defaults to all of them
+
+        Returns:
+            host, or None when reads must go to the primary
+
+        """
+        if candidates is None:
+            candidates = self.replicas
+        with self.__lock:
+            if not candidates or time.monotonic() < self.__pinned_until:
+                return None
+            host = min(candidates, key=self.__cost)
+            self.__busy[host] += 1
+            self.__reads[host] += 1
+            return host
+
+    def release(self, host, seconds=None):
+        """
+        Finish a read started with #acquire.
+
+        Args:
+            seconds: how long the read took, or None to leave the average
+                latency alone (e.g. for streams, which run at the pace of
+                their consumer)
+
+        """
+        with self.__lock:
+            self.__busy[host] -= 1
+            if seconds is None:
+                return
+            latency = self.__latency[host]
+            self.__latency[host] = seconds if latency is None else (
+                LATENCY_WEIGHT * seconds + (1 - LATENCY_WEIGHT) * latency)
+
+    def stats(self):
+        """Dictionary of host to average latency, busy and total reads."""
+        with self.__lock:
+            return {
+                host: {
+                    'latency': self.__latency[host],
+                    'busy': self.__busy[host],
+                    'reads': self.__reads[host]
+                }
+                for host in self.replicas
+            }
+
+    def __cost(self, host):
+        latency = self.__latency[host]
+        if latency is None:
+            return (0, self.__busy[host], self.__reads[host])
+        return (1, latency * (self.__busy[host] + 1), self.__reads[host])
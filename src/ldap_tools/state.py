@@ -0,0 +1,336 @@
+"""Declarative LDAP State Management."""
+import sys
+from collections import namedtuple
+
+import click
+import ldap3
+import yaml
+
+import ldap_tools.exceptions
+from ldap_tools.bulk import DEFAULT_WORKERS
+from ldap_tools.bulk import Executor
+from ldap_tools.bulk import check
+from ldap_tools.client import Client
+from ldap_tools.group import API as GroupApi
+from ldap_tools.user import API as UserApi
+
+Change = namedtuple('Change', ['action', 'name', 'detail'])
+
+
+class API:
+    """Methods to reconcile LDAP with a desired state."""
+
+    # Changes are applied in phases: a phase only starts once the previous
+    # one has finished, since users need their primary group to exist.
+    PHASES = [
+        ('create_group', ),
+        ('create_user', ),
+        ('update_members', 'replace_keys'),
+        ('delete_user', 'delete_group'),
+    ]
+
+    def __init__(self, client):
+        """Initialize State API and LDAP Client."""
+        self.client = client
+
+    def load(filename):
+        """
+        Load desired state from a YAML file.
+
+        The file looks like this; every key except `name` and `group` for
+        users is optional.  When `members` or `keys` is given it is
+        authoritative, and anything in LDAP that is not listed is removed.
+
+            groups:
+              developers:
+                type: user
+                members: [jane.doe]
+            users:
+              jane.doe:
+                name: [Jane, Doe]
+                group: developers
+                type: user
+                keys: ['ssh-rsa AAAA...']
+
+        Returns:
+            Dictionary with 'users' and 'groups' keys
+
+        Raises:
+            ldap_tools.exceptions.ArgumentError: the state file is invalid
+
+        """
+        with open(filename, 'r') as FILE:
+            state = yaml.safe_load(FILE) or {}
+
+        desired = {
+            'groups': state.get('groups') or {},
+            'users': state.get('users') or {}
+        }
+        for username, user in desired['users'].items():
+            if 'name' not in user or 'group' not in user:
+                raise ldap_tools.exceptions.ArgumentError(
+                    'User ({}) needs a name and a group'.format(username))
+            if '.'.join(i.lower() for i in user['name']) != username:
+                raise ldap_tools.exceptions.ArgumentError(
+                    'User ({}) does not match name {}'.format(
+                        username, ' '.join(user['name'])))
+        return desired
+
+    def current(self):
+        """
+        Fetch the current state of LDAP with one search per object type.
+
+        Returns:
+            Dictionary with 'users' and 'groups' keys, mapping each name to
+            its DN, ID number and keys (users) or members (groups)
+
+        """
+        # plan() allocates IDs from these, so replicas that lag behind
+        # would hand out IDs already in use
+        with self.client.primary():
+            users_results = self.client.search(
+                ['(objectclass=posixAccount)'],
+                ['uid', 'uidNumber', 'sshPublicKey'])
+            groups_results = self.client.search(
+                ['(objectclass=posixGroup)'],
+                ['cn', 'gidNumber', 'memberUid'])
+
+        users = {}
+        for result in users_results:
+            users[result.uid.value] = {
+                'dn': result.entry_dn,
+                'id': result.uidNumber.value,
+                'keys': set(API.__decode(result.sshPublicKey.values)),
+            }
+
+        groups = {}
+        for result in groups_results:
+            groups[result.cn.value] = {
+                'dn': result.entry_dn,
+                'id': result.gidNumber.value,
+                'members': set(result.memberUid.values),
+            }
+
+        return {'users': users, 'groups': groups}
+
+    def plan(self, desired, current, prune=False):
+        """
+        Compute the changes needed to turn current into desired.
+
+        IDs for new users and groups are allocated here, from the IDs in
+        current, so creates can run concurrently without racing on
+        Client#get_max_id.
+
+        Args:
+            desired: state as returned by #load
+            current: state as returned by #current
+            prune: also delete users and groups missing from desired
+
+        Returns:
+            List of Change tuples
+
+        """
+        changes = []
+        group_ids = {
+            name: group['id']
+            for name, group in current['groups'].items()
+        }
+        allocators = {}
+
+        def allocate(object_type, role, used_ids):
+            if (object_type, role) not in allocators:
+                allocators[(object_type, role)] = self.client.id_allocator(
+                    role, used_ids)
+            return next(allocators[(object_type, role)])
+
+        for name in sorted(desired['groups']):
+            group = desired['groups'][name] or {}
+            if name not in current['groups']:
+                group_ids[name] = allocate(
+                    'group', group.get('type', 'user'),
+                    [i['id'] for i in current['groups'].values()])
+                changes.append(
+                    Change('create_group', name, {
+                        'type': group.get('type', 'user'),
+                        'gidnumber': group_ids[name]
+                    }))
+            if 'members' in group:
+                have = current['groups'].get(name, {}).get('members', set())
+                want = set(group['members'] or [])
+                if have != want:
+                    changes.append(
+                        Change('update_members', name, {
+                            'add': sorted(want - have),
+                            'remove': sorted(have - want)
+                        }))
+
+        for username in sorted(desired['users']):
+            user = desired['users'][username]
+            if username not in current['users']:
+                if user['group'] not in group_ids:
+                    raise ldap_tools.exceptions.NoGroupsFound(
+                        'Group ({}) not found for user ({})'.format(
+                            user['group'], username))
+                changes.append(
+                    Change('create_user', username, {
+                        'name': user['name'],
+                        'group': user['group'],
+                        'type': user.get('type', 'user'),
+                        'uidnumber': allocate(
+                            'user', user.get('type', 'user'),
+                            [i['id'] for i in current['users'].values()]),
+                        'gidnumber': group_ids[user['group']]
+                    }))
+            if 'keys' in user:
+                have = current['users'].get(username, {}).get('keys', set())
+                want = set(k.strip() for k in user['keys'] or [])
+                if have != want:
+                    changes.append(
+                        Change('replace_keys', username, {
+                            'dn': current['users'].get(username, {}).get('dn'),
+                            'keys': sorted(want)
+                        }))
+
+        if prune:
+            for username in sorted(set(current['users']) - set(desired['users'])):
+                changes.append(
+                    Change('delete_user', username,
+                           {'dn': current['users'][username]['dn']}))
+            for name in sorted(set(current['groups']) - set(desired['groups'])):
+                changes.append(
+                    Change('delete_group', name,
+                           {'dn': current['groups'][name]['dn']}))
+
+        return changes
+
+    def apply(self, changes, workers=DEFAULT_WORKERS):
+        """
+        Apply changes computed by #plan.
+
+        Changes within a phase run concurrently on up to `workers`
+        connections.
+
+        Returns:
+            List of (Change, exception) tuples for changes that failed
+
+        """
+        failures = []
+        executor = Executor(self.client, workers)
+        for phase in API.PHASES:
+            batch = [change for change in changes if change.action in phase]
+            failures.extend(executor.run(API.__apply_change, batch))
+        return failures
+
+    def format(change):
+        """Describe a change in one line for display in a plan."""
+        if change.action == 'create_group':
+            return '+ group {} (gid {})'.format(change.name,
+                                                change.detail['gidnumber'])
+        elif change.action == 'create_user':
+            return '+ user {} (uid {}, group {})'.format(
+                change.name, change.detail['uidnumber'],
+                change.detail['group'])
+        elif change.action == 'update_members':
+            return '~ group {} members: {}'.format(
+                change.name, ' '.join(
+                    ['+' + i for i in change.detail['add']] +
+                    ['-' + i for i in change.detail['remove']]))
+        elif change.action == 'replace_keys':
+            return '~ user {} keys: {} key(s)'.format(
+                change.name, len(change.detail['keys']))
+        elif change.action == 'delete_user':
+            return '- user {}'.format(change.name)
+        elif change.action == 'delete_group':
+            return '- group {}'.format(change.name)
+
+    def __apply_change(client, change):  # pragma: no cover
+        detail = change.detail
+        if change.action == 'create_group':
+            return check(client,
+                         GroupApi(client).create(change.name, detail['type'],
+                                                 detail['gidnumber']))
+        elif change.action == 'create_user':
+            return check(client,
+                         UserApi(client).create(
+                             detail['name'][0], detail['name'][1],
+                             detail['group'], detail['type'],
+                             GroupApi(client), detail['uidnumber'],
+                             detail['gidnumber']))
+        elif change.action == 'update_members':
+            operation = []
+            if detail['add']:
+                operation.append((ldap3.MODIFY_ADD, detail['add']))
+            if detail['remove']:
+                operation.append((ldap3.MODIFY_DELETE, detail['remove']))
+            return check(client,
+                         client.modify(
+                             'cn={},ou=Group,{}'.format(
+                                 change.name, client.basedn),
+                             {'memberUid': operation}))
+        elif change.action == 'replace_keys':
+            distinguished_name = detail['dn']
+            if distinguished_name is None:  # user created in this run
+                distinguished_name = UserApi(client).find(
+                    change.name, [ldap3.NO_ATTRIBUTES])[0].entry_dn
+            operation = {
+                'sshPublicKey': [(ldap3.MODIFY_REPLACE, detail['keys'])]
+            }
+            return check(client, client.modify(distinguished_name, operation))
+        elif change.action in ('delete_user', 'delete_group'):
+            return check(client, client.delete(detail['dn']))
+
+    def __decode(values):
+        return [
+            v.decode().strip() if isinstance(v, bytes) else v.strip()
+            for v in values
+        ]
+
+
+class CLI:
+    """Commands to reconcile LDAP with a state file."""
+
+    @click.command()
+    @click.argument('filename', type=click.Path(exists=True))
+    @click.option(
+        '--prune',
+        is_flag=True,
+        help='Delete users and groups not listed in the state file')
+    @click.option(
+        '--workers',
+        '-w',
+        default=DEFAULT_WORKERS,
+        show_default=True,
+        help='Maximum number of concurrent LDAP operations')
+    @click.option('--dry-run', is_flag=True, help='Only show the plan')
+    @click.option('--force', is_flag=True, help='Apply without confirmation')
+    @click.pass_obj
+    def apply(config, filename, prune, workers, dry_run, force):
+        """Make LDAP users, groups, members and keys match a state file."""
+        try:
+            desired = API.load(filename)
+        except ldap_tools.exceptions.ArgumentError as err:
+            sys.exit(err.args[0])
+
+        client = Client()
+        client.prepare_connection()
+        state_api = API(client)
+        changes = state_api.plan(desired, state_api.current(), prune)
+
+        if not changes:
+            print('No changes.')
+            return
+        for change in changes:
+            print(API.format(change))
+        if dry_run:
+            return
+        if not force:
+            if not click.confirm('Apply {} change(s)?'.format(len(changes))):
+                sys.exit('Apply aborted')
+
+        failures = state_api.apply(changes, workers)
+        for change, err in failures:
+            print(
+                'Failed: {}: {}'.format(API.format(change), err),
+                file=sys.stderr)
+        if failures:
+            sys.exit(1)
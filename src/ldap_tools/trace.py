@@ -0,0 +1,116 @@
+"""Timing Traces in Chrome Trace Event Format."""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_tracer = None
+
+
+def clock():
+    """Current time on the clock spans are measured with."""
+    return time.perf_counter()
+
+
+def enable(origin=None):
+    """
+    Start recording spans.
+
+    Args:
+        origin: clock() value that timestamps count from (optional), e.g.
+            taken before the imports of the command line entry point
+
+    """
+    global _tracer
+    _tracer = Tracer(origin)
+    return _tracer
+
+
+def disable():
+    """Stop recording; return the Tracer that was active, if any."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def active():
+    """The active Tracer, or None."""
+    return _tracer
+
+
+@contextmanager
+def span(name, category='phase', **args):
+    """
+    Record the time spent in a block, when tracing.
+
+    Spans of one thread nest by time, so a span opened inside another
+    shows up as its child in a trace viewer.
+
+    Args:
+        category: 'phase' for steps of a command, 'ldap' for operations
+        args: details shown with the span, e.g. filter=...
+
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    started = clock()
+    try:
+        yield
+    finally:
+        tracer.complete(name, category, started, clock(), args)
+
+
+def traced(name, category='phase'):
+    """Decorate a function to run in a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Tracer:
+    """Collect spans as Chrome trace events ("X" complete events)."""
+
+    def __init__(self, origin=None):
+        """Initialize Tracer."""
+        self.origin = clock() if origin is None else origin
+        self.__events = []
+        self.__lock = threading.Lock()
+
+    def complete(self, name, category, started, finished, args=None):
+        """Record a span that ran from started to finished (clock())."""
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((started - self.origin) * 1e6, 1),
+            'dur': round((finished - started) * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        if args:
+            event['args'] = {key: str(value) for key, value in args.items()}
+        with self.__lock:
+            self.__events.append(event)
+
+    def events(self):
+        """Recorded events, in start order."""
+        with self.__lock:
+            return sorted(self.__events, key=lambda i: (i['ts'], -i['dur']))
+
+    def write(self, FILE):
+        """Write the trace as JSON, loadable by chrome://tracing."""
+        json.dump({
+            'traceEvents': self.events(),
+            'displayTimeUnit': 'ms'
+        }, FILE, indent=1, sort_keys=True)
+        FILE.write('\n')
@@ -3,52 +3,292 @@ import os
 import string
 import sys
 from base64 import b64encode
+from collections import namedtuple
 from hashlib import sha1
 from random import SystemRandom
 
 import click
+import ldap3
 
 import ldap_tools.exceptions
+from ldap_tools.bulk import DEFAULT_WORKERS
+from ldap_tools.bulk import Executor
+from ldap_tools.bulk import Journal
+from ldap_tools.bulk import check
+from ldap_tools.cache import normalize_dn
 from ldap_tools.client import Client
+from ldap_tools.client import any_of
 from ldap_tools.group import API as GroupApi
 
+Creation = namedtuple(
+    'Creation',
+    ['username', 'fname', 'lname', 'group', 'type', 'uidnumber', 'gidnumber'])
+
 
 class API:
     """Methods to handle LDAP Group Management."""
 
+    # Attributes fetched for listings; password hashes and SSH keys are
+    # left out unless explicitly requested
+    INDEX_ATTRIBUTES = [
+        'uid', 'cn', 'uidNumber', 'gidNumber', 'mail', 'homeDirectory',
+        'loginShell'
+    ]
+
     def __init__(self, client):
         """Initialize User API and LDAP Client."""
         # TODO: pass the client in instead of instantiating here
         self.client = client
 
-    def create(self, fname, lname, group, type, group_api):
-        """Create an LDAP User."""
+    def create(self, fname, lname, group, type, group_api, uidnumber=None,
+               gidnumber=None):
+        """
+        Create an LDAP User.
+
+        Args:
+            uidnumber: UID to assign (optional). Looked up with
+                Client#get_max_id when not given.
+            gidnumber: GID of the primary group (optional). Looked up with
+                group_api#lookup_id when not given.
+
+        """
         self.__username(fname, lname)
-        self.client.add(
+        return self.client.add(
             self.__distinguished_name(type, fname=fname, lname=lname),
             API.__object_class(),
-            self.__ldap_attr(fname, lname, type, group, group_api))
+            self.__ldap_attr(fname, lname, type, group, group_api, uidnumber,
+                             gidnumber))
+
+    def create_plan(self, people, type='user'):
+        """
+        Plan the creation of many users with two searches.
+
+        One search finds the users that already exist and the IDs in use,
+        so IDs are allocated up front and the creates can run
+        concurrently; the other finds the GIDs of every primary group.
+
+        Args:
+            people: list of (first name, last name, group) tuples
+            type: 'user' or 'service'
+
+        Returns:
+            Tuple of a list of Creation tuples, a sorted list of usernames
+            that already exist and a sorted list of groups not found
+
+        """
+        if not people:
+            return [], [], []
+
+        with self.client.primary():  # replicas may not have the newest IDs
+            results = self.client.search(['(objectclass=posixAccount)'],
+                                         ['uid', 'uidNumber'])
+        existing = {result.uid.value for result in results}
+        allocator = self.client.id_allocator(
+            type, [result.uidNumber.value for result in results])
+
+        groups = sorted({group for _, _, group in people})
+        gids = {
+            result.cn.value: result.gidNumber.value
+            for result in self.client.search(
+                ['(objectclass=posixGroup)',
+                 any_of('cn', groups)], ['cn', 'gidNumber'])
+        }
+
+        creations = []
+        found = set()
+        planned = set()
+        for fname, lname, group in people:
+            username = API.__login(fname, lname)
+            if username in existing:
+                found.add(username)
+            elif group in gids and username not in planned:
+                planned.add(username)
+                creations.append(
+                    Creation(username, fname, lname, group, type,
+                             next(allocator), gids[group]))
+        return creations, sorted(found), sorted(set(groups) - set(gids))
+
+    def create_batch(self, creations, workers=DEFAULT_WORKERS, journal=None):
+        """
+        Create users planned by #create_plan, concurrently.
+
+        Args:
+            journal: bulk.Journal keyed by username (optional); users it
+                lists are skipped and users created are added to it
+
+        Returns:
+            List of (Creation, exception) tuples for users that failed
+
+        """
+        return Executor(self.client, workers).run(API.__create_user,
+                                                  creations, journal)
+
+    def ensure(self, people, type='user'):
+        """
+        Create the users that do not exist yet.
+
+        One search, projected to uid, tells which users exist, so a call
+        for users that are all present costs a single round trip.  IDs and
+        GIDs are looked up only for the users that are missing (see
+        #create_plan).
+
+        Args:
+            people: list of (first name, last name, group) tuples
+            type: 'user' or 'service'
+
+        Returns:
+            List of Creation tuples for the users created
+
+        Raises:
+            ldap_tools.exceptions.NoGroupsFound: a primary group is missing
+            ldap3.core.exceptions.LDAPOperationResult: a create failed
+
+        """
+        if not people:
+            return []
+
+        usernames = sorted({API.__login(fname, lname)
+                            for fname, lname, _ in people})
+        with self.client.primary():  # replicas may lag behind our writes
+            existing = {
+                result.uid.value for result in self.client.search(
+                    ['(objectclass=posixAccount)',
+                     any_of('uid', usernames)], ['uid'])
+            }
+        missing = [
+            person for person in people
+            if API.__login(person[0], person[1]) not in existing
+        ]
+        if not missing:
+            return []
+
+        creations, _, groups = self.create_plan(missing, type)
+        if groups:
+            raise ldap_tools.exceptions.NoGroupsFound(
+                'Group ({}) not found'.format(', '.join(groups)))
+        for creation in creations:
+            API.__create_user(self.client, creation)
+        return creations
 
     def delete(self, username, type):
         """Delete an LDAP user."""
-        self.client.delete(self.__distinguished_name(type, username=username))
+        return self.client.delete(
+            self.__distinguished_name(type, username=username))
+
+    def offboard_plan(self, usernames, type=None):
+        """
+        Plan the removal of users and every trace of them.
+
+        One search finds the users and another every group that lists any
+        of them in memberUid, so each affected group needs a single modify
+        however many of its members leave.
+
+        Args:
+            usernames: users to remove
+            type: only remove accounts of this type ('user' or 'service'),
+                i.e. under its OU (optional). Memberships name uids, not
+                DNs, so they are kept while an account of another type
+                has the uid.
+
+        Returns:
+            Tuple of a list of (action, dn, values) operations and a sorted
+            list of usernames that were not found. action is
+            'remove_members', 'remove_keys' or 'delete'.
+
+        """
+        usernames = sorted(set(usernames))
+        if not usernames:
+            return [], []
+
+        operations = []
+        found = set()
+        kept = set()
+        results = self.client.search(
+            ['(objectclass=posixAccount)',
+             any_of('uid', usernames)], ['uid', 'sshPublicKey'])
+        for result in sorted(results, key=lambda i: i.entry_dn):
+            wanted = type is None or normalize_dn(
+                result.entry_dn) == normalize_dn(self.__distinguished_name(
+                    type, username=result.uid.value))
+            if not wanted:
+                kept.add(result.uid.value)
+                continue
+            found.add(result.uid.value)
+            if result.sshPublicKey.values:
+                operations.append(('remove_keys', result.entry_dn, []))
+            operations.append(('delete', result.entry_dn, []))
+
+        results = self.client.search(
+            ['(objectclass=posixGroup)',
+             any_of('memberUid', usernames)], ['cn', 'memberUid'])
+        for result in sorted(results, key=lambda i: i.entry_dn):
+            members = set(result.memberUid.values) & (set(usernames) - kept)
+            if members:
+                operations.append(('remove_members', result.entry_dn,
+                                   sorted(members)))
+
+        return operations, sorted(set(usernames) - found)
+
+    def offboard(self, operations, workers=DEFAULT_WORKERS):
+        """
+        Apply operations planned by #offboard_plan.
+
+        Group memberships and keys are removed first, concurrently, so
+        access is revoked even if deleting an entry fails; the entries are
+        then deleted concurrently.
+
+        Returns:
+            List of (operation, exception) tuples for operations that failed
+
+        """
+        failures = []
+        executor = Executor(self.client, workers)
+        for phase in (('remove_members', 'remove_keys'), ('delete', )):
+            batch = [i for i in operations if i[0] in phase]
+            failures.extend(executor.run(API.__offboard_operation, batch))
+        return failures
+
+    def index(self, attributes=None, sort=None, offset=0, limit=None):
+        """
+        Return user info in LDIF format.
+
+        Args:
+            attributes: attributes to fetch (optional).
+                Defaults to API.INDEX_ATTRIBUTES.
+            sort: attribute to sort by, prefixed with '-' for descending
+                order (optional). Defaults to uid when windowing.
+            offset: number of users to skip
+            limit: maximum number of users to return (optional)
+
+        """
+        if attributes is None:
+            attributes = API.INDEX_ATTRIBUTES
 
-    def index(self):
-        """Return user info in LDIF format."""
         filter = ["(objectclass=posixAccount)"]
-        return self.client.search(filter)
+        if sort is None and offset == 0 and limit is None:
+            return self.client.search(filter, attributes)
+        return self.client.sorted_search(filter, attributes, sort or 'uid',
+                                         offset, limit)
+
+    def show(self, username, attributes=None):
+        """
+        Return a specific user's info in LDIF format.
+
+        Args:
+            attributes: attributes to fetch (optional). Defaults to all.
 
-    def show(self, username):
-        """Return a specific user's info in LDIF format."""
+        """
         filter = ['(objectclass=posixAccount)', "(uid={})".format(username)]
-        return self.client.search(filter)
+        return self.client.search(filter, attributes)
 
-    def find(self, username):
+    def find(self, username, attributes=None):
         """
         Find user with given username.
 
         Args:
             username Username of the user to search for
+            attributes: attributes to fetch (optional). Defaults to
+                objectClass only; the DN is always returned.
 
         Raises:
             ldap_tools.exceptions.NoUserFound: No users returned by LDAP
@@ -56,8 +296,11 @@ class API:
                 Multiple users returned by LDAP
 
         """
+        if attributes is None:
+            attributes = ['objectClass']
+
         filter = ['(uid={})'.format(username)]
-        results = self.client.search(filter)
+        results = self.client.search(filter, attributes)
 
         if len(results) < 1:
             raise ldap_tools.exceptions.NoUserFound(
@@ -70,6 +313,31 @@ class API:
         else:
             return results
 
+    def __create_user(client, creation):
+        return check(client,
+                     API(client).create(creation.fname, creation.lname,
+                                        creation.group, creation.type,
+                                        GroupApi(client), creation.uidnumber,
+                                        creation.gidnumber))
+
+    def __offboard_operation(client, operation):
+        action, distinguished_name, values = operation
+        if action == 'remove_members':
+            return check(client,
+                         client.modify(distinguished_name, {
+                             'memberUid': [(ldap3.MODIFY_DELETE, values)]
+                         }))
+        elif action == 'remove_keys':
+            return check(client,
+                         client.modify(distinguished_name, {
+                             'sshPublicKey': [(ldap3.MODIFY_REPLACE, [])]
+                         }))
+        return check(client, client.delete(distinguished_name))
+
+    def __login(fname, lname):
+        """Username of first.last style for a first and last name."""
+        return '.'.join([i.lower() for i in [fname, lname]])
+
     def __username(self, fname, lname):  # pragma: no cover
         """Convert first name + last name into first.last style username."""
         self.username = '.'.join([i.lower() for i in [fname, lname]])
@@ -90,9 +358,14 @@ class API:
 
         return ','.join(dn_list)
 
-    def __ldap_attr(self, fname, lname, type, group,
-                    group_api):  # pragma: no cover
+    def __ldap_attr(self, fname, lname, type, group, group_api,
+                    uidnumber=None, gidnumber=None):  # pragma: no cover
         """User LDAP attributes."""
+        if uidnumber is None:
+            uidnumber = self.__uidnumber(type)
+        if gidnumber is None:
+            gidnumber = API.__gidnumber(group, group_api)
+
         return {
             'uid':
             str(self.username).encode(),
@@ -109,9 +382,9 @@ class API:
             'mail':
             '@'.join([self.username, self.client.mail_domain]).encode(),
             'uidnumber':
-            self.__uidnumber(type),
+            uidnumber,
             'gidnumber':
-            API.__gidnumber(group, group_api),
+            gidnumber,
             'userpassword':
             str('{SSHA}' + API.__create_password().decode()).encode(),
         }
@@ -191,6 +464,106 @@ class CLI:
         group_api = GroupApi(client)
         user_api.create(name[0], name[1], group, type, group_api)
 
+    @user.command()
+    @click.option(
+        '--name',
+        '-n',
+        'names',
+        required=True,
+        multiple=True,
+        nargs=2,
+        help="User's first and last name (repeatable)")
+    @click.option(
+        '--group', '-g', required=True, help='Specify name of primary group')
+    @click.option(
+        '--type',
+        '-t',
+        'usertype',
+        type=click.Choice(['user', 'service']),
+        help='Specfy if these are user or service accounts',
+        default='user',
+        show_default=True)
+    @click.pass_obj
+    def ensure(config, names, group, usertype):
+        """
+        Create users only where missing.
+
+        Prints the users created; nothing is printed if all existed.
+        """
+        client = Client()
+        client.prepare_connection()
+        user_api = API(client)
+        try:
+            creations = user_api.ensure(
+                [(fname, lname, group) for fname, lname in names], usertype)
+        except (ldap_tools.exceptions.NoGroupsFound,
+                ldap3.core.exceptions.LDAPOperationResult) as err:
+            sys.exit('{}: {}'.format(type(err), err))
+        for creation in creations:
+            print('+ user {} (uid {}, group {})'.format(
+                creation.username, creation.uidnumber, creation.group))
+
+    @user.command()
+    @click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+    @click.option(
+        '--type',
+        '-t',
+        type=click.Choice(['user', 'service']),
+        help='Specfy if these are user or service accounts',
+        default='user',
+        show_default=True)
+    @click.option(
+        '--workers',
+        '-w',
+        default=DEFAULT_WORKERS,
+        show_default=True,
+        help='Maximum number of concurrent LDAP operations')
+    @click.option(
+        '--resume',
+        is_flag=True,
+        help='Skip users created by a previous run (see FILENAME.journal)')
+    @click.pass_obj
+    def create_batch(config, filename, type, workers, resume):
+        """
+        Create the users listed in a file.
+
+        FILENAME has one user per line: first name, last name and primary
+        group, separated by whitespace.
+        """
+        people = []
+        with open(filename, 'r') as FILE:
+            for number, line in enumerate(FILE, 1):
+                if not line.strip() or line.startswith('#'):
+                    continue
+                fields = line.split()
+                if len(fields) != 3:
+                    sys.exit('{}:{}: expected first name, last name and '
+                             'group'.format(filename, number))
+                people.append(tuple(fields))
+
+        journal = Journal('{}.journal'.format(filename),
+                          lambda creation: creation.username, resume)
+        client = Client()
+        client.prepare_connection()
+        user_api = API(client)
+        creations, existing, missing = user_api.create_plan(people, type)
+        for username in existing:
+            if not journal.recorded(username):  # created by an earlier run
+                print('User ({}) already exists'.format(username),
+                      file=sys.stderr)
+        for group in missing:
+            print('Group ({}) not found'.format(group), file=sys.stderr)
+        if missing:
+            sys.exit(1)
+
+        failures = user_api.create_batch(creations, workers, journal)
+        journal.close(finished=not failures)
+        for creation, err in failures:
+            print('Failed: {}: {}'.format(creation.username, err),
+                  file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
     @user.command()
     @click.option(
         '--username', '-u', required=True, help="Specify username to delete")
@@ -200,30 +573,100 @@ class CLI:
         help='Specfy if this is a user or service account',
         default='user',
         show_default=True)
+    @click.option(
+        '--purge',
+        is_flag=True,
+        help='Also remove the user from every group')
     @click.pass_obj
-    def delete(config, username, type):
+    def delete(config, username, type, purge):
         """Delete an LDAP user."""
         client = Client()
         client.prepare_connection()
         user_api = API(client)
-        user_api.delete(username, type)
+        if not purge:
+            user_api.delete(username, type)
+            return
+        operations, missing = user_api.offboard_plan([username], type)
+        CLI.report_offboarding(
+            user_api.offboard(operations, workers=1), missing)
+
+    @user.command()
+    @click.argument('filename', type=click.File('r'))
+    @click.option(
+        '--workers',
+        '-w',
+        default=DEFAULT_WORKERS,
+        show_default=True,
+        help='Maximum number of concurrent LDAP operations')
+    @click.option('--force', is_flag=True, help='Delete without confirmation')
+    @click.pass_obj
+    def offboard(config, filename, workers, force):
+        """
+        Delete users listed in a file, with their keys and memberships.
+
+        FILENAME has one username per line ('-' reads stdin).
+        """
+        usernames = [
+            line.strip() for line in filename
+            if line.strip() and not line.startswith('#')
+        ]
+        client = Client()
+        client.prepare_connection()
+        user_api = API(client)
+        operations, missing = user_api.offboard_plan(usernames)
+        for action, distinguished_name, values in operations:
+            print('{} {} {}'.format(action, distinguished_name,
+                                    ' '.join(values)).rstrip())
+        if not force:
+            if not click.confirm('Offboard {} user(s)?'.format(
+                    len(set(usernames)))):
+                sys.exit('Offboarding aborted')
+        CLI.report_offboarding(user_api.offboard(operations, workers), missing)
+
+    def report_offboarding(failures, missing):  # pragma: no cover
+        """Print the outcome of API#offboard; exit 1 if anything failed."""
+        for username in missing:
+            print('User ({}) not found'.format(username), file=sys.stderr)
+        for (action, distinguished_name, _), err in failures:
+            print(
+                'Failed: {} {}: {}'.format(action, distinguished_name, err),
+                file=sys.stderr)
+        if failures or missing:
+            sys.exit(1)
 
     @user.command()
+    @click.option(
+        '--attributes',
+        '-a',
+        multiple=True,
+        help='Attribute to display (repeatable); default: {}'.format(
+            ', '.join(API.INDEX_ATTRIBUTES)))
+    @click.option(
+        '--sort', '-s', help='Attribute to sort by; prefix with - to reverse')
+    @click.option(
+        '--offset', default=0, show_default=True, help='Users to skip')
+    @click.option('--limit', type=int, help='Maximum users to display')
     @click.pass_obj
-    def index(config):
+    def index(config, attributes, sort, offset, limit):
         """Display user info in LDIF format."""
         client = Client()
         client.prepare_connection()
         user_api = API(client)
-        CLI.show_user(user_api.index())
+        CLI.show_user(
+            user_api.index(list(attributes) or None, sort, offset, limit))
 
     @user.command()
     @click.option(
         '--username', '-u', required=True, help="Specify username to delete")
+    @click.option(
+        '--attributes',
+        '-a',
+        multiple=True,
+        help='Attribute to display (repeatable); default: all')
     @click.pass_obj
-    def show(config, username):
+    def show(config, username, attributes):
         """Display a specific user."""
         client = Client()
         client.prepare_connection()
         user_api = API(client)
-        CLI.show_user(user_api.show(username))
+        CLI.show_user(user_api.show(username, list(attributes) or None))
@@ -0,0 +1,53 @@
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import mocker  # noqa: F401
+
+from ldap_tools.client import Client
+
+
+@pytest.fixture
+def servers(mocker):  # noqa: F811
+    """
+    Client of primary ldap1 and replica ldap2, with mock connections.
+
+    Returns:
+        Tuple of the connected client and a dictionary of host to its mock
+        ldap3 connection, filled in as the client connects to hosts
+
+    """
+    connections = {}
+    mocker.patch('time.sleep')  # backoff between retries
+    mocker.patch('ldap3.Server', side_effect=lambda host, **kwargs: host)
+    mocker.patch(
+        'ldap3.Connection',
+        side_effect=lambda host, **kwargs: connections.setdefault(
+            host, MagicMock(result={'result': 0}, entries=[])))
+    client = Client()
+    client.host = 'ldap1'
+    client.port = 389
+    client.user_dn = 'cn=admin,dc=test,dc=org'
+    client.user_pw = 'secret'
+    client.basedn = 'dc=test,dc=org'
+    client.replicas = ['ldap2']
+    client.connection()
+    return client, connections
+
+
+@pytest.fixture
+def entry():
+    """
+    Factory of mock search results, e.g. entry(dn, uid=['a'], cn='A').
+
+    Each attribute gets its values as .values and the first as .value.
+    """
+    def entry(dn=None, **attributes):
+        result = MagicMock(entry_dn=dn)
+        for name, values in attributes.items():
+            if not isinstance(values, list):
+                values = [values]
+            getattr(result, name).values = values
+            getattr(result, name).value = values[0] if values else None
+        return result
+
+    return entry
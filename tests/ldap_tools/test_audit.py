@@ -1,8 +1,16 @@
+import io
+import json
+from unittest.mock import MagicMock
+
+import pytest
 from click.testing import CliRunner
 from pytest_mock import mocker  # noqa: F401
 
 import ldap_tools
+from ldap_tools.audit import API as AuditApi
 from ldap_tools.audit import CLI as AuditCli
+from ldap_tools.audit import MembershipMatrix
+from ldap_tools.client import Client
 
 
 def describe_audit():
@@ -27,8 +35,153 @@ def describe_audit():
             runner.invoke(AuditCli.audit, ['by_group'])
             ldap_tools.audit.API.by_group.assert_called_once_with()
 
+        def it_lists_groups_of_one_user(mocker):  # noqa: F811
+            mocker.patch('ldap_tools.audit.API.user', return_value={})
+            mocker.patch(
+                'ldap_tools.client.Client.prepare_connection',
+                return_value=None)
+
+            runner.invoke(AuditCli.audit, ['user', 'test.user'])
+            ldap_tools.audit.API.user.assert_called_once_with('test.user')
+
+        def it_lists_members_of_one_group(mocker):  # noqa: F811
+            mocker.patch('ldap_tools.audit.API.group', return_value={})
+            mocker.patch(
+                'ldap_tools.client.Client.prepare_connection',
+                return_value=None)
+
+            runner.invoke(AuditCli.audit, ['group', 'testgroup'])
+            ldap_tools.audit.API.group.assert_called_once_with('testgroup')
+
+        def it_snapshots_membership(mocker, tmpdir):  # noqa: F811
+            mocker.patch(
+                'ldap_tools.audit.API.by_group',
+                return_value={'testgroup': ['test.user']})
+            mocker.patch(
+                'ldap_tools.client.Client.prepare_connection',
+                return_value=None)
+
+            runner.invoke(AuditCli.audit, ['snapshot', '--path', str(tmpdir)])
+            result = runner.invoke(AuditCli.audit,
+                                   ['at', '2100-01-01', '--path',
+                                    str(tmpdir)])
+
+            assert 'test.user' in result.output
+
     def describe_api_calls():
-        pass  # no testable methods implemented
+        client = Client()
+
+        def _group(cn, members):
+            record = MagicMock()
+            record.cn.value = cn
+            record.memberUid.values = members
+            return record
+
+        def it_finds_groups_with_an_equality_filter():
+            client.search = MagicMock(return_value=[
+                _group('testgroup2', []),
+                _group('testgroup', [])
+            ])
+            audit_api = AuditApi(client)
+
+            assert audit_api.user('test.user') == {
+                'test.user': ['testgroup', 'testgroup2']
+            }
+            client.search.assert_called_once_with(
+                ['(objectclass=posixGroup)', '(memberUid=test.user)'], ['cn'])
+
+        def it_escapes_the_username():
+            client.search = MagicMock(return_value=[])
+            audit_api = AuditApi(client)
+
+            audit_api.user('*')
+
+            client.search.assert_called_once_with(
+                ['(objectclass=posixGroup)', '(memberUid=\\2a)'], ['cn'])
+
+        def it_finds_members_of_a_group():
+            client.search = MagicMock(
+                return_value=[_group('testgroup', ['b.user', 'a.user'])])
+            audit_api = AuditApi(client)
+
+            assert audit_api.group('testgroup') == {
+                'testgroup': ['a.user', 'b.user']
+            }
+
+        def it_builds_the_matrix_from_one_search():
+            user = MagicMock()
+            user.objectClass.values = ['posixAccount']
+            user.uid.value = 'd.user'
+            group = _group('testgroup', ['a.user'])
+            group.objectClass.values = ['posixGroup']
+            client.search = MagicMock(return_value=[user, group])
+            audit_api = AuditApi(client)
+
+            matrix = audit_api.matrix()
+
+            client.search.assert_called_once()
+            assert matrix.groups == ['testgroup']
+            assert matrix.users == ['a.user', 'd.user']
+
+        def it_raises_exception_on_missing_group():
+            client.search = MagicMock(return_value=[])
+            audit_api = AuditApi(client)
+
+            with pytest.raises(ldap_tools.exceptions.NoGroupsFound):
+                audit_api.group('testgroup')
+
+    def describe_membership_matrix():
+        matrix = MembershipMatrix({
+            'admins': ['a.user'],
+            'developers': ['a.user', 'b.user'],
+            'engineers': ['b.user', 'a.user'],
+            'sales': ['c.user']
+        }, ['a.user', 'b.user', 'c.user', 'd.user'])
+
+        def it_compares_groups_sharing_members():
+            assert matrix.overlaps() == [{
+                'groups': ['developers', 'engineers'],
+                'shared': 2,
+                'jaccard': 1.0,
+                'relation': 'equal'
+            }, {
+                'groups': ['admins', 'developers'],
+                'shared': 1,
+                'jaccard': 0.5,
+                'relation': 'subset'
+            }, {
+                'groups': ['admins', 'engineers'],
+                'shared': 1,
+                'jaccard': 0.5,
+                'relation': 'subset'
+            }]
+
+        def it_applies_the_threshold():
+            assert [i['groups'] for i in matrix.overlaps(0.75)] == [[
+                'developers', 'engineers'
+            ]]
+
+        def it_counts_groups_per_user():
+            assert matrix.user_counts() == {
+                'a.user': 3,
+                'b.user': 2,
+                'c.user': 1,
+                'd.user': 0
+            }
+
+        def it_exports_json():
+            output = io.StringIO()
+            matrix.export(output)
+
+            results = json.loads(output.getvalue())
+            assert results['groups']['developers'] == 2
+            assert len(results['overlaps']) == 3
+
+        def it_exports_csv():
+            output = io.StringIO()
+            matrix.export(output, 'csv', 0.75)
 
-    def describe_utility_methods():
-        pass
+            assert output.getvalue().splitlines() == [
+                'group_a,group_b,shared,jaccard,relation',
+                'developers,engineers,2,1.0,equal'
+            ]
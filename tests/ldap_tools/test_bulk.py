@@ -0,0 +1,105 @@
+from unittest.mock import MagicMock
+
+import ldap3
+import pytest
+
+from ldap_tools.bulk import Executor
+from ldap_tools.bulk import Journal
+from ldap_tools.bulk import check
+from ldap_tools.client import Client
+
+
+def describe_bulk():
+    def describe_executor():
+        def it_runs_sequentially_on_the_given_client():
+            client = Client()
+            client.spawn = MagicMock()
+            executor = Executor(client, workers=1)
+
+            results = list(
+                executor.results(lambda c, item: (c, item * 2), [1, 2]))
+
+            assert results == [(1, (client, 2), None), (2, (client, 4), None)]
+            client.spawn.assert_not_called()
+
+        def it_uses_one_connection_per_worker():
+            client = Client()
+            client.spawn = MagicMock(side_effect=lambda: MagicMock())
+            executor = Executor(client, workers=3)
+
+            results = list(executor.results(lambda c, item: item, range(20)))
+
+            assert sorted(result for _, result, _ in results) == list(
+                range(20))
+            assert 1 <= client.spawn.call_count <= 3
+
+        def it_reports_failures():
+            client = Client()
+            executor = Executor(client, workers=1)
+
+            def fail_odd(client, item):
+                if item % 2:
+                    raise ValueError(item)
+                return item
+
+            failures = executor.run(fail_odd, [1, 2, 3])
+
+            assert [item for item, _ in failures] == [1, 3]
+            assert all(isinstance(err, ValueError) for _, err in failures)
+
+    def describe_journal():
+        def it_skips_items_recorded_by_a_previous_run(tmpdir):
+            filename = str(tmpdir.join('run.journal'))
+            journal = Journal(filename)
+            executor = Executor(Client(), workers=1)
+            executor.run(lambda c, item: item, [1], journal)
+            journal.close()
+
+            journal = Journal(filename, resume=True)
+            done = [item for item, _, _ in executor.results(
+                lambda c, item: item, [1, 2, 3], journal)]
+
+            assert done == [2, 3]
+            assert len(journal) == 3
+
+        def it_does_not_record_failures(tmpdir):
+            journal = Journal(str(tmpdir.join('run.journal')))
+
+            def _fail(client, item):
+                raise ValueError(item)
+
+            Executor(Client(), workers=1).run(_fail, [1], journal)
+
+            assert 1 not in journal
+
+        def it_starts_empty_unless_resuming(tmpdir):
+            filename = str(tmpdir.join('run.journal'))
+            Journal(filename).record('a')
+
+            assert 'a' not in Journal(filename)
+
+        def it_is_removed_when_finished(tmpdir):
+            journal = Journal(str(tmpdir.join('run.journal')))
+
+            journal.close(finished=True)
+
+            assert not tmpdir.join('run.journal').check()
+
+    def describe_check():
+        def it_passes_successful_results_through():
+            assert check(Client(), True) is True
+
+        def it_raises_the_matching_ldap3_exception():
+            client = Client()
+            client.conn = MagicMock()
+            client.conn.result = {
+                'result': 68,
+                'description': 'entryAlreadyExists',
+                'dn': '',
+                'message': '',
+                'type': 'addResponse'
+            }
+
+            with pytest.raises(
+                    ldap3.core.exceptions.LDAPEntryAlreadyExistsResult):
+                check(client, False)
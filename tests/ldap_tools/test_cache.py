@@ -0,0 +1,122 @@
+from unittest.mock import MagicMock
+
+from pytest_mock import mocker  # noqa: F401
+
+from ldap_tools.cache import SearchCache
+from ldap_tools.client import Client
+
+
+def _entry(dn):
+    return MagicMock(entry_dn=dn)
+
+
+def describe_cache():
+    user_filter = ['(objectclass=posixAccount)', '(uid=test.user)']
+    group_filter = ['(objectclass=posixGroup)', '(cn=testgroup)']
+    user_dn = 'uid=test.user,ou=People,dc=test,dc=org'
+    group_dn = 'cn=testgroup,ou=Group,dc=test,dc=org'
+
+    def _filled():
+        cache = SearchCache()
+        cache.put(cache.key('dc=test,dc=org', user_filter, ['uid']),
+                  user_filter, [_entry(user_dn)])
+        cache.put(cache.key('dc=test,dc=org', group_filter, ['gidNumber']),
+                  group_filter, [_entry(group_dn)])
+        return cache
+
+    def describe_lookups():
+        def it_normalizes_keys():
+            cache = _filled()
+
+            assert cache.get(
+                cache.key('DC=test,dc=org', list(reversed(user_filter)),
+                          ['UID'])) is not None
+            assert cache.stats()['hits'] == 1
+
+        def it_keeps_the_case_of_filter_values():
+            cache = SearchCache()
+            key = cache.key('dc=test,dc=org', ['(memberUid=Alice)'], ['cn'])
+
+            assert key == cache.key('dc=test,dc=org', ['(MEMBERUID=Alice)'],
+                                    ['cn'])
+            assert key != cache.key('dc=test,dc=org', ['(memberUid=alice)'],
+                                    ['cn'])
+
+        def it_expires_results(mocker):  # noqa: F811
+            cache = _filled()
+            mocker.patch('time.monotonic', return_value=10.0 ** 12)
+
+            assert cache.get(
+                cache.key('dc=test,dc=org', user_filter, ['uid'])) is None
+            assert cache.stats()['misses'] == 1
+
+        def it_evicts_least_recently_used():
+            cache = SearchCache(size=1)
+            cache.put(('a', ), [], [])
+            cache.put(('b', ), [], [])
+
+            assert cache.get(('a', )) is None
+            assert cache.get(('b', )) == []
+            assert cache.stats()['evictions'] == 1
+
+    def describe_invalidation():
+        def it_invalidates_results_holding_a_deleted_dn():
+            cache = _filled()
+
+            cache.deleted('uid=Test.User, ou=People,dc=test,dc=org')
+
+            assert cache.stats()['size'] == 1
+            assert cache.get(
+                cache.key('dc=test,dc=org', group_filter,
+                          ['gidNumber'])) is not None
+
+        def it_invalidates_filters_testing_modified_attributes():
+            cache = _filled()
+
+            cache.modified('uid=other.user,ou=People,dc=test,dc=org',
+                           ['uid'])
+
+            assert cache.stats()['size'] == 1
+
+        def it_invalidates_only_matching_object_classes_on_add():
+            cache = _filled()
+            anything = ['(cn=*)']
+            cache.put(cache.key('dc=test,dc=org', anything, []), anything, [])
+
+            cache.added('cn=new,ou=Group,dc=test,dc=org',
+                        ['top', 'posixGroup'])
+
+            assert cache.stats()['size'] == 1
+            assert cache.get(cache.key('dc=test,dc=org', user_filter,
+                                       ['uid'])) is not None
+
+    def describe_client():
+        def it_serves_repeated_searches_from_the_cache():
+            client = Client()
+            client.basedn = 'dc=test,dc=org'
+            client.conn = MagicMock()
+            client.conn.result = {'result': 0}
+            client.conn.entries = [_entry(user_dn)]
+            client.enable_cache()
+
+            client.search(user_filter, ['uid'])
+            client.search(user_filter, ['uid'])
+            client.modify(user_dn, {'mail': []})
+            client.search(user_filter, ['uid'])
+
+            assert client.conn.search.call_count == 2
+            assert client.cache.stats()['hits'] == 1
+
+        def it_searches_again_for_reads_from_the_primary():
+            client = Client()
+            client.basedn = 'dc=test,dc=org'
+            client.conn = MagicMock()
+            client.conn.result = {'result': 0}
+            client.conn.entries = []
+            client.enable_cache()
+
+            client.get_max_id('user', 'user')
+            client.get_max_id('user', 'user')
+
+            assert client.conn.search.call_count == 2
+            assert client.cache.stats()['hits'] == 0
@@ -1,10 +1,13 @@
+import itertools
 from unittest.mock import MagicMock
 
 import ldap3
 import pytest
+from pytest_mock import mocker  # noqa: F401
 
 import ldap_tools
 from ldap_tools.client import Client
+from ldap_tools.client import any_of
 
 
 def describe_client():
@@ -69,6 +72,195 @@ def describe_client():
                 search_scope=ldap3.SUBTREE,
                 attributes=attributes)
 
+    def describe_sorted_search():
+        def _entry(dn):
+            result = MagicMock()
+            result.entry_dn = dn
+            return result
+
+        def it_uses_server_controls_when_supported(mocker):  # noqa: F811
+            entries = [_entry('uid=b,dc=test,dc=org')]
+            mocker.patch.object(
+                client, '_Client__server_side_window', return_value=True)
+            client.search = MagicMock(return_value=entries)
+            client.conn.result = {'result': 0}
+
+            assert client.sorted_search(['(objectclass=posixAccount)'],
+                                        ['uid'], 'uid', 1, 1) == entries
+            assert len(client.search.call_args[0][2]) == 2
+
+        def it_windows_on_the_client_otherwise(mocker):  # noqa: F811
+            responses = [{
+                'dn': 'uid={},dc=test,dc=org'.format(uid),
+                'attributes': {
+                    'uid': [uid]
+                }
+            } for uid in ['d', 'a', 'c', 'b']]
+            mocker.patch.object(
+                client, '_Client__server_side_window', return_value=False)
+            client.stream = MagicMock(return_value=iter(responses))
+            client.search = MagicMock(return_value=[
+                _entry('uid=c,dc=test,dc=org'),
+                _entry('uid=b,dc=test,dc=org')
+            ])
+
+            results = client.sorted_search(['(objectclass=posixAccount)'],
+                                           ['uid'], 'uid', 1, 2)
+
+            client.search.assert_called_once_with(
+                ['(objectclass=posixAccount)', '(|(uid=b)(uid=c))'], ['uid'])
+            assert [i.entry_dn for i in results] == [
+                'uid=b,dc=test,dc=org', 'uid=c,dc=test,dc=org'
+            ]
+
+        def it_sorts_missing_values_last(mocker):  # noqa: F811
+            missing = _entry('cn=x,dc=test,dc=org')
+            missing.entry_attributes_as_dict = {'mail': []}
+            present = _entry('cn=y,dc=test,dc=org')
+            present.entry_attributes_as_dict = {'mail': ['y@test.org']}
+            mocker.patch.object(
+                client, '_Client__server_side_window', return_value=False)
+            client.search = MagicMock(return_value=[missing, present])
+
+            results = client.sorted_search(None, None, 'mail')
+
+            assert [i.entry_dn for i in results] == [
+                'cn=y,dc=test,dc=org', 'cn=x,dc=test,dc=org'
+            ]
+
+        def it_fetches_unlimited_windows_in_one_search(mocker):  # noqa: F811
+            entries = []
+            for uid in ['b', 'c', 'a']:
+                entry = _entry('uid={},dc=test,dc=org'.format(uid))
+                entry.entry_attributes_as_dict = {'uid': [uid]}
+                entries.append(entry)
+            mocker.patch.object(
+                client, '_Client__server_side_window', return_value=False)
+            client.stream = MagicMock()
+            client.search = MagicMock(return_value=entries)
+
+            results = client.sorted_search(['(objectclass=posixAccount)'],
+                                           ['mail'], '-uid', 1)
+
+            client.search.assert_called_once_with(
+                ['(objectclass=posixAccount)'], ['mail', 'uid'])
+            client.stream.assert_not_called()
+            assert [i.entry_dn for i in results] == [
+                'uid=b,dc=test,dc=org', 'uid=a,dc=test,dc=org'
+            ]
+
+    def describe_watch():
+        def _response(dn, stamp):
+            return {
+                'dn': dn,
+                'raw_attributes': {
+                    'modifyTimestamp': [stamp]
+                }
+            }
+
+        def it_polls_for_newer_modify_timestamps(mocker):  # noqa: F811
+            watcher = Client()
+            mocker.patch('time.sleep')
+            mocker.patch.object(
+                watcher, 'supports_control', return_value=False)
+            watcher.stream = MagicMock(side_effect=[
+                [_response('cn=a', b'20180101000000Z')],
+                [
+                    _response('cn=a', b'20180101000000Z'),
+                    _response('cn=b', b'20180102000000Z')
+                ],
+                [_response('cn=b', b'20180102000000Z')],
+            ])
+
+            changes = list(
+                itertools.islice(watcher.watch(['(cn=*)'], ['cn']), 1))
+
+            assert changes == [('modify', 'cn=b', {
+                'modifyTimestamp': [b'20180102000000Z']
+            })]
+            assert watcher.stream.call_args_list[1][0] == ([
+                '(cn=*)', '(modifyTimestamp>=20180101000000Z)'
+            ], ['cn', 'modifyTimestamp'])
+
+    def describe_sharded_stream():
+        entries = {
+            'ou=People,dc=test,dc=org': [
+                'uid=alice,ou=People,dc=test,dc=org',
+                'uid=zed,ou=People,dc=test,dc=org',
+                'uid=_svc,ou=People,dc=test,dc=org',
+            ],
+            'ou=Group,dc=test,dc=org': ['cn=admins,ou=Group,dc=test,dc=org'],
+        }
+
+        def _scanner():
+            scanner = Client()
+            scanner.basedn = 'dc=test,dc=org'
+            scanner.spawn = MagicMock(return_value=scanner)
+
+            def _stream(filter, attributes=None, page_size=500, base=None,
+                        scope=ldap3.SUBTREE):
+                dns = [dn for ou in sorted(entries) for dn in entries[ou]]
+                if scope == ldap3.BASE:
+                    dns = [base]
+                elif scope == ldap3.LEVEL:
+                    dns = sorted(entries)
+                elif base is not None:
+                    dns = entries[base]
+                elif filter[-1].startswith('(!'):
+                    dns = [dns[0], dns[2], dns[3]]
+                else:
+                    dns = [dn for dn in dns
+                           if '(uid={}*)'.format(dn[4]) in filter[-1]]
+                for dn in dns:
+                    yield {'dn': dn}
+
+            scanner.stream = MagicMock(side_effect=_stream)
+            return scanner
+
+        def it_merges_ou_shards_after_the_base_entry():
+            responses = list(_scanner().sharded_stream(None, workers=2))
+
+            assert responses[0] == {'dn': 'dc=test,dc=org'}
+            assert sorted(i['dn'] for i in responses[1:]) == sorted(
+                dn for dns in entries.values() for dn in dns)
+
+        def it_merges_uid_shards_without_duplicates():
+            responses = list(_scanner().sharded_stream(
+                ['(sshPublicKey=*)'], shard_by='uid', workers=2))
+
+            # uid=zed is also in the catch-all shard here, as if it had a
+            # second uid, and is reported once
+            assert sorted(i['dn'] for i in responses) == sorted(
+                dn for dns in entries.values() for dn in dns)
+
+        def it_raises_errors_from_shards():
+            scanner = _scanner()
+            stream = scanner.stream.side_effect
+
+            def _failing(filter, attributes=None, page_size=500, base=None,
+                         scope=ldap3.SUBTREE):
+                if base == 'ou=Group,dc=test,dc=org':
+                    raise OSError('unreachable')
+                return stream(filter, attributes, page_size, base, scope)
+
+            scanner.stream.side_effect = _failing
+
+            with pytest.raises(OSError):
+                list(scanner.sharded_stream(None, workers=2))
+
+        def it_streams_sequentially_with_one_worker():
+            scanner = _scanner()
+
+            list(scanner.sharded_stream(None, workers=1))
+
+            scanner.stream.assert_called_once_with(['(objectclass=*)'], None,
+                                                   500)
+
+    def describe_any_of():
+        def it_escapes_each_value():
+            assert any_of('uid', ['a.user', 'b*']) == (
+                '(|(uid=a.user)(uid=b\\2a))')
+
     def describe_get_max_id():
         def it_gets_id_of_service_user():
             client.search = MagicMock(return_value=[])
@@ -0,0 +1,31 @@
+from ldap3.utils.asn1 import encode
+
+from ldap_tools.controls import parse_sort_key
+from ldap_tools.controls import sort_control
+from ldap_tools.controls import vlv_control
+
+
+def describe_controls():
+    def describe_parse_sort_key():
+        def it_sorts_ascending_by_default():
+            assert parse_sort_key('uid') == ('uid', False)
+
+        def it_reverses_with_a_dash():
+            assert parse_sort_key('-uid') == ('uid', True)
+
+    def describe_sort_control():
+        def it_encodes_a_reverse_sort_key():
+            control = sort_control('-uid')
+
+            assert str(control['controlType']) == '1.2.840.113556.1.4.473'
+            assert bytes(control['controlValue']) == bytes.fromhex(
+                '300a300804037569648101ff')
+
+    def describe_vlv_control():
+        def it_encodes_a_one_based_offset():
+            control = vlv_control(50, 25)
+
+            assert str(control['controlType']) == '2.16.840.1.113730.3.4.9'
+            assert bytes(control['controlValue']) == bytes.fromhex(
+                '300e020100020118a006020133020100')
+            assert encode(control)
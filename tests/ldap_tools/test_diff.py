@@ -0,0 +1,110 @@
+import io
+
+from click.testing import CliRunner
+
+from ldap_tools.diff import API as DiffApi
+from ldap_tools.diff import CLI as DiffCli
+from ldap_tools.diff import dn_key
+from ldap_tools.diff import sorted_index
+
+OLD = b"""version: 1
+
+dn: uid=b.user,ou=People,dc=test,dc=org
+uid: b.user
+mail: b@test.org
+
+dn: ou=People,dc=test,dc=org
+ou: People
+
+dn: uid=a.user,ou=People,dc=test,dc=org
+uid: a.user
+"""
+
+NEW = b"""version: 1
+
+dn: ou=People,dc=test,dc=org
+ou: People
+
+dn: uid=B.User, ou=People,dc=test,dc=org
+mail: b@example.org
+uid: b.user
+
+dn: uid=c.user,ou=People,dc=test,dc=org
+uid: c.user
+"""
+
+
+def describe_diff():
+    def describe_sorted_index():
+        def it_sorts_parents_before_children():
+            keys = [key for key, _, _ in sorted_index(io.BytesIO(OLD))]
+
+            assert keys == [
+                dn_key('ou=People,dc=test,dc=org'),
+                dn_key('uid=a.user,ou=People,dc=test,dc=org'),
+                dn_key('uid=b.user,ou=People,dc=test,dc=org'),
+            ]
+
+        def it_merges_spilled_runs():
+            assert list(sorted_index(io.BytesIO(OLD), chunk_size=1)) == list(
+                sorted_index(io.BytesIO(OLD)))
+
+        def it_ignores_attribute_order():
+            [(_, old, _)] = sorted_index(
+                io.BytesIO(b'dn: cn=a\ncn: a\nsn: b\nsn: c\n'))
+            [(_, new, _)] = sorted_index(
+                io.BytesIO(b'dn: cn=a\nsn: c\nsn: b\ncn: a\n'))
+
+            assert old == new
+
+    def describe_api():
+        def it_reports_attribute_level_changes():
+            differences = list(DiffApi().diff(
+                io.BytesIO(OLD), io.BytesIO(NEW)))
+
+            assert [(d.action, d.dn) for d in differences] == [
+                ('delete', 'uid=a.user,ou=People,dc=test,dc=org'),
+                ('modify', 'uid=B.User, ou=People,dc=test,dc=org'),
+                ('add', 'uid=c.user,ou=People,dc=test,dc=org'),
+            ]
+            assert differences[1].attributes == {
+                'mail': ([b'b@test.org'], [b'b@example.org'])
+            }
+
+        def it_formats_differences():
+            [difference] = [
+                d for d in DiffApi().diff(io.BytesIO(OLD), io.BytesIO(NEW))
+                if d.action == 'modify'
+            ]
+
+            assert DiffApi.format(difference) == [
+                '~ uid=B.User, ou=People,dc=test,dc=org',
+                '    - mail: b@test.org',
+                '    + mail: b@example.org',
+            ]
+
+    def describe_commandline():
+        runner = CliRunner()
+
+        def it_compares_files(tmpdir):
+            old = tmpdir.join('old.ldif')
+            old.write_binary(OLD)
+            new = tmpdir.join('new.ldif')
+            new.write_binary(NEW)
+
+            result = runner.invoke(DiffCli.diff, [str(old), str(new)])
+
+            assert result.exit_code == 1
+            assert '+ uid=c.user,ou=People,dc=test,dc=org' in result.output
+            assert '1 added, 1 deleted, 1 modified' in result.output
+
+        def it_exits_cleanly_without_changes(tmpdir):
+            old = tmpdir.join('old.ldif')
+            old.write_binary(OLD)
+            empty = tmpdir.join('empty.ldif')
+            empty.write_binary(b'')
+
+            assert runner.invoke(DiffCli.diff,
+                                 [str(old), str(old)]).exit_code == 0
+            result = runner.invoke(DiffCli.diff, [str(empty), str(old)])
+            assert '3 added, 0 deleted, 0 modified' in result.output
@@ -31,6 +31,12 @@ def describe_group():  # TODO: change this to use test_key.py format
         password='my_password',
         client_strategy=ldap3.MOCK_SYNC)
 
+    def _result(dn, cn, members):
+        result = MagicMock(entry_dn=dn)
+        result.cn.value = cn
+        result.memberUid.values = members
+        return result
+
     def describe_creates_group():
         def describe_commandline():
             def it_calls_the_api(mocker):  # noqa: F811
@@ -146,6 +152,162 @@ def describe_group():  # TODO: change this to use test_key.py format
                         'memberUid': [(ldap3.MODIFY_ADD, [username])]
                     })
 
+    def describe_ensures_groups():
+        def describe_commandline():
+            def it_prints_changes(mocker):  # noqa: F811
+                mocker.patch(
+                    'ldap_tools.client.Client.prepare_connection',
+                    return_value=None)
+                mocker.patch(
+                    'ldap_tools.group.API.ensure',
+                    return_value=[('create', 'ops', 10001),
+                                  ('add_members', 'ops', ['a'])])
+
+                result = runner.invoke(GroupCli.group, [
+                    'ensure', '-g', 'ops', '-g', 'dev', '-u', 'a'
+                ])
+
+                assert result.output == ('+ group ops (gid 10001)\n'
+                                         '~ group ops members: +a\n')
+                ldap_tools.group.API.ensure.assert_called_once_with(
+                    ('ops', 'dev'), 'user', ('a', ))
+
+        def describe_api():
+            def it_does_not_write_when_nothing_is_missing():
+                ensure_client = Client()
+                ensure_client.search = MagicMock(return_value=[
+                    _result('cn=ops,dc=test', 'ops', ['a', 'b'])
+                ])
+                ensure_client.add = MagicMock()
+                ensure_client.modify = MagicMock()
+
+                changes = GroupApi(ensure_client).ensure(['ops'], 'user',
+                                                         ['a', 'b'])
+
+                assert changes == []
+                ensure_client.search.assert_called_once_with(
+                    ['(objectclass=posixGroup)', '(|(cn=ops))'],
+                    ['cn', 'memberUid'])
+                ensure_client.add.assert_not_called()
+                ensure_client.modify.assert_not_called()
+
+            def it_matches_group_names_case_insensitively():
+                ensure_client = Client()
+                ensure_client.search = MagicMock(return_value=[
+                    _result('cn=developers,dc=test', 'developers', ['a'])
+                ])
+                ensure_client.add = MagicMock()
+
+                changes = GroupApi(ensure_client).ensure(
+                    ['Developers', 'developers'], 'user', ['a'])
+
+                assert changes == []
+                ensure_client.add.assert_not_called()
+
+            def it_creates_missing_groups_and_members():
+                gid = MagicMock()
+                gid.gidNumber.value = 10004
+                ensure_client = Client()
+                ensure_client.basedn = 'dc=test,dc=org'
+                ensure_client.search = MagicMock(side_effect=[[
+                    _result('cn=ops,dc=test', 'ops', ['a'])
+                ], [gid]])
+                ensure_client.add = MagicMock(return_value=True)
+                ensure_client.modify = MagicMock(return_value=True)
+
+                changes = GroupApi(ensure_client).ensure(['ops', 'dev'],
+                                                         'user', ['a'])
+
+                assert changes == [('create', 'dev', 10005),
+                                   ('add_members', 'dev', ['a'])]
+                ensure_client.modify.assert_called_once_with(
+                    'cn=dev,ou=Group,dc=test,dc=org',
+                    {'memberUid': [(ldap3.MODIFY_ADD, ['a'])]})
+
+    def describe_adds_users_in_batch():
+        def describe_commandline():
+            def it_applies_the_plan(mocker, tmpdir):  # noqa: F811
+                mocker.patch(
+                    'ldap_tools.client.Client.prepare_connection',
+                    return_value=None)
+                mocker.patch(
+                    'ldap_tools.group.API.add_users_plan',
+                    return_value=([('ops', 'cn=ops', ['a'])], []))
+                mocker.patch('ldap_tools.group.API.add_users', return_value=[])
+                filename = tmpdir.join('members.txt')
+                filename.write('# group username\nops a\n')
+
+                result = runner.invoke(GroupCli.group,
+                                       ['add_users', str(filename)])
+
+                assert result.exit_code == 0
+                ldap_tools.group.API.add_users_plan.assert_called_once_with(
+                    [('ops', 'a')])
+                assert not tmpdir.join('members.txt.journal').check()
+
+            def it_resumes_new_members(mocker, tmpdir):  # noqa: F811
+                mocker.patch(
+                    'ldap_tools.client.Client.prepare_connection',
+                    return_value=None)
+                mocker.patch(
+                    'ldap_tools.group.API.add_users_plan',
+                    return_value=([('ops', 'cn=ops', ['b'])], []))
+                mocker.patch(
+                    'ldap_tools.client.Client.modify', return_value=True)
+                filename = tmpdir.join('members.txt')
+                filename.write('ops a\nops b\n')
+                tmpdir.join('members.txt.journal').write('ops a\n')
+
+                result = runner.invoke(GroupCli.group,
+                                       ['add_users', str(filename), '-w', '1',
+                                        '--resume'])
+
+                assert result.exit_code == 0
+                ldap_tools.client.Client.modify.assert_called_once_with(
+                    'cn=ops', {'memberUid': [(ldap3.MODIFY_ADD, ['b'])]})
+
+        def describe_api():
+            def it_plans_with_one_search():
+                batch_client = Client()
+                batch_client.search = MagicMock(return_value=[
+                    _result('cn=ops,dc=test', 'ops', ['a']),
+                    _result('cn=dev,dc=test', 'dev', [])
+                ])
+
+                operations, missing = GroupApi(batch_client).add_users_plan(
+                    [('ops', 'a'), ('ops', 'b'), ('dev', 'a'), ('gone', 'a')])
+
+                assert missing == ['gone']
+                assert operations == [('ops', 'cn=ops,dc=test', ['b']),
+                                      ('dev', 'cn=dev,dc=test', ['a'])]
+                batch_client.search.assert_called_once_with(
+                    ['(objectclass=posixGroup)',
+                     '(|(cn=ops)(cn=dev)(cn=gone))'], ['cn', 'memberUid'])
+
+            def it_matches_group_names_case_insensitively():
+                batch_client = Client()
+                batch_client.search = MagicMock(return_value=[
+                    _result('cn=ops,dc=test', 'ops', ['a'])
+                ])
+
+                operations, missing = GroupApi(batch_client).add_users_plan(
+                    [('Ops', 'a'), ('OPS', 'b')])
+
+                assert (operations, missing) == ([('Ops', 'cn=ops,dc=test',
+                                                   ['b'])], [])
+
+            def it_adds_each_groups_members_at_once():
+                batch_client = Client()
+                batch_client.modify = MagicMock(return_value=True)
+
+                failures = GroupApi(batch_client).add_users(
+                    [('ops', 'cn=ops,dc=test', ['a', 'b'])], workers=1)
+
+                assert failures == []
+                batch_client.modify.assert_called_once_with(
+                    'cn=ops,dc=test',
+                    {'memberUid': [(ldap3.MODIFY_ADD, ['a', 'b'])]})
+
     def describe_removes_user():
         def describe_commandline():
             def it_calls_the_api(mocker):  # noqa: F811
@@ -190,7 +352,8 @@ def describe_group():  # TODO: change this to use test_key.py format
 
                 runner.invoke(GroupCli.group, ['index'])
 
-                ldap_tools.group.API.index.assert_called_once_with()
+                ldap_tools.group.API.index.assert_called_once_with(
+                    None, None, 0, None)
 
         def describe_api():
             def it_calls_the_client():
@@ -201,7 +364,7 @@ def describe_group():  # TODO: change this to use test_key.py format
                 group_api = GroupApi(client)
 
                 group_api.index()
-                client.search.assert_called_once_with(group_objectclass)
+                client.search.assert_called_once_with(group_objectclass, None)
 
     def describe_lookup_id():
         def describe_commandline():
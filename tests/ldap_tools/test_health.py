@@ -0,0 +1,84 @@
+import ldap3
+import pytest
+from pytest_mock import mocker  # noqa: F401
+
+from ldap_tools.health import ServerHealth
+from ldap_tools.health import backoff
+
+SOCKET_ERROR = ldap3.core.exceptions.LDAPSocketReceiveError('timed out')
+
+
+def describe_health():
+    def describe_backoff():
+        def it_grows_exponentially_up_to_a_cap(mocker):  # noqa: F811
+            mocker.patch('random.uniform', side_effect=lambda low, high: high)
+
+            assert [backoff(i) for i in [1, 2, 3]] == [0.2, 0.4, 0.8]
+            assert backoff(10) == 5
+
+    def describe_server_health():
+        def it_demotes_servers_that_keep_failing(mocker):  # noqa: F811
+            clock = mocker.patch('time.monotonic', return_value=100.0)
+            health = ServerHealth(threshold=2, cooldown=10)
+
+            health.failed('ldap1')
+            assert not health.demoted('ldap1')
+            health.failed('ldap1')
+            assert health.demoted('ldap1')
+            assert health.order(['ldap1', 'ldap2']) == ['ldap2', 'ldap1']
+
+            clock.return_value = 110.0
+            assert not health.demoted('ldap1')
+            health.failed('ldap1')  # cooldown doubles
+            clock.return_value = 129.0
+            assert health.demoted('ldap1')
+
+        def it_restores_servers_that_succeed():
+            health = ServerHealth(threshold=1)
+
+            health.failed('ldap1')
+            health.succeeded('ldap1')
+
+            assert not health.demoted('ldap1')
+            assert health.stats() == {}
+
+    def describe_failover():
+        def it_retries_reads_on_another_server(servers):
+            client, connections = servers
+            connections['ldap1'].search.side_effect = SOCKET_ERROR
+
+            assert client.search(['(uid=test.user)']) == []
+            connections['ldap2'].search.assert_called_once()
+            assert client.health.stats()['ldap1']['failures'] == 1
+
+        def it_retries_busy_servers(servers):
+            client, connections = servers
+            client.replicas = []
+            results = iter([{'result': 51}, {'result': 0}])
+
+            def _search(**kwargs):
+                connections['ldap1'].result = next(results)
+
+            connections['ldap1'].search.side_effect = _search
+
+            client.search(['(uid=test.user)'])
+
+            assert client.result == {'result': 0}
+            assert connections['ldap1'].search.call_count == 2
+
+        def it_does_not_retry_writes(servers):
+            client, connections = servers
+            connections['ldap1'].modify.side_effect = SOCKET_ERROR
+
+            with pytest.raises(ldap3.core.exceptions.LDAPSocketReceiveError):
+                client.modify('uid=test.user,dc=test,dc=org', {})
+            assert 'ldap2' not in connections
+
+        def it_sets_a_timeout_per_operation_type(servers):
+            client, connections = servers
+            client.timeouts['scan'] = 600
+            connections['ldap1'].extend.standard.paged_search.return_value = []
+
+            list(client.stream(['(uid=test.user)']))
+
+            connections['ldap1'].socket.settimeout.assert_called_with(600)
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+import ldap_tools.exceptions
+from ldap_tools.history import History
+from ldap_tools.history import parse_time
+
+
+def describe_history():
+    def describe_parse_time():
+        def it_treats_a_date_as_the_end_of_the_day():
+            assert parse_time('2018-03-03') == '2018-03-03T23:59:59Z'
+
+        def it_accepts_a_date_and_time():
+            assert parse_time('2018-03-03T10:00:00') == '2018-03-03T10:00:00Z'
+
+        def it_pads_dates_and_times():
+            assert (parse_time('2018-3-3'), parse_time('2018-03-03T1:2:3')) == (
+                '2018-03-03T23:59:59Z', '2018-03-03T01:02:03Z')
+
+        def it_raises_error_on_bad_dates():
+            with pytest.raises(ldap_tools.exceptions.ArgumentError):
+                parse_time('March 3rd')
+
+    def describe_snapshots():
+        def it_rebuilds_membership_at_a_point_in_time(tmpdir):
+            history = History(str(tmpdir))
+            history.snapshot({'admins': ['a.user']}, '2018-03-01T00:00:00Z')
+            history.snapshot({
+                'admins': ['a.user', 'b.user'],
+                'sales': ['c.user']
+            }, '2018-03-02T00:00:00Z')
+            history.snapshot({'sales': ['c.user']}, '2018-03-04T00:00:00Z')
+
+            assert history.at('2018-02-28T23:59:59Z') is None
+            assert history.at('2018-03-01T23:59:59Z') == {'admins': ['a.user']}
+            assert history.at('2018-03-03T23:59:59Z') == {
+                'admins': ['a.user', 'b.user'],
+                'sales': ['c.user']
+            }
+            assert history.at('2018-03-05T23:59:59Z') == {'sales': ['c.user']}
+
+        def it_stores_deltas_after_the_base(tmpdir):
+            history = History(str(tmpdir))
+            history.snapshot({'admins': ['a.user']}, '2018-03-01T00:00:00Z')
+            history.snapshot({'admins': ['b.user']}, '2018-03-02T00:00:00Z')
+
+            assert len(os.listdir(str(tmpdir))) == 1
+
+        def it_skips_unchanged_membership(tmpdir):
+            history = History(str(tmpdir))
+
+            assert history.snapshot({'admins': ['a.user']},
+                                    '2018-03-01T00:00:00Z')
+            assert not history.snapshot({'admins': ['a.user']},
+                                        '2018-03-02T00:00:00Z')
+
+        def it_starts_a_new_base_periodically(tmpdir):
+            history = History(str(tmpdir), rebase_every=2)
+            for day in range(1, 6):
+                history.snapshot({
+                    'admins': ['user{}'.format(day)]
+                }, '2018-03-0{}T00:00:00Z'.format(day))
+
+            assert len(os.listdir(str(tmpdir))) == 2
+            assert history.at('2018-03-02T00:00:00Z') == {'admins': ['user2']}
+            assert history.at('2018-03-05T00:00:00Z') == {'admins': ['user5']}
+
+        def it_raises_error_on_out_of_order_snapshots(tmpdir):
+            history = History(str(tmpdir))
+            history.snapshot({'admins': ['a.user']}, '2018-03-02T00:00:00Z')
+
+            with pytest.raises(ldap_tools.exceptions.ArgumentError):
+                history.snapshot({}, '2018-03-01T00:00:00Z')
+
+    def describe_changes():
+        def it_reports_net_changes(tmpdir):
+            history = History(str(tmpdir))
+            history.snapshot({
+                'admins': ['a.user'],
+                'sales': ['c.user']
+            }, '2018-03-01T00:00:00Z')
+            history.snapshot({'admins': ['b.user']}, '2018-03-02T00:00:00Z')
+            history.snapshot({'admins': ['b.user', 'd.user']},
+                             '2018-03-03T00:00:00Z')
+
+            assert history.changes('2018-03-01T23:59:59Z',
+                                   '2018-03-03T23:59:59Z') == {
+                                       'admins': {
+                                           'added': ['b.user', 'd.user'],
+                                           'removed': ['a.user']
+                                       },
+                                       'sales': {
+                                           'added': [],
+                                           'removed': ['c.user']
+                                       }
+                                   }
@@ -1,3 +1,4 @@
+import hashlib
 from os import path
 from unittest import mock
 from unittest.mock import MagicMock
@@ -8,10 +9,12 @@ import sshpubkeys
 from click.testing import CliRunner
 from pytest_mock import mocker  # noqa: F401
 
+import ldap_tools.exceptions
 import ldap_tools.key
 from ldap_tools.client import Client
 from ldap_tools.key import API as KeyApi
 from ldap_tools.key import CLI as KeyCli
+from ldap_tools.key import fingerprint
 from ldap_tools.user import API as UserApi
 
 
@@ -144,3 +147,365 @@ def describe_key():
 
                 client.search.assert_called_once_with(filter,
                                                       ['uid', 'sshPublicKey'])
+
+    def describe_fingerprints():
+        with open(path.join(fixture_path, 'two_key_user'), 'r') as FILE:
+            first, second = FILE.read().splitlines()
+        with open(path.join(fixture_path, 'weak_user_key'), 'r') as FILE:
+            weak = FILE.read().strip()
+
+        def _key_client(keys):
+            client = Client()
+            client.stream = MagicMock(return_value=[{
+                'raw_attributes': {
+                    'uid': [username.encode()],
+                    'sshPublicKey': [key.encode() for key in user_keys]
+                }
+            } for username, user_keys in keys.items()])
+            return client
+
+        def it_fingerprints_a_key():
+            info = fingerprint(first)
+
+            assert info.sha256.startswith('SHA256:')
+            assert (info.type, info.bits, info.error) == ('ssh-rsa', 2048,
+                                                          None)
+
+        def it_reports_parse_errors():
+            assert fingerprint('ssh-rsa AAAAbroken').error is not None
+
+        def it_ignores_comments_when_memoizing():
+            key_api = KeyApi(Client())
+            infos = key_api.fingerprints(
+                [first, first + ' other@host'], workers=1)
+
+            assert len(set(infos.values())) == 1
+
+        def it_finds_users_by_fingerprint():
+            key_api = KeyApi(
+                _key_client({
+                    'test.user': [first, second],
+                    'other.user': [first + ' copy']
+                }))
+
+            matches = key_api.who_has(fingerprint(first).sha256, workers=1)
+
+            assert [users for _, users in matches.values()] == [[
+                'other.user', 'test.user'
+            ]]
+            assert key_api.who_has(fingerprint(second).md5, workers=1) != {}
+
+        def it_finds_users_by_key_file():
+            key_api = KeyApi(_key_client({'test.user': [first, second]}))
+
+            matches = key_api.who_has(
+                path.join(fixture_path, 'single_key_user'), workers=1)
+
+            assert len(matches) == 1
+
+        def it_audits_shared_weak_and_invalid_keys():
+            key_api = KeyApi(
+                _key_client({
+                    'test.user': [first, weak],
+                    'other.user': [first, 'ssh-rsa AAAAbroken']
+                }))
+
+            report = key_api.audit(workers=1)
+
+            assert [users for _, _, users in report['duplicate']] == [[
+                'other.user', 'test.user'
+            ]]
+            assert [(info.bits, users) for _, info, users in report['weak']
+                    ] == [(1024, ['test.user'])]
+            assert [username for username, _, _ in report['invalid']
+                    ] == ['other.user']
+
+    def describe_install():
+        def _result(**attributes):
+            result = MagicMock()
+            for name, value in attributes.items():
+                getattr(result, name).value = value
+                getattr(result, name).values = value
+            return result
+
+        def it_resolves_members_with_one_search():
+            client = Client()
+            client.search = MagicMock(return_value=[
+                _result(cn='admins', memberUid=['a.user', 'b.user']),
+                _result(cn='ops', memberUid=['b.user', 'c.user'])
+            ])
+
+            members = KeyApi(client).group_members(['admins', 'ops'])
+
+            assert members == {'a.user', 'b.user', 'c.user'}
+            client.search.assert_called_once_with(
+                ['(objectclass=posixGroup)', '(|(cn=admins)(cn=ops))'],
+                ['cn', 'memberUid'])
+
+        def it_matches_group_names_case_insensitively():
+            client = Client()
+            client.search = MagicMock(return_value=[
+                _result(cn='developers', memberUid=['a.user'])
+            ])
+
+            assert KeyApi(client).group_members(['Developers']) == {'a.user'}
+
+        def it_raises_error_on_missing_groups():
+            client = Client()
+            client.search = MagicMock(return_value=[
+                _result(cn='admins', memberUid=[])
+            ])
+
+            with pytest.raises(ldap_tools.exceptions.NoGroupsFound):
+                KeyApi(client).group_members(['admins', 'nogroup'])
+
+        def it_fetches_keys_in_batches():
+            client = Client()
+            client.search = MagicMock(return_value=[])
+
+            KeyApi(client).get_keys_for_users(['c', 'a', 'b'], batch_size=2)
+
+            assert [call[0][0] for call in client.search.call_args_list] == [
+                ['(sshPublicKey=*)', '(|(uid=a)(uid=b))'],
+                ['(sshPublicKey=*)', '(|(uid=c))'],
+            ]
+
+        def it_only_writes_changed_files(mocker, tmpdir):  # noqa: F811
+            mocker.patch.object(
+                KeyApi,
+                '_API__authorized_keys_path',
+                side_effect=lambda user: str(tmpdir.join(user)))
+            key_api = KeyApi(Client())
+            key_api.get_keys_for_users = MagicMock(
+                return_value={'a.user': [b'ssh-rsa AAAA a']})
+            key_api.group_members = MagicMock(return_value={'a.user'})
+
+            assert key_api.install(['admins']) == ['a.user']
+            assert key_api.install(['admins']) == []
+            assert tmpdir.join('a.user', 'authorized_keys').read() == (
+                'ssh-rsa AAAA a\n')
+
+        def it_removes_keys_of_users_who_left(mocker, tmpdir):  # noqa: F811
+            mocker.patch.object(
+                KeyApi,
+                '_API__authorized_keys_path',
+                side_effect=lambda user: str(tmpdir.join(user)))
+            tmpdir.join('b.user', 'authorized_keys').write(
+                'ssh-rsa AAAA b\n', ensure=True)
+            key_api = KeyApi(Client())
+            key_api.get_keys_for_users = MagicMock(
+                return_value={'a.user': [b'ssh-rsa AAAA a']})
+            key_api.group_members = MagicMock(return_value={'a.user'})
+
+            assert key_api.install(['admins']) == ['a.user', 'b.user']
+            assert not tmpdir.join('b.user', 'authorized_keys').exists()
+
+        def it_revokes_members_who_leave(mocker, tmpdir):  # noqa: F811
+            mocker.patch.object(
+                KeyApi,
+                '_API__authorized_keys_path',
+                side_effect=lambda user: str(tmpdir.join(user)))
+            tmpdir.join('b.user', 'authorized_keys').write(
+                'ssh-rsa AAAA b\n', ensure=True)
+            client = Client()
+            client.watch = MagicMock(return_value=iter([
+                ('modify', 'cn=admins', {
+                    'objectClass': [b'posixGroup'],
+                    'cn': [b'admins'],
+                    'memberUid': [b'a.user']
+                }),
+            ]))
+            key_api = KeyApi(client)
+            key_api.install = MagicMock()
+            key_api.group_members = MagicMock(
+                side_effect=[{'a.user', 'b.user'}, {'a.user'}])
+
+            assert list(key_api.watch(['admins'])) == [('delete', 'b.user'),
+                                                       ('modify', None)]
+            assert not tmpdir.join('b.user', 'authorized_keys').exists()
+            assert key_api.install.call_count == 2
+
+        def it_applies_watched_changes(mocker, tmpdir):  # noqa: F811
+            mocker.patch.object(
+                KeyApi,
+                '_API__authorized_keys_path',
+                side_effect=lambda user: str(tmpdir.join(user)))
+            client = Client()
+            client.watch = MagicMock(return_value=iter([
+                ('modify', 'uid=a.user', {
+                    'objectClass': [b'posixAccount'],
+                    'uid': [b'a.user'],
+                    'sshPublicKey': [b'ssh-rsa AAAA new']
+                }),
+                ('modify', 'uid=b.user', {
+                    'objectClass': [b'posixAccount'],
+                    'uid': [b'b.user']
+                }),
+                ('delete', 'uid=a.user', {
+                    'objectClass': [b'posixAccount'],
+                    'uid': [b'a.user']
+                }),
+            ]))
+            key_api = KeyApi(client)
+            key_api.install = MagicMock()
+            key_api.group_members = MagicMock(return_value={'a.user'})
+            changes = key_api.watch(['admins'])
+
+            assert next(changes) == ('modify', 'a.user')
+            assert tmpdir.join('a.user', 'authorized_keys').read() == (
+                'ssh-rsa AAAA new\n')
+            assert next(changes) == ('delete', 'a.user')  # b.user skipped
+            assert not tmpdir.join('a.user', 'authorized_keys').exists()
+            key_api.install.assert_called_once_with(['admins'])
+
+    def describe_rotate():
+        with open(path.join(fixture_path, 'two_key_user'), 'r') as FILE:
+            first, second = FILE.read().splitlines()
+
+        def _user(uid, keys):
+            result = MagicMock(entry_dn='uid={},ou=People,dc=test,dc=org'.format(
+                uid))
+            result.uid.value = uid
+            result.sshPublicKey.values = [k.encode() for k in keys]
+            return result
+
+        def it_loads_a_manifest(tmpdir):
+            manifest = tmpdir.join('keys.yaml')
+            manifest.write('a.user: [k1, k1, k2]\nb.user: k3\nc.user: []\n')
+
+            assert KeyApi.load_manifest(str(manifest)) == {
+                'a.user': ['k1', 'k2'],
+                'b.user': ['k3'],
+                'c.user': []
+            }
+
+        def it_rejects_manifest_keys_that_are_not_strings(tmpdir):
+            manifest = tmpdir.join('keys.yaml')
+            manifest.write('a.user: [k1, 42]\n')
+
+            with pytest.raises(ldap_tools.exceptions.ArgumentError):
+                KeyApi.load_manifest(str(manifest))
+
+        def it_finds_users_case_insensitively():
+            client = Client()
+            client.search = MagicMock(return_value=[_user('a.user', [first])])
+
+            rotations, missing, invalid = KeyApi(client).rotation_plan(
+                {'A.User': [second]}, workers=1)
+
+            assert [i.username for i in rotations] == ['A.User']
+            assert missing == []
+
+        def it_plans_only_changed_users():
+            client = Client()
+            client.search = MagicMock(return_value=[
+                _user('a.user', [first]),
+                _user('b.user', [first, second])
+            ])
+
+            rotations, missing, invalid = KeyApi(client).rotation_plan({
+                'a.user': [second],
+                'b.user': [second, first],
+                'c.user': []
+            }, workers=1)
+
+            assert rotations == [
+                ldap_tools.key.Rotation('a.user',
+                                        'uid=a.user,ou=People,dc=test,dc=org',
+                                        [second], [second], [first])
+            ]
+            assert (missing, invalid) == (['c.user'], [])
+            client.search.assert_called_once_with([
+                '(objectclass=posixAccount)',
+                '(|(uid=a.user)(uid=b.user)(uid=c.user))'
+            ], ['uid', 'sshPublicKey'])
+
+        def it_resumes_users_whose_keys_changed(mocker, tmpdir):  # noqa: F811
+            mocker.patch(
+                'ldap_tools.client.Client.prepare_connection',
+                return_value=None)
+            mocker.patch(
+                'ldap_tools.key.API.rotation_plan',
+                return_value=([
+                    ldap_tools.key.Rotation('a.user', 'uid=a.user', [second],
+                                            [second], [first])
+                ], [], []))
+            mocker.patch('ldap_tools.client.Client.modify', return_value=True)
+            manifest = tmpdir.join('keys.yaml')
+            manifest.write('a.user: [{}]\n'.format(second))
+            previous = hashlib.sha1(first.encode()).hexdigest()
+            tmpdir.join('keys.yaml.journal').write(
+                'a.user {}\n'.format(previous))
+
+            result = CliRunner().invoke(KeyCli.key, [
+                'rotate', '-m', str(manifest), '-w', '1', '--resume'
+            ])
+
+            assert result.exit_code == 0
+            ldap_tools.client.Client.modify.assert_called_once_with(
+                'uid=a.user',
+                {'sshPublicKey': [(ldap3.MODIFY_REPLACE, [second])]})
+
+        def it_replaces_keys_with_one_modify_per_user():
+            client = Client()
+            client.modify = MagicMock(return_value=True)
+            progress = MagicMock()
+            rotation = ldap_tools.key.Rotation('a.user', 'uid=a.user',
+                                               [second], [second], [first])
+
+            failures = KeyApi(client).rotate([rotation], 1, progress)
+
+            assert failures == []
+            client.modify.assert_called_once_with(
+                'uid=a.user',
+                {'sshPublicKey': [(ldap3.MODIFY_REPLACE, [second])]})
+            progress.assert_called_once_with(1)
+
+    def describe_ensure():
+        with open(path.join(fixture_path, 'two_key_user'), 'r') as FILE:
+            first, second = FILE.read().splitlines()
+
+        def _user(uid, keys):
+            result = MagicMock(entry_dn='uid={},dc=test,dc=org'.format(uid))
+            result.uid.value = uid
+            result.sshPublicKey.values = [k.encode() for k in keys]
+            return result
+
+        def it_adds_only_missing_keys_with_one_modify_per_user():
+            client = Client()
+            client.search = MagicMock(return_value=[
+                _user('a.user', [first]),
+                _user('b.user', [first, second])
+            ])
+            client.modify = MagicMock(return_value=True)
+            renamed = ' '.join(first.split()[:2] + ['laptop'])
+
+            added, missing = KeyApi(client).ensure({
+                'a.user': [renamed, second],
+                'b.user': [second],
+                'c.user': [first]
+            })
+
+            assert (added, missing) == ([('a.user', [second])], ['c.user'])
+            client.modify.assert_called_once_with(
+                'uid=a.user,dc=test,dc=org',
+                {'sshPublicKey': [(ldap3.MODIFY_ADD, [second])]})
+
+        def it_matches_usernames_case_insensitively():
+            client = Client()
+            client.search = MagicMock(return_value=[_user('a.user', [])])
+            client.modify = MagicMock(return_value=True)
+
+            added, missing = KeyApi(client).ensure({'A.User': [second]})
+
+            assert (added, missing) == ([('A.User', [second])], [])
+
+        def it_rejects_invalid_keys_before_writing():
+            client = Client()
+            client.search = MagicMock(return_value=[_user('a.user', [])])
+            client.modify = MagicMock()
+
+            with pytest.raises(ldap_tools.exceptions.ArgumentError):
+                KeyApi(client).ensure({'a.user': [second, 'ssh-rsa bogus']})
+
+            client.modify.assert_not_called()
@@ -0,0 +1,154 @@
+import io
+from unittest.mock import MagicMock
+
+import ldap3
+import pytest
+
+from ldap_tools.client import Client
+from ldap_tools.ldif import API as LdifApi
+from ldap_tools.ldif import read_entries
+from ldap_tools.ldif import write_entry
+
+LDIF = b"""version: 1
+
+# People
+dn: ou=People,dc=test,dc=org
+objectClass: organizationalUnit
+ou: People
+
+dn: uid=test.user,ou=People,dc=test,dc=org
+objectClass: posixAccount
+objectClass: inetOrgPerson
+cn: Test
+  User
+description:: IGxlYWRpbmcgc3BhY2U=
+"""
+
+
+def describe_ldif():
+    def describe_read_entries():
+        def it_parses_records_with_offsets():
+            records = list(read_entries(io.BytesIO(LDIF)))
+
+            assert [(offset, dn) for offset, dn, _ in records] == [
+                (LDIF.index(b'dn: ou'), 'ou=People,dc=test,dc=org'),
+                (LDIF.index(b'dn: uid'),
+                 'uid=test.user,ou=People,dc=test,dc=org'),
+            ]
+
+        def it_unfolds_and_decodes_values():
+            _, _, attributes = list(read_entries(io.BytesIO(LDIF)))[1]
+
+            assert attributes['objectClass'] == [
+                b'posixAccount', b'inetOrgPerson'
+            ]
+            assert attributes['cn'] == [b'Test User']
+            assert attributes['description'] == [b' leading space']
+
+        def it_skips_folded_comments():
+            ldif = (b'# a comment\n  continued\ndn: cn=a,dc=test,dc=org\n'
+                    b'# another\n  continued\ncn: a\n')
+
+            (record, ) = list(read_entries(io.BytesIO(ldif)))
+
+            assert record[1:] == ('cn=a,dc=test,dc=org', {'cn': [b'a']})
+
+        def it_rejects_change_records():
+            ldif = b'dn: cn=a,dc=test,dc=org\nchangetype: delete\n'
+
+            with pytest.raises(ldap3.core.exceptions.LDAPLDIFError):
+                list(read_entries(io.BytesIO(ldif)))
+
+    def describe_write_entry():
+        def it_round_trips_unsafe_values():
+            FILE = io.BytesIO()
+            write_entry(FILE, 'cn=a,dc=test,dc=org', {
+                'cn': [b'a'],
+                'description': ['café', ':colon'],
+                'gidNumber': 10000
+            })
+
+            assert b'description:: ' in FILE.getvalue()
+            FILE.seek(0)
+            [(_, dn, attributes)] = list(read_entries(FILE))
+            assert dn == 'cn=a,dc=test,dc=org'
+            assert attributes == {
+                'cn': [b'a'],
+                'description': ['café'.encode(), b':colon'],
+                'gidNumber': [b'10000']
+            }
+
+    def describe_api():
+        def it_dumps_streamed_entries():
+            client = Client()
+            client.stream = MagicMock(return_value=iter([{
+                'dn': 'cn=a,dc=test,dc=org',
+                'raw_attributes': {
+                    'cn': [b'a']
+                }
+            }]))
+            FILE = io.BytesIO()
+
+            assert LdifApi(client).dump(FILE) == 1
+            assert FILE.getvalue() == (
+                b'version: 1\n\ndn: cn=a,dc=test,dc=org\ncn: a\n\n')
+
+        def it_loads_entries_and_checkpoints():
+            client = Client()
+            client.add = MagicMock(return_value=True)
+            checkpoint = MagicMock()
+
+            failures = LdifApi(client).load(
+                io.BytesIO(LDIF), workers=1, checkpoint=checkpoint,
+                checkpoint_every=1)
+
+            assert failures == []
+            client.add.assert_any_call('ou=People,dc=test,dc=org',
+                                       ['organizationalUnit'],
+                                       {'ou': [b'People']})
+            assert [i[0][0] for i in checkpoint.call_args_list] == [1, 2]
+
+        def it_skips_checkpointed_records():
+            client = Client()
+            client.add = MagicMock(return_value=True)
+
+            LdifApi(client).load(io.BytesIO(LDIF), workers=1, skip=1)
+
+            client.add.assert_called_once()
+            assert client.add.call_args[0][0] == (
+                'uid=test.user,ou=People,dc=test,dc=org')
+
+        def it_adds_parents_before_children():
+            client = Client()
+            added = []
+            spawned = MagicMock()
+            spawned.add = MagicMock(
+                side_effect=lambda dn, *args: added.append(dn))
+            client.spawn = MagicMock(return_value=spawned)
+
+            failures = LdifApi(client).load(io.BytesIO(LDIF), workers=2)
+
+            assert failures == []
+            assert added == [
+                'ou=People,dc=test,dc=org',
+                'uid=test.user,ou=People,dc=test,dc=org'
+            ]
+
+        def it_stops_checkpointing_at_failures():
+            client = Client()
+            client.conn = MagicMock()
+            client.conn.result = {
+                'result': 32,
+                'description': 'noSuchObject',
+                'dn': '',
+                'message': '',
+                'type': 'addResponse'
+            }
+            client.add = MagicMock(side_effect=[False, True])
+            checkpoint = MagicMock()
+
+            failures = LdifApi(client).load(
+                io.BytesIO(LDIF), workers=1, checkpoint=checkpoint)
+
+            assert [dn for dn, _ in failures] == ['ou=People,dc=test,dc=org']
+            checkpoint.assert_not_called()
@@ -0,0 +1,37 @@
+from ldap_tools.loadtest import API
+from ldap_tools.loadtest import StandIn
+from ldap_tools.loadtest import percentile
+
+
+def describe_loadtest():
+    def describe_percentile():
+        def it_uses_nearest_rank():
+            values = list(range(1, 101))
+
+            assert (percentile(values, 50), percentile(values, 99)) == (50,
+                                                                        99)
+
+        def it_returns_none_without_values():
+            assert percentile([], 50) is None
+
+    def describe_run():
+        def _run(scenario, workers=4, operations=8):
+            return API(StandIn(latency=0, users=4), workers).run(
+                scenario, operations)
+
+        def it_creates_users():
+            result = _run('create', workers=1)
+
+            assert (len(result.latencies), result.errors,
+                    result.collisions) == (8, {}, 0)
+
+        def it_adds_group_members():
+            result = _run('membership')
+
+            assert (len(result.latencies), result.errors,
+                    result.collisions) == (8, {}, None)
+
+        def it_looks_up_keys():
+            result = _run('keys')
+
+            assert (len(result.latencies), result.errors) == (8, {})
@@ -0,0 +1,110 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+import ldap_tools
+from ldap_tools.client import Client
+from ldap_tools.nss import API as NssApi
+from ldap_tools.nss import build_index
+from ldap_tools.nss import write_atomic
+
+
+def _response(**attributes):
+    return {
+        'raw_attributes': {
+            name: [v.encode() for v in values]
+            for name, values in attributes.items()
+        }
+    }
+
+
+def describe_nss():
+    client = Client()
+    client.stream = MagicMock(return_value=[
+        _response(
+            objectClass=['posixAccount'],
+            uid=['test.user'],
+            uidNumber=['10001'],
+            gidNumber=['10000'],
+            cn=['Test User'],
+            homeDirectory=['/home/test.user'],
+            loginShell=['/bin/bash']),
+        _response(
+            objectClass=['posixAccount'],
+            uid=['a.user'],
+            uidNumber=['10000'],
+            gidNumber=['10000'],
+            homeDirectory=['/home/a.user']),
+        _response(
+            objectClass=['posixAccount'], uid=['broken'], uidNumber=['1']),
+        _response(
+            objectClass=['posixGroup'],
+            cn=['users'],
+            gidNumber=['10000'],
+            memberUid=['test.user', 'a.user']),
+    ])
+
+    def describe_maps():
+        def it_builds_maps_from_one_search():
+            client.stream.reset_mock()
+
+            maps = NssApi(client).maps()
+
+            assert maps == {
+                'passwd': [
+                    'a.user:x:10000:10000::/home/a.user:',
+                    'test.user:x:10001:10000:Test User:/home/test.user:'
+                    '/bin/bash',
+                ],
+                'group': ['users:x:10000:a.user,test.user']
+            }
+            client.stream.assert_called_once()
+
+    def describe_export():
+        def it_writes_only_changed_files(tmpdir):
+            nss_api = NssApi(client)
+
+            written = nss_api.export(str(tmpdir), index=True)
+
+            assert sorted(i.rsplit('/', 1)[1] for i in written) == [
+                'group.cache', 'group.cache.ixgid', 'group.cache.ixname',
+                'passwd.cache', 'passwd.cache.ixname', 'passwd.cache.ixuid'
+            ]
+            assert nss_api.export(str(tmpdir), index=True) == []
+
+        def it_refuses_to_write_empty_maps(tmpdir):
+            empty_client = Client()
+            empty_client.stream = MagicMock(return_value=[])
+
+            with pytest.raises(ldap_tools.exceptions.InvalidResult):
+                NssApi(empty_client).export(str(tmpdir))
+
+            assert tmpdir.listdir() == []
+
+        def it_refuses_to_shrink_maps_unless_forced(tmpdir):
+            tmpdir.join('passwd.cache').write('a\nb\nc\n')
+            nss_api = NssApi(client)
+
+            with pytest.raises(ldap_tools.exceptions.InvalidResult):
+                nss_api.export(str(tmpdir))
+
+            assert len(nss_api.export(str(tmpdir), max_shrink=0.5)) == 2
+            tmpdir.join('passwd.cache').write('a\nb\nc\n')
+            assert len(nss_api.export(str(tmpdir), force=True)) == 1
+
+    def describe_build_index():
+        def it_indexes_fixed_width_lines():
+            lines = ['bb:x:2', 'a:x:10']
+
+            assert build_index(lines, 0) == b'a\x00\x0007\nbb\x0000\n'
+            assert build_index(lines, 2) == b'10\x0007\n2\x00\x0000\n'
+
+    def describe_write_atomic():
+        def it_replaces_files(tmpdir):
+            filename = str(tmpdir.join('passwd'))
+
+            assert write_atomic(filename, b'a\n')
+            assert not write_atomic(filename, b'a\n')
+            assert write_atomic(filename, b'b\n')
+            assert tmpdir.join('passwd').read() == 'b\n'
+            assert tmpdir.listdir() == [tmpdir.join('passwd')]
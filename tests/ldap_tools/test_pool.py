@@ -0,0 +1,124 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import mocker  # noqa: F401
+
+from ldap_tools.client import Client
+from ldap_tools.exceptions import PoolTimeout
+from ldap_tools.pool import ConnectionPool
+
+
+def _factory():
+    return MagicMock(side_effect=lambda: MagicMock(closed=False))
+
+
+def describe_pool():
+    def describe_connection():
+        def it_reuses_idle_connections():
+            factory = _factory()
+            pool = ConnectionPool(factory, size=2)
+
+            with pool.connection() as first:
+                pass
+            with pool.connection() as second:
+                pass
+
+            assert first is second
+            assert factory.call_count == 1
+            assert pool.stats() == {'open': 1, 'idle': 1, 'size': 2}
+
+        def it_bounds_open_connections():
+            pool = ConnectionPool(_factory(), size=1)
+
+            with pool.connection():
+                with pytest.raises(PoolTimeout):
+                    with pool.connection(timeout=0.01):
+                        pass
+
+        def it_wakes_waiting_threads():
+            pool = ConnectionPool(_factory(), size=1)
+            acquired = []
+
+            def _worker():
+                with pool.connection(timeout=5) as conn:
+                    acquired.append(conn)
+
+            with pool.connection() as conn:
+                thread = threading.Thread(target=_worker)
+                thread.start()
+            thread.join()
+
+            assert acquired == [conn]
+
+        def it_discards_connections_that_failed():
+            factory = _factory()
+            pool = ConnectionPool(factory)
+
+            with pytest.raises(OSError):
+                with pool.connection() as conn:
+                    raise OSError('connection reset')
+
+            conn.unbind.assert_called_once_with()
+            assert pool.stats()['open'] == 0
+
+        def it_replaces_expired_connections(mocker):  # noqa: F811
+            factory = _factory()
+            pool = ConnectionPool(factory, idle_timeout=10, max_lifetime=100)
+            clock = mocker.patch('time.monotonic', return_value=0.0)
+
+            with pool.connection() as first:
+                pass
+            clock.return_value = 11.0
+            with pool.connection() as second:
+                pass
+
+            assert first is not second
+            first.unbind.assert_called_once_with()
+            assert pool.stats()['open'] == 1
+
+    def describe_close():
+        def it_closes_connections_when_returned():
+            pool = ConnectionPool(_factory())
+
+            with pool.connection() as busy:
+                with pool.connection() as idle:
+                    pass
+                pool.close()
+                idle.unbind.assert_called_once_with()
+                busy.unbind.assert_not_called()
+            busy.unbind.assert_called_once_with()
+            assert pool.stats()['open'] == 0
+
+    def describe_pooled_client():
+        def _client():
+            client = Client()
+            client.basedn = 'dc=test,dc=org'
+            client.pool = ConnectionPool(_factory())
+            return client
+
+        def it_keeps_results_per_thread():
+            client = _client()
+            main = threading.current_thread()
+            with client.pool.connection() as conn:
+                conn.search.side_effect = lambda **kwargs: setattr(
+                    conn, 'result',
+                    {'result': 0 if threading.current_thread() is main else 32})
+            results = {}
+
+            def _search():
+                client.search(['(uid=test.user)'])
+                results['worker'] = client.result
+
+            client.search(['(uid=test.user)'])
+            thread = threading.Thread(target=_search)
+            thread.start()
+            thread.join()
+
+            assert results['worker'] == {'result': 32}
+            assert client.result == {'result': 0}
+
+        def it_spawns_itself():
+            client = _client()
+
+            assert client.spawn() is client
@@ -0,0 +1,116 @@
+from unittest.mock import MagicMock
+
+from ldap_tools import profile
+from ldap_tools.client import Client
+from ldap_tools.profile import Measurement
+from ldap_tools.profile import QueryProfiler
+from ldap_tools.profile import index_needs
+from ldap_tools.profile import parse_indexes
+from ldap_tools.profile import template
+
+
+def _measurement(seconds, entries=0, size=0):
+    measurement = Measurement()
+    measurement.seconds = seconds
+    measurement.entries = entries
+    measurement.size = size
+    return measurement
+
+
+def describe_profile():
+    def describe_template():
+        def it_replaces_values():
+            assert template(
+                '(&(objectclass=posixAccount)(uidNumber>=10000)(cn=Te*st))'
+            ) == '(&(objectclass=?)(uidnumber>=?)(cn=?*?))'
+
+        def it_keeps_presence_tests():
+            assert template('(&(objectclass=posixGroup)(memberUid=*))') == (
+                '(&(objectclass=?)(memberuid=*))')
+
+    def describe_index_needs():
+        def it_maps_tests_to_index_types():
+            assert index_needs(
+                '(&(memberUid=*)(uidNumber<=20)(cn=a*)(uid=a))') == {
+                    ('memberuid', 'pres'), ('uidnumber', 'eq'),
+                    ('cn', 'sub'), ('uid', 'eq')
+                }
+
+    def describe_parse_indexes():
+        def it_parses_index_directives():
+            assert parse_indexes(['objectClass eq', 'uid,cn eq,sub',
+                                  'entryUUID']) == {
+                'objectclass': {'eq'},
+                'uid': {'eq', 'sub'},
+                'cn': {'eq', 'sub'},
+                'entryuuid': {'eq'}
+            }
+
+    def describe_report():
+        def _profiler():
+            profiler = QueryProfiler(slow=0.1)
+            for uid in ['a', 'b']:
+                profiler.record(
+                    'search',
+                    '(&(objectclass=posixAccount)(uid={}))'.format(uid),
+                    _measurement(0.01, 1, 100))
+            profiler.record('search',
+                            '(&(objectclass=posixGroup)(memberuid=*))',
+                            _measurement(0.5, 300, 90000))
+            return profiler
+
+        def it_aggregates_by_template():
+            report = _profiler().report()
+
+            assert [(i['template'], i['count'], i['entries'])
+                    for i in report] == [
+                        ('(&(objectclass=?)(memberuid=*))', 1, 300),
+                        ('(&(objectclass=?)(uid=?))', 2, 2),
+                    ]
+            assert report[0]['flags'] == ['slow']
+
+        def it_flags_unindexed_patterns():
+            report = _profiler().report({'objectclass': {'eq'},
+                                         'uid': {'eq'}})
+
+            assert [i['flags'] for i in report] == [['slow', 'unindexed'],
+                                                    []]
+
+        def it_suggests_indexes():
+            assert _profiler().suggestions({'uid': {'eq'}}) == [
+                'index memberuid pres'
+            ]
+
+    def describe_client():
+        def it_records_searches():
+            client = Client()
+            client.conn = MagicMock()
+            client.basedn = 'dc=test,dc=org'
+            client.conn.entries = [
+                MagicMock(entry_dn='uid=a,dc=test,dc=org',
+                          entry_raw_attributes={'uid': [b'a']})
+            ]
+            profiler = profile.enable()
+            try:
+                client.search(['(uid=a)'], ['uid'])
+            finally:
+                profile.disable()
+
+            (stats, ) = profiler.report()
+            assert (stats['template'], stats['entries'],
+                    stats['bytes']) == ('(&(uid=?))', 1, 24)
+
+        def it_times_streamed_responses():
+            measurement = Measurement()
+
+            responses = list(measurement.iterate([{
+                'dn': 'cn=a',
+                'raw_attributes': {'cn': [b'a']},
+                'type': 'searchResEntry'
+            }, {
+                'uri': ['ldap://other'],
+                'type': 'searchResRef'
+            }]))
+
+            assert len(responses) == 2
+            assert (measurement.entries, measurement.size) == (1, 7)
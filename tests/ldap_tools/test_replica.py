@@ -0,0 +1,102 @@
+from unittest.mock import MagicMock
+
+from ldap_tools.client import Client
+from ldap_tools.diff import Difference
+from ldap_tools.replica import API as ReplicaApi
+from ldap_tools.replica import DigestTree
+
+PRIMARY = [
+    ('dc=test,dc=org', b'1'),
+    ('ou=People,dc=test,dc=org', b'2'),
+    ('uid=a.user,ou=People,dc=test,dc=org', b'3'),
+    ('uid=b.user,ou=People,dc=test,dc=org', b'4'),
+    ('ou=Group,dc=test,dc=org', b'5'),
+    ('cn=a,ou=Group,dc=test,dc=org', b'6'),
+]
+
+
+def describe_replica():
+    def describe_digest_tree():
+        def it_confirms_matching_trees_at_the_root():
+            tree = DigestTree(PRIMARY)
+
+            assert tree.compare(DigestTree(reversed(PRIMARY))) == ([], 6)
+
+        def it_descends_only_into_differing_branches():
+            replica = dict(PRIMARY)
+            replica['uid=b.user,ou=People,dc=test,dc=org'] = b'changed'
+
+            differences, confirmed = DigestTree(PRIMARY).compare(
+                DigestTree(replica.items()))
+
+            assert [(action, key[-1]) for action, key in differences] == [
+                ('modify', 'uid=b.user')
+            ]
+            assert confirmed == 3  # ou=Group, cn=a and uid=a.user
+
+        def it_reports_missing_subtrees():
+            replica = [i for i in PRIMARY if 'ou=Group' not in i[0]]
+            replica.append(('ou=Hosts,dc=test,dc=org', b'7'))
+
+            differences, _ = DigestTree(PRIMARY).compare(DigestTree(replica))
+
+            assert [(action, key[-1]) for action, key in differences] == [
+                ('delete', 'ou=group'),
+                ('delete', 'cn=a'),
+                ('add', 'ou=hosts'),
+            ]
+
+    def describe_check():
+        def it_fetches_full_entries_only_for_mismatches():
+            client = Client()
+            client.host = 'ldap1'
+            servers = {'ldap1': MagicMock(), 'ldap2': MagicMock()}
+            client.spawn = MagicMock(side_effect=lambda host: servers[host])
+            servers['ldap1'].stream = MagicMock(return_value=[{
+                'dn': 'uid=a.user,dc=test,dc=org',
+                'raw_attributes': {'entryCSN': [b'1']}
+            }, {
+                'dn': 'uid=b.user,dc=test,dc=org',
+                'raw_attributes': {'entryCSN': [b'1']}
+            }])
+            servers['ldap2'].stream = MagicMock(return_value=[{
+                'dn': 'uid=a.user,dc=test,dc=org',
+                'raw_attributes': {'entryCSN': [b'1']}
+            }, {
+                'dn': 'uid=b.user,dc=test,dc=org',
+                'raw_attributes': {'entryCSN': [b'2']}
+            }])
+            servers['ldap1'].read().entry_raw_attributes = {'mail': [b'old']}
+            servers['ldap2'].read().entry_raw_attributes = {'mail': [b'new']}
+            servers['ldap1'].read.reset_mock()
+
+            differences, errors = ReplicaApi(client).check(['ldap2'])
+
+            assert errors == {}
+            assert differences == {
+                'ldap2': [
+                    Difference('modify', 'uid=b.user,dc=test,dc=org',
+                               {'mail': ([b'old'], [b'new'])})
+                ]
+            }
+            servers['ldap1'].read.assert_called_once_with(
+                'uid=b.user,dc=test,dc=org')
+            servers['ldap2'].close.assert_called_once_with()
+
+        def it_reports_unreachable_replicas():
+            client = Client()
+            client.host = 'ldap1'
+            primary = MagicMock()
+            primary.stream = MagicMock(return_value=[])
+
+            def spawn(host):
+                if host == 'ldap2':
+                    raise OSError('unreachable')
+                return primary
+
+            client.spawn = MagicMock(side_effect=spawn)
+
+            differences, errors = ReplicaApi(client).check(['ldap2'])
+
+            assert differences == {}
+            assert list(errors) == ['ldap2']
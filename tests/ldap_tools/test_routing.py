@@ -0,0 +1,78 @@
+import pytest
+from pytest_mock import mocker  # noqa: F401
+
+from ldap_tools.routing import Router
+from ldap_tools.state import API as StateApi
+
+
+def describe_routing():
+    def describe_router():
+        def it_tries_unmeasured_replicas_first():
+            router = Router(['ldap2', 'ldap3'])
+
+            first = router.acquire()
+            router.release(first, 0.5)
+
+            assert router.acquire() != first
+
+        def it_prefers_fast_idle_replicas():
+            router = Router(['ldap2', 'ldap3'])
+            router.release(router.acquire(), 0.1)  # ldap2
+            router.release(router.acquire(), 0.3)  # ldap3
+
+            assert router.acquire() == 'ldap2'
+            assert router.acquire() == 'ldap2'  # 0.1 * 2 < 0.3
+            assert router.acquire() == 'ldap3'  # 0.1 * 3 == 0.3, fewer reads
+            assert router.stats()['ldap2']['busy'] == 2
+
+        def it_pins_reads_after_writes(mocker):  # noqa: F811
+            clock = mocker.patch('time.monotonic', return_value=100.0)
+            router = Router(['ldap2'], pin_window=5)
+
+            router.wrote()
+
+            assert router.acquire() is None
+            clock.return_value = 105.0
+            assert router.acquire() == 'ldap2'
+
+    def describe_routed_client():
+        @pytest.fixture
+        def routed(servers):
+            client, connections = servers
+            client.enable_routing(client.replicas)
+            return client, connections
+
+        def it_sends_reads_to_replicas(routed):
+            client, connections = routed
+            client.router.pin_window = 0
+
+            client.search(['(uid=test.user)'])
+            client.modify('uid=test.user,dc=test,dc=org', {})
+
+            connections['ldap2'].search.assert_called_once()
+            connections['ldap1'].search.assert_not_called()
+            connections['ldap1'].modify.assert_called_once()
+
+        def it_reads_its_own_writes(routed):
+            client, connections = routed
+
+            client.modify('uid=test.user,dc=test,dc=org', {})
+            client.search(['(uid=test.user)'])
+
+            connections['ldap1'].search.assert_called_once()
+            assert 'ldap2' not in connections
+
+        def it_allocates_ids_from_the_primary(routed):
+            client, connections = routed
+
+            client.get_max_id('user', 'user')
+
+            connections['ldap1'].search.assert_called_once()
+
+        def it_reads_state_from_the_primary(routed):
+            client, connections = routed
+
+            StateApi(client).current()
+
+            assert connections['ldap1'].search.call_count == 2
+            assert 'ldap2' not in connections
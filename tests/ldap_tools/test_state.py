@@ -0,0 +1,200 @@
+from unittest.mock import MagicMock
+
+import ldap3
+import pytest
+from click.testing import CliRunner
+from pytest_mock import mocker  # noqa: F401
+
+import ldap_tools.exceptions
+import ldap_tools.state
+from ldap_tools.client import Client
+from ldap_tools.state import API as StateApi
+from ldap_tools.state import CLI as StateCli
+from ldap_tools.state import Change
+
+
+def describe_state():
+    client = Client()
+    client.basedn = 'dc=test,dc=org'
+    current = {
+        'users': {
+            'test.user': {
+                'dn': 'uid=test.user,ou=People,dc=test,dc=org',
+                'id': 10004,
+                'keys': {'ssh-rsa AAAA old'}
+            }
+        },
+        'groups': {
+            'testgroup': {
+                'dn': 'cn=testgroup,ou=Group,dc=test,dc=org',
+                'id': 10001,
+                'members': {'test.user', 'old.user'}
+            }
+        }
+    }
+
+    def describe_commandline():
+        runner = CliRunner()
+
+        def it_plans_without_applying(mocker, tmpdir):  # noqa: F811
+            state_file = tmpdir.join('state.yaml')
+            state_file.write('groups:\n  newgroup: {}\n')
+            mocker.patch(
+                'ldap_tools.client.Client.prepare_connection',
+                return_value=None)
+            mocker.patch('ldap_tools.state.API.current', return_value=current)
+            mocker.patch('ldap_tools.state.API.apply', return_value=[])
+
+            result = runner.invoke(StateCli.apply,
+                                   [str(state_file), '--dry-run'])
+
+            assert '+ group newgroup (gid 10002)' in result.output
+            ldap_tools.state.API.apply.assert_not_called()
+
+        def it_applies_the_plan(mocker, tmpdir):  # noqa: F811
+            state_file = tmpdir.join('state.yaml')
+            state_file.write('groups:\n  newgroup: {}\n')
+            mocker.patch(
+                'ldap_tools.client.Client.prepare_connection',
+                return_value=None)
+            mocker.patch('ldap_tools.state.API.current', return_value=current)
+            mocker.patch('ldap_tools.state.API.apply', return_value=[])
+
+            runner.invoke(StateCli.apply, [str(state_file), '--force'])
+
+            ldap_tools.state.API.apply.assert_called_once_with(
+                [Change('create_group', 'newgroup', {
+                    'type': 'user',
+                    'gidnumber': 10002
+                })], 4)
+
+    def describe_load():
+        def it_rejects_mismatched_usernames(tmpdir):
+            state_file = tmpdir.join('state.yaml')
+            state_file.write(
+                'users:\n  jdoe:\n    name: [Jane, Doe]\n    group: g\n')
+
+            with pytest.raises(ldap_tools.exceptions.ArgumentError):
+                StateApi.load(str(state_file))
+
+        def it_loads_an_empty_file(tmpdir):
+            state_file = tmpdir.join('state.yaml')
+            state_file.write('')
+
+            assert StateApi.load(str(state_file)) == {
+                'users': {},
+                'groups': {}
+            }
+
+    def describe_plan():
+        state_api = StateApi(client)
+
+        def it_skips_resources_already_in_sync():
+            desired = {
+                'users': {
+                    'test.user': {
+                        'name': ['Test', 'User'],
+                        'group': 'testgroup',
+                        'keys': ['ssh-rsa AAAA old']
+                    }
+                },
+                'groups': {
+                    'testgroup': {
+                        'members': ['test.user', 'old.user']
+                    }
+                }
+            }
+
+            assert state_api.plan(desired, current) == []
+
+        def it_diffs_memberships():
+            desired = {
+                'users': {},
+                'groups': {
+                    'testgroup': {
+                        'members': ['test.user', 'new.user']
+                    }
+                }
+            }
+
+            assert state_api.plan(desired, current) == [
+                Change('update_members', 'testgroup', {
+                    'add': ['new.user'],
+                    'remove': ['old.user']
+                })
+            ]
+
+        def it_allocates_ids_for_new_objects():
+            desired = {
+                'users': {
+                    'jane.doe': {
+                        'name': ['Jane', 'Doe'],
+                        'group': 'newgroup'
+                    },
+                    'john.doe': {
+                        'name': ['John', 'Doe'],
+                        'group': 'testgroup'
+                    }
+                },
+                'groups': {
+                    'newgroup': None
+                }
+            }
+
+            changes = state_api.plan(desired, current)
+
+            assert [(c.action, c.name) for c in changes] == [
+                ('create_group', 'newgroup'),
+                ('create_user', 'jane.doe'),
+                ('create_user', 'john.doe'),
+            ]
+            assert changes[1].detail['uidnumber'] == 10005
+            assert changes[1].detail['gidnumber'] == 10002
+            assert changes[2].detail['uidnumber'] == 10006
+            assert changes[2].detail['gidnumber'] == 10001
+
+        def it_raises_error_on_unknown_primary_group():
+            desired = {
+                'users': {
+                    'jane.doe': {
+                        'name': ['Jane', 'Doe'],
+                        'group': 'nogroup'
+                    }
+                },
+                'groups': {}
+            }
+
+            with pytest.raises(ldap_tools.exceptions.NoGroupsFound):
+                state_api.plan(desired, current)
+
+        def it_prunes_only_when_asked():
+            desired = {'users': {}, 'groups': {}}
+
+            assert state_api.plan(desired, current) == []
+            assert [(c.action, c.name)
+                    for c in state_api.plan(desired, current, prune=True)] == [
+                        ('delete_user', 'test.user'),
+                        ('delete_group', 'testgroup'),
+                    ]
+
+    def describe_apply():
+        def it_applies_each_change():
+            client.modify = MagicMock(return_value=True)
+            client.delete = MagicMock(return_value=True)
+            state_api = StateApi(client)
+
+            failures = state_api.apply([
+                Change('delete_group', 'testgroup',
+                       {'dn': 'cn=testgroup,ou=Group,dc=test,dc=org'}),
+                Change('update_members', 'testgroup', {
+                    'add': ['new.user'],
+                    'remove': []
+                }),
+            ], workers=1)
+
+            assert failures == []
+            client.modify.assert_called_once_with(
+                'cn=testgroup,ou=Group,dc=test,dc=org',
+                {'memberUid': [(ldap3.MODIFY_ADD, ['new.user'])]})
+            client.delete.assert_called_once_with(
+                'cn=testgroup,ou=Group,dc=test,dc=org')
@@ -0,0 +1,73 @@
+import io
+import json
+from unittest.mock import MagicMock
+
+from ldap_tools import trace
+from ldap_tools.client import Client
+from ldap_tools.trace import Tracer
+
+
+def describe_trace():
+    def _traced(func):
+        tracer = trace.enable()
+        try:
+            func()
+        finally:
+            trace.disable()
+        return tracer.events()
+
+    def describe_span():
+        def it_records_nested_spans():
+            def _phases():
+                with trace.span('outer'):
+                    with trace.span('inner', 'ldap', filter='(uid=a)'):
+                        pass
+
+            outer, inner = _traced(_phases)
+
+            assert (outer['name'], inner['name']) == ('outer', 'inner')
+            assert inner['args'] == {'filter': '(uid=a)'}
+            assert outer['ts'] <= inner['ts']
+            assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+        def it_does_nothing_when_disabled():
+            with trace.span('ignored'):
+                pass
+
+            assert trace.active() is None
+
+        def it_traces_decorated_functions():
+            @trace.traced('step')
+            def _step(value):
+                return value * 2
+
+            results = []
+            (event, ) = _traced(lambda: results.append(_step(21)))
+
+            assert results == [42]
+            assert (event['name'], event['cat'], event['ph']) == ('step',
+                                                                  'phase',
+                                                                  'X')
+
+    def describe_tracer():
+        def it_writes_chrome_trace_events():
+            tracer = Tracer(origin=10.0)
+            tracer.complete('import', 'phase', 10.0, 10.25)
+            FILE = io.StringIO()
+
+            tracer.write(FILE)
+
+            (event, ) = json.loads(FILE.getvalue())['traceEvents']
+            assert (event['ts'], event['dur']) == (0.0, 250000.0)
+
+    def describe_client():
+        def it_traces_ldap_operations():
+            client = Client()
+            client.conn = MagicMock()
+            client.basedn = 'dc=test,dc=org'
+            client.conn.entries = []
+
+            (event, ) = _traced(lambda: client.search(['(uid=a)']))
+
+            assert (event['name'], event['cat']) == ('search', 'ldap')
+            assert event['args']['filter'] == '(&(uid=a))'
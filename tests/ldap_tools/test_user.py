@@ -2,14 +2,17 @@ from unittest import mock
 from unittest.mock import MagicMock
 
 import click
+import ldap3
 import pytest
 from click.testing import CliRunner
 from pytest_mock import mocker  # noqa: F401
 
 import ldap_tools.exceptions
+from ldap_tools.bulk import Journal
 from ldap_tools.client import Client
 from ldap_tools.group import API as GroupApi
 from ldap_tools.user import API as UserApi
+from ldap_tools.user import Creation
 from ldap_tools.user import CLI as UserCli
 
 
@@ -123,6 +126,203 @@ def describe_user():  # TODO: change this to use test_key.py format
                 ldap_tools.client.Client.delete.assert_called_once_with(
                     'uid=test.user,ou=People,dc=test,dc=org')
 
+    def describe_offboards_users():
+        def it_plans_with_one_search_per_object_type(entry):
+            offboard_client = Client()
+            offboard_client.search = MagicMock(side_effect=[[
+                entry('uid=a,ou=People,dc=test,dc=org', uid=['a'],
+                      sshPublicKey=[b'ssh-rsa AAAA']),
+                entry('uid=b,ou=People,dc=test,dc=org', uid=['b'],
+                      sshPublicKey=[])
+            ], [
+                entry('cn=ops,ou=Group,dc=test,dc=org',
+                      memberUid=['a', 'b', 'c'])
+            ]])
+
+            operations, missing = UserApi(offboard_client).offboard_plan(
+                ['b', 'a', 'gone', 'a'])
+
+            assert missing == ['gone']
+            assert operations == [
+                ('remove_keys', 'uid=a,ou=People,dc=test,dc=org', []),
+                ('delete', 'uid=a,ou=People,dc=test,dc=org', []),
+                ('delete', 'uid=b,ou=People,dc=test,dc=org', []),
+                ('remove_members', 'cn=ops,ou=Group,dc=test,dc=org',
+                 ['a', 'b']),
+            ]
+            assert offboard_client.search.call_args_list[1][0] == ([
+                '(objectclass=posixGroup)',
+                '(|(memberUid=a)(memberUid=b)(memberUid=gone))'
+            ], ['cn', 'memberUid'])
+
+        def it_only_plans_accounts_of_the_given_type(entry):
+            offboard_client = Client()
+            offboard_client.basedn = 'dc=test,dc=org'
+            offboard_client.service_ou = 'Service'
+            offboard_client.search = MagicMock(side_effect=[[
+                entry('uid=a,ou=People,dc=test,dc=org', uid=['a'],
+                      sshPublicKey=[b'ssh-rsa AAAA']),
+                entry('uid=a,ou=Service,dc=test,dc=org', uid=['a'],
+                      sshPublicKey=[]),
+                entry('uid=b,ou=People,dc=test,dc=org', uid=['b'],
+                      sshPublicKey=[]),
+                entry('uid=c,ou=Service,dc=test,dc=org', uid=['c'],
+                      sshPublicKey=[])
+            ], [
+                entry('cn=ops,ou=Group,dc=test,dc=org',
+                      memberUid=['a', 'b', 'c'])
+            ]])
+
+            operations, missing = UserApi(offboard_client).offboard_plan(
+                ['a', 'b', 'c'], 'service')
+
+            # the People entry of a keeps the memberships of uid a
+            assert missing == ['b']
+            assert operations == [
+                ('delete', 'uid=a,ou=Service,dc=test,dc=org', []),
+                ('delete', 'uid=c,ou=Service,dc=test,dc=org', []),
+                ('remove_members', 'cn=ops,ou=Group,dc=test,dc=org', ['c']),
+            ]
+
+        def it_removes_memberships_before_deleting():
+            offboard_client = Client()
+            calls = []
+            offboard_client.modify = MagicMock(
+                side_effect=lambda dn, changes: calls.append(dn) or True)
+            offboard_client.delete = MagicMock(
+                side_effect=lambda dn: calls.append(dn) or True)
+
+            failures = UserApi(offboard_client).offboard([
+                ('delete', 'uid=a,dc=test,dc=org', []),
+                ('remove_members', 'cn=ops,dc=test,dc=org', ['a']),
+            ], workers=1)
+
+            assert failures == []
+            assert calls == ['cn=ops,dc=test,dc=org', 'uid=a,dc=test,dc=org']
+            offboard_client.modify.assert_called_once_with(
+                'cn=ops,dc=test,dc=org',
+                {'memberUid': [(ldap3.MODIFY_DELETE, ['a'])]})
+
+        def it_purges_from_the_commandline(mocker):  # noqa: F811
+            mocker.patch(
+                'ldap_tools.client.Client.prepare_connection',
+                return_value=None)
+            mocker.patch(
+                'ldap_tools.user.API.offboard_plan',
+                return_value=([('delete', 'uid=test.user', [])], []))
+            mocker.patch('ldap_tools.user.API.offboard', return_value=[])
+
+            result = runner.invoke(
+                ldap_tools.user.CLI.user,
+                ['delete', '--username', username, '--purge'])
+
+            assert result.exit_code == 0
+            ldap_tools.user.API.offboard_plan.assert_called_once_with(
+                [username], 'user')
+            ldap_tools.user.API.offboard.assert_called_once_with(
+                [('delete', 'uid=test.user', [])], workers=1)
+
+    def describe_creates_users_in_batch():
+        def it_plans_with_one_search_per_object_type(entry):
+            batch_client = Client()
+            batch_client.search = MagicMock(side_effect=[[
+                entry(uid='jane.doe', uidNumber=10004),
+                entry(uid='svc', uidNumber=20000)
+            ], [entry(cn='ops', gidNumber=10001)]])
+
+            creations, existing, missing = UserApi(batch_client).create_plan(
+                [('Jane', 'Doe', 'ops'), ('John', 'Doe', 'ops'),
+                 ('Max', 'Roe', 'gone'), ('Ann', 'Lee', 'ops')])
+
+            assert (existing, missing) == (['jane.doe'], ['gone'])
+            assert [(i.username, i.uidnumber, i.gidnumber)
+                    for i in creations] == [('john.doe', 10005, 10001),
+                                            ('ann.lee', 10006, 10001)]
+            assert batch_client.search.call_args_list[1][0] == ([
+                '(objectclass=posixGroup)', '(|(cn=gone)(cn=ops))'
+            ], ['cn', 'gidNumber'])
+
+        def it_does_not_report_journaled_users(mocker, tmpdir):  # noqa: F811
+            mocker.patch(
+                'ldap_tools.client.Client.prepare_connection',
+                return_value=None)
+            mocker.patch(
+                'ldap_tools.user.API.create_plan',
+                return_value=([], ['jane.doe', 'john.doe'], []))
+            filename = tmpdir.join('users.txt')
+            filename.write('Jane Doe ops\nJohn Doe ops\n')
+            tmpdir.join('users.txt.journal').write('jane.doe\n')
+
+            result = runner.invoke(UserCli.user,
+                                   ['create_batch', str(filename), '--resume'])
+
+            assert result.exit_code == 0
+            assert result.output == 'User (john.doe) already exists\n'
+
+        def it_skips_users_in_the_journal(tmpdir):
+            batch_client = Client()
+            batch_client.basedn = 'dc=test,dc=org'
+            batch_client.mail_domain = 'test.org'
+            batch_client.add = MagicMock(return_value=True)
+            journal = Journal(str(tmpdir.join('users.journal')),
+                              lambda creation: creation.username)
+            journal.record(Creation('jane.doe', 'Jane', 'Doe', 'ops', 'user',
+                                    10005, 10001))
+            creations = [
+                Creation(name.lower() + '.doe', name, 'Doe', 'ops', 'user',
+                         uid, 10001)
+                for name, uid in [('Jane', 10005), ('John', 10006)]
+            ]
+
+            failures = UserApi(batch_client).create_batch(
+                creations, workers=1, journal=journal)
+
+            assert failures == []
+            batch_client.add.assert_called_once()
+            assert batch_client.add.call_args[0][0] == (
+                'uid=john.doe,ou=People,dc=test,dc=org')
+            assert 'john.doe' in tmpdir.join('users.journal').read()
+
+    def describe_ensures_users():
+        def it_reads_once_when_users_exist():
+            ensure_client = Client()
+            result = MagicMock()
+            result.uid.value = 'jane.doe'
+            ensure_client.search = MagicMock(return_value=[result])
+            ensure_client.add = MagicMock()
+
+            assert UserApi(ensure_client).ensure([('Jane', 'Doe', 'ops')]) == []
+            ensure_client.search.assert_called_once_with(
+                ['(objectclass=posixAccount)', '(|(uid=jane.doe))'], ['uid'])
+            ensure_client.add.assert_not_called()
+
+        def it_creates_missing_users(mocker):  # noqa: F811
+            creation = Creation('john.doe', 'John', 'Doe', 'ops', 'user',
+                                10005, 10001)
+            mocker.patch(
+                'ldap_tools.user.API.create_plan',
+                return_value=([creation], [], []))
+            mocker.patch('ldap_tools.user.API.create', return_value=True)
+            ensure_client = Client()
+            ensure_client.search = MagicMock(return_value=[])
+
+            assert UserApi(ensure_client).ensure(
+                [('John', 'Doe', 'ops')]) == [creation]
+            ldap_tools.user.API.create_plan.assert_called_once_with(
+                [('John', 'Doe', 'ops')], 'user')
+            ldap_tools.user.API.create.assert_called_once_with(
+                'John', 'Doe', 'ops', 'user', mock.ANY, 10005, 10001)
+
+        def it_raises_on_missing_groups(mocker):  # noqa: F811
+            mocker.patch(
+                'ldap_tools.user.API.create_plan',
+                return_value=([], [], ['gone']))
+            ensure_client = Client()
+            ensure_client.search = MagicMock(return_value=[])
+
+            with pytest.raises(ldap_tools.exceptions.NoGroupsFound):
+                UserApi(ensure_client).ensure([('John', 'Doe', 'gone')])
+
     def describe_indexes_user():
         def describe_commandline():
             def it_calls_the_api(mocker):  # noqa: F811
@@ -133,9 +333,48 @@ def describe_user():  # TODO: change this to use test_key.py format
 
                 runner.invoke(ldap_tools.user.CLI.user, ['index'])
 
-                ldap_tools.user.API.index.assert_called_once_with()
+                ldap_tools.user.API.index.assert_called_once_with(
+                    None, None, 0, None)
+
+            def it_passes_attributes(mocker):  # noqa: F811
+                mocker.patch('ldap_tools.user.API.index', return_value=None)
+                mocker.patch(
+                    'ldap_tools.client.Client.prepare_connection',
+                    return_value=None)
+
+                runner.invoke(ldap_tools.user.CLI.user,
+                              ['index', '-a', 'uid', '-a', 'mail'])
+
+                ldap_tools.user.API.index.assert_called_once_with(
+                    ['uid', 'mail'], None, 0, None)
+
+            def it_passes_window_options(mocker):  # noqa: F811
+                mocker.patch('ldap_tools.user.API.index', return_value=None)
+                mocker.patch(
+                    'ldap_tools.client.Client.prepare_connection',
+                    return_value=None)
+
+                runner.invoke(ldap_tools.user.CLI.user, [
+                    'index', '--sort', '-uid', '--offset', '50', '--limit',
+                    '25'
+                ])
+
+                ldap_tools.user.API.index.assert_called_once_with(
+                    None, '-uid', 50, 25)
 
         def describe_api():
+            def it_windows_sorted_by_uid_by_default(mocker):  # noqa: F811
+                mocker.patch(
+                    'ldap_tools.client.Client.sorted_search',
+                    return_value=None)
+
+                user_api = UserApi(client)
+                user_api.index(offset=50, limit=25)
+
+                ldap_tools.client.Client.sorted_search.assert_called_once_with(
+                    ["(objectclass=posixAccount)"], UserApi.INDEX_ATTRIBUTES,
+                    'uid', 50, 25)
+
             def it_passes_the_correct_filter(mocker):  # noqa: F811
                 mocker.patch(
                     'ldap_tools.client.Client.search', return_value=None)
@@ -147,7 +386,7 @@ def describe_user():  # TODO: change this to use test_key.py format
                 user_api.index()
 
                 ldap_tools.client.Client.search.assert_called_once_with(
-                    ["(objectclass=posixAccount)"])
+                    ["(objectclass=posixAccount)"], UserApi.INDEX_ATTRIBUTES)
 
     def describe_shows_user():
         def describe_commandline():
@@ -160,7 +399,8 @@ def describe_user():  # TODO: change this to use test_key.py format
                 runner.invoke(ldap_tools.user.CLI.user,
                               ['show', '--username', username])
 
-                ldap_tools.user.API.show.assert_called_once_with(username)
+                ldap_tools.user.API.show.assert_called_once_with(
+                    username, None)
 
         def describe_api():
             def it_passes_the_correct_filter(mocker):  # noqa: F811
@@ -177,7 +417,8 @@ def describe_user():  # TODO: change this to use test_key.py format
                     '(objectclass=posixAccount)', "(uid={})".format(username)
                 ]
 
-                ldap_tools.client.Client.search.assert_called_once_with(filter)
+                ldap_tools.client.Client.search.assert_called_once_with(
+                    filter, None)
 
     def describe_finds_user():
         def describe_commandline():
@@ -195,7 +436,7 @@ def describe_user():  # TODO: change this to use test_key.py format
                 user_api.find(username)
 
                 ldap_tools.client.Client.search.assert_called_once_with(
-                    ['(uid={})'.format(username)])
+                    ['(uid={})'.format(username)], ['objectClass'])
 
             def it_finds_two_users(mocker):  # noqa: F811
                 mocker.patch(